@@ -0,0 +1,12 @@
+""" Benchmark suite of rvgeocoder
+
+Measures, for every query mode and loader path, the cold start of a fresh process, the tree build,
+the throughput of batch queries at several batch sizes, the latency of single point queries and the
+peak RSS, on synthetic uniform and clustered coordinates generated locally. Each case runs in its own
+process, so start-up and memory figures are not polluted by the previous cases.
+
+Usage:
+    python -m benchmarks [--quick] [--output results.json] [--compare baseline.json]
+
+The other modules of the package time single features, e.g. python -m benchmarks.aio
+"""
@@ -0,0 +1,175 @@
+""" Runner of the benchmark suite, see benchmarks/__init__.py """
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from benchmarks import data
+
+MODES = (1, 2, 3)
+LOADERS = ('csv', 'files', 'index')
+
+# Report layout version, bumped on any incompatible change of the json output
+REPORT_VERSION = 1
+
+# Metrics compared by --compare, True when higher is better
+METRICS = {
+    'process_cold_start_s': False,
+    'cold_start_s': False,
+    'import_s': False,
+    'load_s': False,
+    'build_s': False,
+    'peak_rss_mb': False,
+    'get_latency.p50_us': False,
+    'get_latency.p99_us': False,
+    'throughput.points_per_sec': True,
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def environment():
+    import numpy
+    import scipy
+    env = {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+           'numpy': numpy.__version__, 'scipy': scipy.__version__}
+    try:
+        env['commit'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                       text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return env
+
+
+def prepare(workdir, locations, seed):
+    """
+    Function that writes the synthetic locations file and its binary index in workdir, unless they exist
+    """
+    import rvgeocoder as rvg
+    os.makedirs(workdir, exist_ok=True)
+    csv_file = data.write_locations(os.path.join(workdir, 'locations_%d.csv' % locations), locations, seed)
+    index = os.path.join(workdir, 'locations_%d.idx' % locations)
+    if not rvg.index.is_index(index):
+        rvg.RGeocoderImpl.from_files([csv_file], mode=1, verbose=False).build_index(index)
+    return csv_file, index
+
+
+def run_case(config):
+    """
+    Function that runs one case in a fresh process
+    Returns:
+        the results of the case, with the cold start measured from the process start (process_cold_start_s)
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-m', 'benchmarks.case', json.dumps(config)], cwd=ROOT, env=env,
+                            stdout=subprocess.PIPE, text=True)
+    process_cold_start = None
+    lines = []
+    for line in proc.stdout:
+        if line.strip() == 'READY':
+            process_cold_start = time.perf_counter() - start
+        else:
+            lines.append(line)
+    if proc.wait() != 0 or not lines:
+        raise RuntimeError('Benchmark case %s failed with exit code %d' % (config, proc.returncode))
+    result = json.loads(lines[-1])
+    result['process_cold_start_s'] = process_cold_start
+    return result
+
+
+def flatten(report):
+    """
+    Function that returns the compared metrics of a report as a dict of (loader, mode, metric) to value
+    """
+    values = {}
+    for case in report['results']:
+        key = (case['loader'], case['mode'])
+        for metric in METRICS:
+            if metric == 'throughput.points_per_sec':
+                for kind, runs in case['throughput'].items():
+                    for run in runs:
+                        values[key + ('%s@%d points/sec' % (kind, run['batch_size']),)] = run['points_per_sec']
+            elif '.' in metric:
+                group, name = metric.split('.')
+                values[key + (metric,)] = case[group][name]
+            else:
+                values[key + (metric,)] = case[metric]
+    return values
+
+
+def compare(baseline, report, threshold=0.1):
+    """
+    Function that prints the change of each metric against a baseline report
+    Returns:
+        the number of metrics worse than the baseline by more than threshold (relative)
+    """
+    before, after = flatten(baseline), flatten(report)
+    regressions = 0
+    for key in sorted(set(before) & set(after), key=str):
+        if not before[key] or after[key] is None:
+            continue
+        change = after[key] / before[key] - 1
+        higher_is_better = 'points/sec' in key[2]
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > threshold:
+            regressions += 1
+            flag = ' REGRESSION'
+        print('%-6s mode %d %-32s %12.4g -> %12.4g %+7.1f%%%s' % (key[0], key[1], key[2], before[key], after[key],
+                                                                 change * 100, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='rvgeocoder benchmark suite')
+    parser.add_argument('--modes', type=int, nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--loaders', nargs='+', default=list(LOADERS), choices=LOADERS)
+    parser.add_argument('--locations', type=int, default=1000000, help='number of synthetic locations')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100, 10000, 1000000])
+    parser.add_argument('--latency-samples', type=int, default=2000, help='number of single point queries')
+    parser.add_argument('--min-time', type=float, default=1.0, help='seconds spent on each batch size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=os.path.join(ROOT, 'benchmarks', 'data'),
+                        help='directory of the generated locations, reused by later runs')
+    parser.add_argument('--quick', action='store_true', help='small data and short runs, to check the suite')
+    parser.add_argument('-o', '--output', help='json file of the results, printed to stdout by default')
+    parser.add_argument('--compare', help='json file of baseline results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change reported as a regression')
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.locations, args.batch_sizes = min(args.locations, 20000), [1, 100, 10000]
+        args.latency_samples, args.min_time = min(args.latency_samples, 300), 0.1
+
+    csv_file, index = prepare(args.workdir, args.locations, args.seed)
+    config = {'csv': csv_file, 'index': index, 'batch_sizes': args.batch_sizes, 'min_points': 100000,
+              'latency_samples': args.latency_samples, 'min_time': args.min_time, 'seed': args.seed}
+    report = {'version': REPORT_VERSION, 'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+              'environment': environment(), 'locations': args.locations,
+              'config': {key: value for key, value in config.items() if key not in ('csv', 'index')},
+              'results': []}
+    for loader in args.loaders:
+        for mode in args.modes:
+            result = run_case(dict(config, loader=loader, mode=mode))
+            print('%-6s mode %d: cold start %.2fs, build %.2fs, get p50 %.0fus p99 %.0fus, peak rss %.0fMB' % (
+                loader, mode, result['process_cold_start_s'], result['build_s'], result['get_latency']['p50_us'],
+                result['get_latency']['p99_us'], result['peak_rss_mb'] or 0), file=sys.stderr)
+            report['results'].append(result)
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as fd:
+            regressions = compare(json.load(fd), report, args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+""" Single point lookups from asyncio code, one query per point against aget micro-batching
+
+Usage:
+    python -m benchmarks.aio
+"""
+import asyncio
+import time
+import numpy as np
+import rvgeocoder as rvg
+from rvgeocoder import aio
+from rvgeocoder.aio import AsyncBatcher
+from benchmarks import data
+
+
+async def clients(rgeo, points, concurrency):
+    # each client issues its lookups one after the other, like the handlers of a web server
+    async def client(chunk):
+        for lat, lon in chunk:
+            await rgeo.aget(lat, lon)
+    await asyncio.gather(*(client(chunk) for chunk in np.array_split(points, concurrency)))
+
+
+def run(rgeo, points, label, executor=None):
+    for concurrency in (1, 10, 100, 1000):
+        rgeo.batcher = AsyncBatcher(rgeo, max_points=256, max_delay_us=500, executor=executor)
+        start = time.time()
+        asyncio.run(clients(rgeo, points, concurrency))
+        t = time.time() - start
+        stats = rgeo.batcher.stats()
+        print('%s aget, %4d clients: %.0f points/sec, mean batch %.1f, queue p99 %.0fus, service p99 %.0fus' % (
+            label, concurrency, len(points) / t, stats['mean_batch_size'], stats['queue_us_p99'],
+            stats['service_us_p99']))
+
+
+def main():
+    source = data.locations_data(100000)
+    points = data.clustered_points(20000).tolist()
+    for mode in (1, 2, 3):
+        with rvg.RGeocoderImpl.from_data(source, mode=mode, verbose=False) as rgeo:
+            start = time.time()
+            for point in points[:2000]:
+                rgeo.query([point])
+            t = (time.time() - start) / 2000
+            print('Mode %d one query per point: %.0f points/sec' % (mode, 1 / t))
+            run(rgeo, points, 'Mode %d' % mode)
+    with rvg.RGeocoderImpl.from_data(source, mode=1, verbose=False) as rgeo, aio.process_pool(rgeo) as executor:
+        run(rgeo, points, 'Mode 1 process pool')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+""" One benchmark case, run in a fresh process by benchmarks.__main__
+
+The case configuration is given as a json argument, the results are printed as json on the last line
+of the output. A READY line is printed once the first query is answered, so the parent process can
+time the cold start including the interpreter start-up.
+"""
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb(who='self'):
+    """
+    Function that returns the peak resident set size of this process (or the largest of its waited for
+    children) in MB, None where getrusage is not available
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage.ru_maxrss / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0)
+
+
+def load_geocoder(rvg, config):
+    kwargs = {'mode': config['mode'], 'verbose': False}
+    if config['loader'] == 'csv':
+        with open(config['csv'], 'rt') as fd:
+            return rvg.RGeocoderImpl(stream=fd, **kwargs)
+    if config['loader'] == 'files':
+        return rvg.RGeocoderImpl.from_files([config['csv']], **kwargs)
+    if config['loader'] == 'index':
+        return rvg.RGeocoderImpl.from_index(config['index'], **kwargs)
+    raise ValueError('Unknown loader %s' % config['loader'])
+
+
+def throughput(query, points, batch_size, min_time):
+    """
+    Function that times the queries of batches of batch_size points until min_time is spent
+    Returns:
+        dict with the best time per batch and the matching points per second
+    """
+    best, spent, rounds, start = float('inf'), 0.0, 0, 0
+    while spent < min_time or rounds < 3:
+        batch = points[start:start + batch_size]
+        if len(batch) < batch_size:
+            start, batch = 0, points[:batch_size]
+        t = time.perf_counter()
+        query(batch)
+        elapsed = time.perf_counter() - t
+        best = min(best, elapsed)
+        spent += elapsed
+        rounds += 1
+        start += batch_size
+    return {'batch_size': batch_size, 'rounds': rounds, 'batch_ms': best * 1e3, 'points_per_sec': batch_size / best}
+
+
+def latency(query, points):
+    """
+    Function that times single point queries, one by one
+    Returns:
+        dict of the p50/p99/mean latencies in microseconds
+    """
+    import numpy as np
+    for point in points[:100]:
+        query(point)
+    timings = np.empty(len(points))
+    for n, point in enumerate(points):
+        t = time.perf_counter_ns()
+        query(point)
+        timings[n] = time.perf_counter_ns() - t
+    timings /= 1e3
+    return {'samples': len(points), 'p50_us': float(np.percentile(timings, 50)),
+            'p99_us': float(np.percentile(timings, 99)), 'mean_us': float(timings.mean())}
+
+
+def run(config):
+    result = {'loader': config['loader'], 'mode': config['mode']}
+    start = time.perf_counter()
+    import rvgeocoder as rvg
+    result['import_s'] = time.perf_counter() - start
+
+    t = time.perf_counter()
+    rgeo = load_geocoder(rvg, config)
+    result['load_s'] = time.perf_counter() - t
+    result['load_rss_mb'] = peak_rss_mb()
+
+    # the tree is built lazily, start() also starts the pool of mode 2
+    t = time.perf_counter()
+    rgeo.tree
+    rgeo.start()
+    result['build_s'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    rgeo.query([(0.0, 0.0)])
+    result['first_query_s'] = time.perf_counter() - t
+    result['cold_start_s'] = time.perf_counter() - start
+    print('READY', flush=True)
+
+    from benchmarks import data
+    largest = max(config['batch_sizes'])
+    result['throughput'] = {}
+    for kind, generate in sorted(data.POINTS.items()):
+        points = generate(max(largest, config['min_points']), config['seed'])
+        result['throughput'][kind] = [throughput(rgeo.query_array, points, batch_size, config['min_time'])
+                                      for batch_size in config['batch_sizes']]
+
+    # the path of rvgeocoder.get, one coordinate tuple per query
+    points = [tuple(point) for point in data.uniform_points(config['latency_samples'], config['seed'] + 10).tolist()]
+    result['get_latency'] = latency(lambda point: rgeo.query([point])[0], points)
+
+    rgeo.close()
+    result['peak_rss_mb'] = peak_rss_mb()
+    result['peak_child_rss_mb'] = peak_rss_mb('children')
+    return result
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(json.loads(sys.argv[1]))))
@@ -0,0 +1,82 @@
+""" Synthetic data of the benchmarks
+
+Locations and query points are generated from a seed, so two runs (or two releases) benchmark the same data.
+Clustered points mimic real traffic: most of the points around a few hot spots, the rest spread out.
+"""
+import csv
+import io
+import os
+import numpy as np
+
+# Latitude range of the generated points, the poles hold no locations
+LAT_RANGE = (-60.0, 75.0)
+LON_RANGE = (-180.0, 180.0)
+
+
+def uniform_points(n, seed=0):
+    """
+    Function that returns n points spread uniformly over LAT_RANGE/LON_RANGE as a (n, 2) float64 array
+    """
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(*LAT_RANGE, n), rng.uniform(*LON_RANGE, n)])
+
+
+def clustered_points(n, seed=0, clusters=50, spread=0.5, background=0.1):
+    """
+    Function that returns n points around a few centers as a (n, 2) float64 array
+    Args:
+    n (int): number of points
+    clusters (int): number of centers
+    spread (float): standard deviation around the centers, in degrees
+    background (float): fraction of the points spread uniformly
+    """
+    rng = np.random.default_rng(seed)
+    centers = uniform_points(clusters, seed + 1)
+    weights = rng.pareto(1.0, clusters) + 1
+    n_background = int(n * background)
+    picked = rng.choice(clusters, n - n_background, p=weights / weights.sum())
+    points = centers[picked] + rng.normal(0, spread, (len(picked), 2))
+    points = np.concatenate([points, uniform_points(n_background, seed + 2)])
+    points[:, 0] = np.clip(points[:, 0], -90, 90)
+    points[:, 1] = (points[:, 1] + 180) % 360 - 180
+    return points[rng.permutation(n)]
+
+
+POINTS = {
+    'uniform': uniform_points,
+    'clustered': clustered_points,
+}
+
+
+def write_locations(filename, n, seed=0):
+    """
+    Function that writes n synthetic locations with the columns of rg_cities1000.csv, clustered like
+    real cities, unless the file exists
+    """
+    if os.path.exists(filename):
+        return filename
+    with open(filename, 'w', newline='') as fd:
+        _write_rows(fd, n, seed)
+    return filename
+
+
+def locations_data(n, seed=0):
+    """
+    Function that returns the csv text of the locations of write_locations, for RGeocoderImpl.from_data
+    """
+    data = io.StringIO()
+    _write_rows(data, n, seed)
+    return data.getvalue()
+
+
+def _write_rows(fd, n, seed):
+    import rvgeocoder as rvg
+    points = clustered_points(n, seed, clusters=2000, spread=1.0, background=0.3)
+    rng = np.random.default_rng(seed)
+    population = (rng.pareto(1.2, n) * 1000).astype(np.int64)
+    writer = csv.writer(fd)
+    writer.writerow(rvg.RG_COLUMNS + rvg.RG_EXTRA_COLUMNS)
+    writer.writerows(('%.5f' % lat, '%.5f' % lon, 'Place %d' % i, 'Admin1 %d' % (i % 3000),
+                      'Admin2 %d' % (i % 40000), 'C%d' % (i % 250), population[i],
+                      'PPLA' if population[i] > 1000000 else 'PPL')
+                     for i, (lat, lon) in enumerate(points.tolist()))
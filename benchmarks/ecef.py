@@ -0,0 +1,28 @@
+""" Queries of the geodesically correct ECEF tree against the degree-space lat/lon tree, in every mode
+
+Usage:
+    python -m benchmarks.ecef
+"""
+import time
+import rvgeocoder as rvg
+from benchmarks import data
+
+
+def main():
+    source = data.locations_data(1000000)
+    points = data.clustered_points(1000000)
+    num = 3
+    for mode in (1, 2, 3):
+        for ecef in (False, True):
+            with rvg.RGeocoderImpl.from_data(source, mode=mode, ecef=ecef, verbose=False) as rgeo:
+                rgeo.query_array(points[:10])
+                start = time.time()
+                for _ in range(num):
+                    rgeo.query_array(points, return_distance=True)
+                t = (time.time() - start) / num
+            print('Mode %d %-7s tree: %.2f secs (%.0f points/sec)' % (mode, 'ECEF' if ecef else 'lat/lon', t,
+                                                                      len(points) / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+""" Queries of a GeocoderHandle with growing deltas of added and removed locations, and their compaction
+
+Usage:
+    python -m benchmarks.handle
+"""
+import time
+import numpy as np
+import rvgeocoder as rvg
+from rvgeocoder import handle as rg_handle
+from rvgeocoder.handle import GeocoderHandle
+from benchmarks import data
+
+
+def new_rows(n):
+    return [{'lat': '%.5f' % lat, 'lon': '%.5f' % lon, 'name': 'New %d' % i, 'cc': 'XX'}
+            for i, (lat, lon) in enumerate(data.uniform_points(n, seed=n).tolist())]
+
+
+def main():
+    points = data.clustered_points(100000)
+    with GeocoderHandle(rvg.RGeocoderImpl.from_data(data.locations_data(1000000), mode=3, verbose=False),
+                        auto_compact=False) as handle:
+        rg_handle.warm_up(handle.geocoder)
+        for delta in (0, 100, 1000, 10000):
+            if delta:
+                handle.add(new_rows(delta - len(handle._snapshot.delta)))
+                handle.remove(np.arange(0, delta * 10, 10))
+            start = time.time()
+            handle.query_array(points)
+            t = time.time() - start
+            print('delta %5d added / %5d removed: %.0f points/sec' % (delta, delta, len(points) / t))
+        start = time.time()
+        handle.compact().result()
+        print('compaction: %.2fs' % (time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
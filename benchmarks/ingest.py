@@ -0,0 +1,49 @@
+""" Load of a locations file through csv.DictReader (the previous ingest path) against the columnar LocationStore
+
+Usage:
+    python -m benchmarks.ingest
+"""
+import csv
+import os
+import tempfile
+import time
+import numpy as np
+import rvgeocoder as rvg
+from benchmarks import data
+
+
+def dictreader_load(filename):
+    # the previous ingest path: a dict per row, string tuples converted by numpy afterwards
+    coordinates, locations = [], []
+    with open(filename, 'rt') as fd:
+        for row in csv.DictReader(fd):
+            coordinates.append((row['lat'], row['lon']))
+            locations.append(row)
+    return np.array(coordinates, dtype=np.float64), locations
+
+
+def columnar_load(filename):
+    with open(filename, 'rt', newline='') as fd:
+        rows = csv.reader(fd)
+        locations = rvg.LocationStore.from_rows(next(rows), rows)
+    return locations.coords, locations
+
+
+def main():
+    # 2M rows rather than 10M: the 10M dicts of the DictReader path take more than 5GB of memory
+    with tempfile.TemporaryDirectory() as path:
+        files = [data.write_locations(os.path.join(path, 'locations_2000000.csv'), 2000000)]
+        if os.path.exists(rvg.rel_path(rvg.RG_FILE)):
+            files.insert(0, rvg.rel_path(rvg.RG_FILE))
+        for filename in files:
+            for name, load in (('DictReader', dictreader_load), ('columnar', columnar_load)):
+                start = time.time()
+                coords, locations = load(filename)
+                t = time.time() - start
+                print('%-40s %-10s %d locations loaded in %.2f secs' % (os.path.basename(filename), name,
+                                                                        len(coords), t))
+                del coords, locations
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+""" Overhead of QueryMetrics on queries of several batch sizes, and the median duration of each stage
+
+Usage:
+    python -m benchmarks.metrics
+"""
+import time
+import rvgeocoder as rvg
+from rvgeocoder.metrics import QueryMetrics
+from benchmarks import data
+
+
+def main():
+    source = data.locations_data(1000000)
+    points = data.clustered_points(100000)
+    for mode in (1, 2, 3):
+        with rvg.RGeocoderImpl.from_data(source, mode=mode, verbose=False) as rgeo:
+            rgeo.query_array(points)
+            for batch_size in (1, 1000, 100000):
+                num = max(1, 100000 // batch_size)
+                times = []
+                for metrics in (None, QueryMetrics()):
+                    rgeo.metrics = metrics
+                    start = time.time()
+                    for _ in range(num):
+                        rgeo.query(points[:batch_size])
+                    times.append((time.time() - start) / num)
+                print('Mode %d batch %6d: %.1fus disabled, %.1fus enabled' % (mode, batch_size, times[0] * 1e6,
+                                                                            times[1] * 1e6))
+            print({name: round(value, 1) for name, value in rgeo.metrics.stats().items()
+                   if name.endswith('_us_p50')})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+""" Pickling of geocoders and their lookups in fork and spawn pools
+
+Usage:
+    python -m benchmarks.pickling
+"""
+import multiprocessing as mp
+import os
+import pickle
+import time
+import rvgeocoder as rvg
+from benchmarks import data
+
+
+def lookup(args):
+    rgeo, points = args
+    return os.getpid(), id(rgeo), rgeo.query_array(points)['index']
+
+
+def main():
+    points = data.uniform_points(10000)
+    source = data.locations_data(150000)
+    for mode in (1, 2, 3):
+        rgeo = rvg.RGeocoderImpl.from_data(source, mode=mode, verbose=False)
+        start = time.time()
+        pickled = pickle.dumps(rgeo)
+        print('Mode %d pickled in %.3f secs (%d bytes)' % (mode, time.time() - start, len(pickled)))
+        for method in ('fork', 'spawn'):
+            start = time.time()
+            with mp.get_context(method).Pool(4) as pool:
+                results = pool.map(lookup, [(rgeo, points)] * 32)
+            instances = {}
+            for pid, instance, _ in results:
+                instances.setdefault(pid, set()).add(instance)
+            print('Mode %d %-5s: %d tasks in %.2f secs, %d processes, %d instances per process' % (
+                mode, method, len(results), time.time() - start, len(instances),
+                max(map(len, instances.values()))))
+        rgeo.close()
+
+
+if __name__ == '__main__':
+    main()
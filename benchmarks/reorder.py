@@ -0,0 +1,30 @@
+""" Queries of uniform and clustered batches with and without Morton reordering and deduplication, in modes 2 and 3
+
+Usage:
+    python -m benchmarks.reorder
+"""
+import time
+import numpy as np
+import rvgeocoder as rvg
+from benchmarks import data
+
+
+def main():
+    options = [('plain', {}), ('reorder', {'reorder': True}), ('reorder+dedupe', {'dedupe': True})]
+    source = data.locations_data(1000000)
+    for n in (1000000, 10000000):
+        # clustered points rounded to 4 decimals, like GPS traffic where many points repeat
+        clustered = np.round(data.clustered_points(n), 4)
+        for kind, points in (('uniform', data.uniform_points(n)), ('clustered', clustered)):
+            for mode in (2, 3):
+                for name, kwargs in options:
+                    with rvg.RGeocoderImpl.from_data(source, mode=mode, verbose=False, **kwargs) as rgeo:
+                        rgeo.query_array(points[:1000])
+                        start = time.time()
+                        rgeo.query_array(points)
+                        t = time.time() - start
+                    print('%9d %-9s mode %d %-15s %6.2f secs (%.0f points/sec)' % (n, kind, mode, name, t, n / t))
+
+
+if __name__ == '__main__':
+    main()
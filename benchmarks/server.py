@@ -0,0 +1,38 @@
+""" Batch queries through the Unix socket server against in-process queries
+
+Usage:
+    python -m benchmarks.server
+"""
+import os
+import tempfile
+import threading
+import time
+import rvgeocoder as rvg
+from rvgeocoder.server import GeocoderServer, RGeocoderClient
+from benchmarks import data
+
+
+def main():
+    points = data.clustered_points(1000000)
+    with tempfile.TemporaryDirectory() as path, \
+            rvg.RGeocoderImpl.from_data(data.locations_data(1000000), mode=3, verbose=False) as rgeo:
+        server = GeocoderServer(rgeo, os.path.join(path, 'rvg.sock'))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            with RGeocoderClient(server.path) as client:
+                for batch_size in (1, 100, 10000, 1000000):
+                    for name, query in (('in-process', rgeo.query_array), ('client', client.query_array)):
+                        num = max(1, 100000 // batch_size)
+                        start = time.time()
+                        for _ in range(num):
+                            query(points[:batch_size], columns=['name', 'cc'])
+                        t = (time.time() - start) / num
+                        print('%-10s batch %7d: %.2f ms (%.0f points/sec)' % (name, batch_size, t * 1e3,
+                                                                            batch_size / t))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+""" Sharded indexes of several tile sizes and resident shard limits against a single index
+
+Usage:
+    python -m benchmarks.shards
+"""
+import os
+import tempfile
+import time
+import rvgeocoder as rvg
+from benchmarks import data
+
+
+def main():
+    points = data.clustered_points(100000)
+    with tempfile.TemporaryDirectory() as path:
+        rgeo = rvg.RGeocoderImpl.from_data(data.locations_data(500000), mode=3, verbose=False)
+        rgeo.build_index(os.path.join(path, 'index'))
+        for tile_size in (5, 10, 30):
+            rgeo.build_index(os.path.join(path, 'shards%d' % tile_size), tile_size=tile_size)
+        for name in ('index', 'shards5', 'shards10', 'shards30'):
+            for max_shards in ((16, 64) if name != 'index' else (0,)):
+                start = time.time()
+                sharded = rvg.RGeocoderImpl.from_index(os.path.join(path, name), mode=3, max_shards=max_shards,
+                                                       verbose=False)
+                sharded.query_array(points[:1])
+                t_first = time.time() - start
+                start = time.time()
+                sharded.query_array(points)
+                t = time.time() - start
+                print('%-8s max_shards %4d: first query %.3fs, %.0f points/sec' % (name, max_shards, t_first,
+                                                                                   len(points) / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+""" Streaming of a large coordinates file in chunks against loading it in a list and querying it at once
+
+Usage:
+    python -m benchmarks.stream
+"""
+import csv
+import os
+import tempfile
+import time
+import numpy as np
+import rvgeocoder as rvg
+from benchmarks import data
+
+
+def main():
+    points = data.clustered_points(5000000)
+    with tempfile.TemporaryDirectory() as path, \
+            rvg.RGeocoderImpl.from_data(data.locations_data(1000000), mode=3, verbose=False) as rgeo:
+        filename = os.path.join(path, 'coordinates.tsv')
+        np.savetxt(filename, points, fmt='%.6f', delimiter='\t')
+        rgeo.query_array(points[:1000])
+
+        start = time.time()
+        with open(filename, 'rt', newline='') as fd:
+            coordinates = [(row[0], row[1]) for row in csv.reader(fd, delimiter='\t')]
+        rgeo.query_array(np.asarray(coordinates, dtype=np.float64), columns=['cc'])
+        t = time.time() - start
+        print('list load and query: %.2f secs (%.0f points/sec)' % (t, len(points) / t))
+        del coordinates
+
+        for chunk_size in (10000, 100000, 1000000):
+            start = time.time()
+            count = sum(len(result['index']) for result in rgeo.search_stream(filename, delimiter='\t',
+                                                                              chunk_size=chunk_size, columns=['cc']))
+            t = time.time() - start
+            print('streaming, chunks of %7d: %.2f secs (%.0f points/sec)' % (chunk_size, t, count / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+""" Population-weighted queries for several numbers of candidates against the plain nearest location query
+
+Usage:
+    python -m benchmarks.weighted
+"""
+import time
+import rvgeocoder as rvg
+from benchmarks import data
+
+
+def run(query, points, num=3):
+    query(points[:1000])
+    start = time.time()
+    for _ in range(num):
+        query(points)
+    return (time.time() - start) / num
+
+
+def main():
+    source = data.locations_data(200000)
+    points = data.uniform_points(1000000)
+    for mode in (1, 2, 3):
+        with rvg.RGeocoderImpl.from_data(source, mode=mode, verbose=False) as rgeo:
+            base = run(rgeo.query_array, points)
+            print('Mode %d nearest:          %.2f secs (%.0f points/sec)' % (mode, base, len(points) / base))
+            for k in (5, 10):
+                t = run(lambda p: rgeo.query_weighted(p, k=k, feature_weights={'PPLA': 1.5}), points)
+                print('Mode %d weighted (k=%2d): %.2f secs (%.0f points/sec) %.1fx nearest' % (
+                    mode, k, t, len(points) / t, t / base))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,16 +6,26 @@ called reverse_geocode developed by Richard Penman & reverse_geocoder by Ajay Th
 from __future__ import print_function
 
 import os
-import sys
 import csv
-csv.field_size_limit(sys.maxsize)
-import zipfile
-from scipy.spatial import cKDTree as KDTree
-from rvgeocoder import cKDTree_MP as KDTree_MP
-import numpy as np
 import io
-from shapely import wkt
-from shapely.geometry import Point
+import itertools
+import logging
+import threading
+import time
+import uuid
+import weakref
+import numpy as np
+from rvgeocoder import _fork
+from rvgeocoder.locations import (COORD_COLUMNS, ROWS_CHUNK_SIZE, LocationStore, LocationStoreBuilder,
+                                  large_csv_fields, parse_coordinates)
+from rvgeocoder import index as rg_index
+from rvgeocoder import shards as rg_shards
+from rvgeocoder import stream as rg_stream
+from rvgeocoder.cache import QueryCache
+from rvgeocoder.ordering import spatial_batch
+# scipy, the multi-process tree and shapely are imported on first use, importing the package stays cheap
+
+logger = logging.getLogger(__name__)
 
 
 GN_URL = 'http://download.geonames.org/export/dump/'
@@ -64,30 +74,110 @@ RG_COLUMNS = [
     'cc'
 ]
 
+# Columns kept after RG_COLUMNS in the cities file, used by query_weighted to rank candidates
+RG_EXTRA_COLUMNS = [
+    'population',
+    'feature_code'
+]
+
 # Name of cities file created by this library
 RG_FILE = 'rg_cities1000.csv'
 
+# Name of the binary index of the cities file, used instead of RG_FILE when it exists
+RG_INDEX = 'rg_cities1000.idx'
+
 # WGS-84 major axis in kms
 A = 6378.137
 
 # WGS-84 eccentricity squared
 E2 = 0.00669437999014
 
+# Mean radius of the earth in kms, used to convert chord distances between ECEF coordinates to arc distances
+R_MEAN = 6371.0088
+
 
-def singleton(cls):
+class GeocoderRegistry:
     """
-    Function to get single instance of the RGeocoder class
+    Per process registry of geocoders. The data is loaded and the tree built once per process for each
+    data source and options, whatever the number of lookups (or of unpickled copies of a geocoder)
     """
-    instances = {}
+    # options that do not change the geocoder
+    IGNORED_OPTIONS = ('verbose',)
+
+    def __init__(self):
+        self._instances = {}
+        # geocoders owned by the application, registered while they are alive
+        self._borrowed = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        _fork.register(self)
+
+    def __len__(self):
+        return len(self._instances)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key, factory):
+        """
+        Function that returns the geocoder registered with key, created by factory if there is none yet
+        """
+        with self._lock:
+            rgeo = self._instances.get(key) or self._borrowed.get(key)
+            if rgeo is None:
+                rgeo = self._instances[key] = factory()
+        return rgeo
 
-    def getinstance(**kwargs):
+    def register(self, key, rgeo):
         """
-        Creates a new RGeocoder instance if not created already
+        Function that registers an existing geocoder with key as long as it is alive, unless a geocoder
+        already is. Returns the registered geocoder
         """
-        if cls not in instances:
-            instances[cls] = cls(**kwargs)
-        return instances[cls]
-    return getinstance
+        with self._lock:
+            registered = self._instances.get(key) or self._borrowed.get(key)
+            if registered is None:
+                registered = self._borrowed[key] = rgeo
+        return registered
+
+    def get(self, cls, **kwargs):
+        """
+        Function that returns the instance of cls created with the same data source and options in this process
+        """
+        key = (cls, _registry_key({name: value for name, value in kwargs.items()
+                                   if name not in self.IGNORED_OPTIONS}))
+        return self.get_or_create(key, lambda: cls(**kwargs))
+
+    def clear(self):
+        """
+        Function that closes and forgets all the registered geocoders
+        """
+        with self._lock:
+            instances = list(self._instances.values())
+            self._instances.clear()
+            self._borrowed.clear()
+        for rgeo in instances:
+            rgeo.close()
+
+
+def _registry_key(kwargs):
+    return tuple(sorted((name, _freeze(value)) for name, value in kwargs.items()))
+
+
+def _freeze(value):
+    """
+    Function that converts an option to a hashable key. In-memory streams are keyed on their content,
+    so a stream rebuilt from the same data on every call finds the same geocoder
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return _registry_key(value)
+    if isinstance(value, (io.StringIO, io.BytesIO)):
+        return ('stream', hash(value.getvalue()))
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return ('id', id(value))
 
 
 class RGeocoderDataLoader:
@@ -116,52 +206,84 @@ class RGeocoderDataLoader:
         return data_stream
 
     @staticmethod
-    def _merge_locations(location_files, currect_locations=None):
-        common_header = None
+    @large_csv_fields()
+    def _append_location_files(builder, location_files, polygons=None, skip_invalid=False,
+                               chunk_size=ROWS_CHUNK_SIZE):
+        """
+        Function that streams location files into a LocationStoreBuilder in chunks, all the files must
+        have the same header. When polygons are given, the points inside of them are dropped
+        Returns:
+            the builder, created from the header of the first file when builder is None
+        """
+        removed = 0
+
+        def chunk_filter(rows):
+            nonlocal removed
+            rows, n_removed = RGeocoderDataLoader._remove_polygons_points(rows, builder.fieldnames, polygons)
+            removed += n_removed
+            return rows
 
-        if not currect_locations:
-            currect_locations = []
         for loc in location_files:
-            with open(loc, 'r') as fd:
-                loc_reader = csv.DictReader(fd)
-                file_header = loc_reader.fieldnames
-                if common_header is None:
-                    common_header = file_header
-                elif common_header != file_header:
+            with open(loc, 'r', newline='') as fd:
+                loc_reader = csv.reader(fd)
+                file_header = next(loc_reader, None)
+                if builder is None:
+                    builder = LocationStoreBuilder(file_header, skip_invalid)
+                elif builder.fieldnames != file_header:
                     raise Exception('File %s has different header than common. Expected header = %s, found = %s' % (
-                        loc, common_header, file_header))
-                currect_locations.extend(list(loc_reader))
-        return currect_locations, common_header
+                        loc, builder.fieldnames, file_header))
+                # line numbers of malformed rows are reported per file
+                builder.line = 2
+                try:
+                    builder.append_rows(loc_reader, chunk_size, chunk_filter if polygons is not None else None)
+                except ValueError as err:
+                    raise ValueError('File %s: %s' % (loc, err)) from err
+        if polygons is not None:
+            logger.info('total %s points were removed because found inside patched polygons', removed)
+        return builder
 
     @staticmethod
-    def _remove_polygons_points(locations, polygons_file):
-        if not polygons_file:
-            return locations
-
-        removed_count = 0
-        filtered_locations = []
-        polygons = []
-
-        with open(polygons_file, 'r') as fd:
-            # get polygons information
-            poly_reader = csv.DictReader(fd)
-            for row in poly_reader:
-                polygons.append((row.get('name', 'unnamed-polygon'),wkt.loads(row['geometry'])))
-
-            # iterate over polygons and remove all points inside of them - avoid collision between sets
-            for loc in locations:
-                p = Point(float(loc['lon']), float(loc['lat']))
-                found = False
-                for name, poly in polygons:
-                    if poly.contains(p):
-                        found = True
-                        removed_count += 1
-                        print('Removing %s (%s,%s) inside polygon %s' % (
-                            loc.get('name', 'unnamed-point'), loc['lat'], loc['lon'], name))
-                if not found:
-                    filtered_locations.append(loc)
-            print('total %s points were removed because found inside patched polygons' % removed_count)
-        return filtered_locations
+    def _remove_polygons_points(rows, fieldnames, polygons):
+        """
+        Function that removes the rows of a chunk whose point is inside of one of the polygons
+        Returns:
+            the rows where the removed ones are replaced by blank rows (skipped by the builder, so the
+            line numbers of the others are kept) and the number of removed rows
+        """
+        lat_col, lon_col = (fieldnames.index(name) for name in COORD_COLUMNS)
+        coords, _ = parse_coordinates([row[lat_col] if len(row) > lat_col else '' for row in rows],
+                                      [row[lon_col] if len(row) > lon_col else '' for row in rows])
+        # malformed coordinates are NaN, never inside a polygon, and reported by the builder
+        inside = polygons.locate(coords[:, 0], coords[:, 1])
+        removed = np.flatnonzero(inside >= 0)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            name_col = fieldnames.index('name') if 'name' in fieldnames else None
+            for n in removed:
+                row = rows[n]
+                logger.debug('Removing %s (%s,%s) inside polygon %s',
+                             row[name_col] if name_col is not None else 'unnamed-point',
+                             row[lat_col], row[lon_col], polygons.names[inside[n]])
+        for n in removed:
+            rows[n] = []
+        return rows, len(removed)
+
+    @classmethod
+    def load_files_locations(cls, location_files: list, patch_poly_file: str = None, skip_invalid: bool = False):
+        """ Loading location files directly into a compact LocationStore, the files are streamed in
+        chunks so the memory used is proportional to the resulting store only.
+        Arguments:
+            location_files {list} -- csv filenames with the same header, including lat/lon columns
+            patch_poly_file {str} -- OPTIONAL. csv file of polygons, the points inside of them are removed
+            skip_invalid {bool} -- skip rows with malformed or out of range coordinates instead of raising
+        Returns:
+            [LocationStore]
+        """
+        polygons = _load_polygons(patch_poly_file)
+        builder = cls._append_location_files(None, location_files, polygons, skip_invalid)
+        if builder is None:
+            raise ValueError('No location files were given')
+        return builder.build()
 
     @classmethod
     def create_patch_locations(cls, location_files: list, patch_loc_file: str,
@@ -169,8 +291,8 @@ class RGeocoderDataLoader:
         """ This method recieve a list of location files and two other files describing the patch
         polygon and The points that should represent this polygon in the Spatial index
 
-        REMARK: this can be done much more effiecint and easy using pandas, decided not to use this
-        in order to reduce requirements size.
+        The files are streamed in chunks into a compact LocationStore and the output is written from it
+        in chunks, so files of tens of millions of rows can be patched without holding them as dicts.
         Arguments:
             location_files {list} -- a csv filename with any schema starting with lat/lon, default is:
                                      lat,lon,name,admin1,admin2,cc
@@ -180,61 +302,340 @@ class RGeocoderDataLoader:
             location and remove all records within these polygon to avoid collision between patch and original 
             location files. schema of file: {cc/name/admin1/admin2}..,geometry(wkt format)
         Returns:
-            list of records containing the result of the patched location files
+            LocationStore of the patched locations, a sequence of records (dicts)
         """
-
-        locations, columns_name = cls._merge_locations(location_files)
-        filtered_locations = cls._remove_polygons_points(locations, patch_poly_file)
-        new_patched_locations, columns_name = cls._merge_locations([patch_loc_file], filtered_locations)
+        polygons = _load_polygons(patch_poly_file)
+        builder = cls._append_location_files(None, location_files, polygons)
+        builder = cls._append_location_files(builder, [patch_loc_file])
+        locations = builder.build()
 
         if output_file:
-            with open(output_file, 'w') as fd:
-                writer = csv.DictWriter(fd, fieldnames=columns_name)
-                writer.writeheader()
-                writer.writerows(new_patched_locations)
+            with open(output_file, 'w', newline='') as fd:
+                writer = csv.writer(fd)
+                writer.writerow(locations.fieldnames)
+                writer.writerows(locations.iter_rows())
 
-        return new_patched_locations
+        return locations
 
 
 class RGeocoderImpl:
     """
     The main reverse geocoder class
     """
-    def __init__(self, mode=2, verbose=True, stream=None, stream_columns=None):
+    def __init__(self, mode=2, verbose=True, stream=None, stream_columns=None, workers=-1, index=None,
+                 ecef=False, cache_size=0, cache_precision=4, reorder=False, dedupe=False, polygons_file=None,
+                 locations=None, skip_invalid=False, prebuild=False, max_shards=rg_shards.DEFAULT_MAX_RESIDENT):
         """ Class Instantiation
         Args:`
-        mode (int): Library supports the following two modes:
+        mode (int): Library supports the following three modes:
                     - 1 = Single-threaded K-D Tree
-                    - 2 = Multi-threaded K-D Tree (Default)
+                    - 2 = Multi-process K-D Tree (Default)
+                    - 3 = Multi-threaded K-D Tree, queries a single in-process tree with scipy's workers
         verbose (bool): For verbose output, set to True
         stream (io.StringIO): An in-memory stream of a custom data source
+        workers (int): Number of threads used by mode 3, -1 uses all the CPUs
+        index (str): Path of a binary index created by build_index, loaded memory mapped. Sharded indexes
+                     (build_index with tile_size) are queried in-process, mode 2 runs as mode 3
+        ecef (bool): Build the tree on earth-centered (ECEF) coordinates instead of raw lat/lon, so that
+                     neighbours are geodesically correct (high latitudes, antimeridian) and query_dist
+                     returns distances in kms
+        cache_size (int): Number of results kept in a LRU cache in front of the tree, 0 disables the cache
+        cache_precision (int): Number of decimals the coordinates are rounded to for the cache keys
+        reorder (bool): Sort each batch along a Morton curve before querying the tree, for better cache
+                        locality on randomly ordered input. Results are returned in the original order
+        dedupe (bool): Query each distinct coordinate of a batch once (implies reorder)
+        polygons_file (str): OPTIONAL. csv file of polygons, schema: {cc/name/admin1/admin2}..,geometry(wkt format).
+                             Coordinates inside a polygon get the attributes of the polygon, the others
+                             the attributes of the nearest location
+        locations (LocationStore): OPTIONAL. Locations already loaded, e.g. by RGeocoderDataLoader.load_files_locations
+        skip_invalid (bool): Skip (and log) locations with malformed or out of range coordinates when loading
+                             a csv source, instead of raising ValueError with their line numbers
+        prebuild (bool): Build the K-D tree in a background thread right away, instead of on the first query.
+                         A query issued before the tree is ready waits for it
+        max_shards (int): Maximal number of shards of a sharded index kept loaded, the least recently
+                          used are evicted
         """
         self.mode = mode
         self.verbose = verbose
-        if stream:
+        # QueryMetrics recording the stages of the queries, see the metrics property
+        self._metrics = None
+        self.workers = workers
+        self.ecef = ecef
+        self.cache = QueryCache(cache_size, cache_precision) if cache_size else None
+        self.reorder = reorder
+        self.dedupe = dedupe
+        self.polygons = _load_polygons(polygons_file)
+        self.skip_invalid = skip_invalid
+        self._weights = None
+        # AsyncBatcher of aget, created on first use
+        self.batcher = None
+        # options and identity of the data carried by pickles, see __reduce__
+        self._options = {'mode': mode, 'verbose': verbose, 'workers': workers, 'ecef': ecef,
+                         'cache_size': cache_size, 'cache_precision': cache_precision, 'reorder': reorder,
+                         'dedupe': dedupe, 'skip_invalid': skip_invalid, 'prebuild': prebuild,
+                         'max_shards': max_shards}
+        self._token = uuid.uuid4().hex
+        self._registered = False
+        self._index_path = None
+        self._tree = None
+        if locations is not None:
+            coordinates, self.locations = locations.coords, locations
+        elif index and rg_shards.is_sharded_index(index):
+            if ecef:
+                raise ValueError('Sharded indexes are gridded in lat/lon degrees and do not support ecef')
+            # the shards are loaded and their trees built on first use
+            self._tree = rg_shards.ShardedIndex(index, max_shards)
+            coordinates, self.locations = None, self._tree.locations
+            self._index_path = os.path.abspath(index)
+            if mode == 2:
+                self.mode = 3
+        elif index:
+            coordinates, self.locations = self.load_index(index)
+            self._index_path = os.path.abspath(index)
+        elif stream:
             coordinates, self.locations = self.load(stream, stream_columns)
+        elif rg_index.is_index(rel_path(RG_INDEX)):
+            coordinates, self.locations = self.load_index(rel_path(RG_INDEX))
+            self._index_path = rel_path(RG_INDEX)
         else:
             coordinates, self.locations = self.extract(rel_path(RG_FILE))
 
-        if mode == 1:  # Single-process
-            self.tree = KDTree(coordinates)
-        else:  # Multi-process
-            self.tree = KDTree_MP.cKDTree_MP(coordinates)
+        if ecef:
+            coordinates = geodetic_in_ecef(coordinates)
+
+        # the tree is built on first use
+        self._coordinates = coordinates
+        self._tree_lock = threading.Lock()
+        _fork.register(self)
+        if prebuild:
+            threading.Thread(target=lambda: self.tree, daemon=True).start()
+
+    def __reduce__(self):
+        """
+        Pickling carries the options and the data source only: the path of the index when loaded from one
+        (it must be readable where the geocoder is unpickled), the compact location arrays otherwise.
+        Unpickled copies of the same geocoder share one instance per process, whose tree is built on first use.
+        In the pickling process, that instance is the pickled geocoder itself
+        """
+        if not self._registered:
+            registry.register(('pickle', self._token), self)
+            self._registered = True
+        locations = None if self._index_path else self.locations
+        return _restore_geocoder, (type(self), self._token, self._options, self._index_path, locations,
+                                   self.polygons)
+
+    def _after_fork(self):
+        self._tree_lock = threading.Lock()
+
+    @property
+    def tree(self):
+        """
+        The K-D tree, built on first use
+        """
+        if self._tree is None:
+            with self._tree_lock:
+                if self._tree is None:
+                    if self.mode == 2:  # Multi-process
+                        from rvgeocoder.cKDTree_MP import cKDTree_MP
+                        self._tree = cKDTree_MP(self._coordinates)
+                        self._tree.metrics = self._metrics
+                    else:  # Single-process, single or multi-threaded queries
+                        from scipy.spatial import cKDTree
+                        self._tree = cKDTree(self._coordinates)
+        return self._tree
+
+    @property
+    def metrics(self):
+        """
+        The rvgeocoder.metrics.QueryMetrics recording the stages of the queries (including those of the worker
+        pool in mode 2), None (the default) disables the instrumentation
+        """
+        return self._metrics
+
+    @metrics.setter
+    def metrics(self, metrics):
+        self._metrics = metrics
+        if self._tree is not None and hasattr(self._tree, 'pquery'):
+            self._tree.metrics = metrics
 
     @classmethod
-    def from_data(cls, data: str):
-        return cls(stream=io.StringIO(data))
+    def from_data(cls, data: str, **kwargs):
+        return cls(stream=io.StringIO(data), **kwargs)
 
     @classmethod
-    def from_files(cls, location_files: list):
-        """ Loading files data into a stream and creating new instance.
+    def from_files(cls, location_files: list, **kwargs):
+        """ Loading files data (streamed in chunks) and creating new instance.
         Arguments:
             location_files {list} -- list of files with lat, lon and additional info on the coord
+            kwargs -- passed to the class instantiation, e.g. mode
+        Returns:
+            [RGeocoderImpl]
+        """
+        locations = RGeocoderDataLoader.load_files_locations(location_files,
+                                                             skip_invalid=kwargs.get('skip_invalid', False))
+        return cls(locations=locations, **kwargs)
+
+    @classmethod
+    def from_index(cls, path: str, **kwargs):
+        """ Creating new instance from a binary index created by build_index.
+        Arguments:
+            path {str} -- directory of the index
         Returns:
             [RGeocoderImpl]
         """
-        data_stream = RGeocoderDataLoader.load_files_stream(location_files)
-        return cls(stream=data_stream)
+        return cls(index=path, **kwargs)
+
+    def with_locations(self, locations):
+        """ Creating new instance with the options and polygons of this instance over other locations,
+        e.g. to rebuild the tree after locations were added or removed.
+        Arguments:
+            locations {LocationStore} -- the locations of the new instance
+        Returns:
+            [RGeocoderImpl]
+        """
+        rgeo = type(self)(locations=locations, **self._options)
+        rgeo.polygons = self.polygons
+        return rgeo
+
+    def build_index(self, path: str, tile_size: float = None):
+        """ Saving the locations of this instance as a binary index, whose columns are memory mapped
+        in near constant time by from_index. The tree is still built on the first query.
+        Arguments:
+            path {str} -- directory of the index, replaced if exists
+            tile_size {float} -- OPTIONAL. Save a sharded index of tile_size x tile_size degrees tiles,
+                                 whose shards are loaded on demand (see rvgeocoder.shards)
+        """
+        if isinstance(self.locations, rg_shards.ShardedLocations):
+            raise ValueError('The locations of a sharded index cannot be saved again')
+        if tile_size:
+            rg_shards.save_sharded_index(self.locations, path, tile_size)
+        else:
+            rg_index.save_index(self.locations, path)
+
+    def start(self):
+        """
+        Function to start the worker pool of the multi-process tree (mode 2). The pool is also
+        started lazily by the first query, so calling this is only needed to pay the startup upfront
+        """
+        if self.mode == 2:
+            self.tree.start()
+        return self
+
+    def close(self):
+        """
+        Function to stop the worker pool of the multi-process tree (mode 2)
+        """
+        if self.mode == 2 and self._tree is not None:
+            self._tree.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _query_tree(self, coordinates, k=1):
+        """
+        Function to query the K-D tree according to the mode of the instance
+        Args:
+        coordinates (list): List of tuple coordinates, i.e. [(latitude, longitude)]
+        Returns:
+            distances (kms when ecef is set) and indices arrays, of shape (n,) when k=1 or (n, k) otherwise
+        """
+        return self._query_latlon(_as_points(coordinates), k)
+
+    def _query_latlon(self, points, k=1):
+        """
+        Function to query the K-D tree with a float64 array of (lat, lon), going through the cache if enabled
+        """
+        if self.cache is not None and k == 1:
+            return self.cache.query(points, self._query_latlon_uncached)
+        return self._query_latlon_uncached(points, k)
+
+    def _query_latlon_uncached(self, points, k=1):
+        if self.ecef:
+            points = geodetic_in_ecef(points)
+        return self._query_points(points, k)
+
+    def _query_points(self, points, k=1):
+        """
+        Function to query the K-D tree with points already in the coordinates space of the tree
+        """
+        metrics = self._metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        if self.mode == 2:
+            dists, indices = self.tree.pquery(points, k=k, reorder=self.reorder, dedupe=self.dedupe)
+            if k == 1:
+                # pquery returns the distances with shape (n, 1)
+                dists = dists.reshape(-1)
+        else:
+            restore = None
+            if self.reorder or self.dedupe:
+                points, restore = spatial_batch(points, self.dedupe)
+            if self.mode == 1:
+                dists, indices = self.tree.query(points, k=k)
+            else:
+                dists, indices = self.tree.query(points, k=k, workers=self.workers)
+            if restore is not None:
+                dists, indices = dists[restore], indices[restore]
+            if metrics is not None:
+                metrics.batch(len(points), 1 if self.mode == 1 else self._thread_count())
+
+        if self.ecef:
+            dists = ecef_chord_to_km(dists)
+        if metrics is not None:
+            metrics.record('tree', time.perf_counter() - start, len(points))
+        return dists, indices
+
+    def _thread_count(self):
+        return (os.cpu_count() or 1) if self.workers < 0 else self.workers
+
+    def _points(self, coordinates):
+        """
+        Function that converts coordinates to a float64 array of (lat, lon), see _as_points
+        """
+        if self._metrics is None:
+            return _as_points(coordinates)
+        start = time.perf_counter()
+        points = _as_points(coordinates)
+        self._metrics.record('convert', time.perf_counter() - start, len(points))
+        return points
+
+    def _locate_polygons(self, lats, lons):
+        """
+        Function that returns the index of the polygon containing each coordinate (-1 outside of all polygons),
+        or None when no polygons are loaded
+        """
+        if self.polygons is None:
+            return None
+        return self.polygons.locate(lats, lons)
+
+    def _records(self, indices, points, locations=None):
+        metrics = self._metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        locations = self.locations if locations is None else locations
+        records = [locations[index] for index in indices]
+        inside = self._locate_polygons(points[:, 0], points[:, 1])
+        if inside is not None:
+            for n in np.flatnonzero(inside >= 0):
+                records[n].update(self._polygon_attributes(inside[n]))
+        if metrics is not None:
+            metrics.record('assemble', time.perf_counter() - start, len(records))
+        return records
+
+    def _polygon_attributes(self, polygon):
+        return {name: value for name, value in self.polygons.attributes[polygon].items() if name not in COORD_COLUMNS}
+
+    def _apply_polygon_columns(self, result, inside):
+        """
+        Function that overrides the gathered columns of the coordinates inside a polygon with its attributes
+        """
+        hits = np.flatnonzero(inside >= 0)
+        for name, values in result.items():
+            if name in self.polygons.columns and name not in COORD_COLUMNS and len(hits):
+                values[hits] = self.polygons.columns[name][inside[hits]]
 
     def query(self, coordinates):
         """
@@ -242,11 +643,25 @@ class RGeocoderImpl:
         Args:
         coordinates (list): List of tuple coordinates, i.e. [(latitude, longitude)]
         """
-        if self.mode == 1:
-            _, indices = self.tree.query(coordinates, k=1)
-        else:
-            _, indices = self.tree.pquery(coordinates, k=1)
-        return [self.locations[index] for index in indices]
+        points = self._points(coordinates)
+        _, indices = self._query_latlon(points)
+        return self._records(indices, points)
+
+    async def aget(self, lat, lon):
+        """
+        Function to find the nearest city of a coordinate from asyncio code. Concurrent calls are answered by
+        batch queries run in an executor, see rvgeocoder.aio.AsyncBatcher. The batcher is created with its
+        default settings on first use, assign an AsyncBatcher to the batcher attribute to configure it
+        Args:
+        lat (float): latitude
+        lon (float): longitude
+        Returns:
+            the location record, as query would return it
+        """
+        if self.batcher is None:
+            from rvgeocoder.aio import AsyncBatcher
+            self.batcher = AsyncBatcher(self)
+        return await self.batcher.get(lat, lon)
 
     def query_dist(self, coordinates):
         """
@@ -254,14 +669,264 @@ class RGeocoderImpl:
         Args:
         coordinates (list): List of tuple coordinates, i.e. [(latitude, longitude)]
         """
-        if self.mode == 1:
-            dists, indices = self.tree.query(coordinates, k=1)
+        points = self._points(coordinates)
+        dists, indices = self._query_latlon(points)
+        return list(zip(dists, self._records(indices, points)))
+
+    def query_columns(self, coordinates, columns=None):
+        """
+        Function to query the K-D tree to find the nearest city, returning the result as columns
+        instead of a list of records, e.g. to build a pandas DataFrame
+        Args:
+        coordinates (list): List of tuple coordinates, i.e. [(latitude, longitude)]
+        columns (list): OPTIONAL. Names of the columns to return, all columns by default
+        Returns:
+            dict of column name to array
+        """
+        points = self._points(coordinates)
+        _, indices = self._query_latlon(points)
+        metrics = self._metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        result = self.locations.take(indices, columns)
+        inside = self._locate_polygons(points[:, 0], points[:, 1])
+        if inside is not None:
+            self._apply_polygon_columns(result, inside)
+        if metrics is not None:
+            metrics.record('assemble', time.perf_counter() - start, len(indices))
+        return result
+
+    def query_array(self, lats, lons=None, return_distance=False, columns=None):
+        """
+        Function to query the K-D tree with arrays of coordinates, without going through lists of tuples
+        Args:
+        lats (array-like): Latitudes as a float64 NumPy array, pandas Series or Arrow array. When lons is None,
+                           an array of shape (n, 2) of latitude/longitude pairs
+        lons (array-like): OPTIONAL. Longitudes, same length as lats
+        return_distance (bool): OPTIONAL. Add the distances to the nearest location (kms when ecef is set)
+        columns (list): OPTIONAL. Names of location columns to gather for each coordinate
+        Returns:
+            dict with 'index' (array of locations indices), 'distance' if return_distance is set,
+            'polygon' (index of the containing polygon, -1 if none) when polygons are loaded,
+            and an array for each of the columns
+        """
+        metrics = self._metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        lats = _as_float_array(lats)
+        lons = None if lons is None else _as_float_array(lons)
+        if metrics is not None:
+            metrics.record('convert', time.perf_counter() - start, len(lats))
+        if lons is None:
+            points = lats.reshape(-1, 2)
+            lats, lons = points[:, 0], points[:, 1]
+            dists, indices = self._query_latlon(points)
         else:
-            dists, indices = self.tree.pquery(coordinates, k=1)
-            # in pquery dists returns a list of arrays so get the first element instead of returning array
-            dists = [dist[0] for dist in dists]
-        return [(dists[n], self.locations[index]) for (n, index) in enumerate(indices)]
+            if self.ecef and self.cache is None:
+                # straight to the coordinates space of the tree, without stacking lat/lon first
+                dists, indices = self._query_points(latlon_in_ecef(lats, lons))
+            else:
+                dists, indices = self._query_latlon(np.column_stack((lats, lons)))
+
+        return self._array_result(lats, lons, dists, indices, return_distance, columns)
 
+    def _array_result(self, lats, lons, dists, indices, return_distance=False, columns=None, locations=None):
+        """
+        Function that assembles the dict returned by query_array from the nearest locations
+        """
+        metrics = self._metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        locations = self.locations if locations is None else locations
+        result = {'index': indices}
+        if return_distance:
+            result['distance'] = dists
+        inside = self._locate_polygons(lats, lons)
+        if inside is not None:
+            result['polygon'] = inside
+        if columns:
+            gathered = locations.take(indices, columns)
+            if inside is not None:
+                self._apply_polygon_columns(gathered, inside)
+            result.update(gathered)
+        if metrics is not None:
+            metrics.record('assemble', time.perf_counter() - start, len(indices))
+        return result
+
+    def query_weighted(self, coordinates, k=10, population_weight=1.0, feature_weights=None,
+                       return_distance=False, columns=None):
+        """
+        Function to query the K-D tree for the k nearest locations and pick the one with the lowest score
+        distance / ((1 + population_weight * log1p(population)) * feature_weights[feature_code]), so a
+        coordinate in the suburbs of a big city resolves to the city rather than to the closest hamlet.
+        The scores are computed at once over the (n, k) candidates
+        Args:
+        coordinates (list): List of tuple coordinates, i.e. [(latitude, longitude)], or an array of shape (n, 2)
+        k (int): Number of nearest candidates ranked for each coordinate
+        population_weight (float): Weight of the population, 0 ranks by distance (and feature weight) only
+        feature_weights (dict): OPTIONAL. Weight of GeoNames feature codes, e.g. {'PPLC': 2.0, 'PPLX': 0.5},
+                                missing codes weigh 1
+        return_distance (bool): OPTIONAL. Add the distances to the selected locations
+        columns (list): OPTIONAL. Names of location columns to gather for each coordinate
+        Returns:
+            dict as returned by query_array
+        """
+        points = self._points(coordinates)
+        dists, indices = self._query_latlon(points, k)
+        dists, indices = dists.reshape(len(points), k), indices.reshape(len(points), k)
+        # missing candidates have an inf distance, their index is out of range
+        weights = self._location_weights(population_weight, feature_weights)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = dists / weights[np.minimum(indices, len(weights) - 1)]
+        scores[np.isnan(scores)] = np.inf
+        best = np.argmin(scores, axis=1)
+        rows = np.arange(len(points))
+        return self._array_result(points[:, 0], points[:, 1], dists[rows, best], indices[rows, best],
+                                  return_distance, columns)
+
+    def _location_weights(self, population_weight, feature_weights):
+        """
+        Function that returns the weight of each location for query_weighted, cached for the last arguments
+        """
+        key = (population_weight, tuple(sorted((feature_weights or {}).items())))
+        if self._weights is None or self._weights[0] != key:
+            weights = np.ones(len(self.locations), dtype=np.float64)
+            if population_weight:
+                if 'population' not in self.locations.fieldnames:
+                    raise ValueError('Locations have no population column, rebuild %s or load a source with '
+                                     'a population column' % RG_FILE)
+                weights += population_weight * np.log1p(np.maximum(self.locations.numeric('population'), 0))
+            if feature_weights:
+                if 'feature_code' not in self.locations.fieldnames:
+                    raise ValueError('Locations have no feature_code column, rebuild %s or load a source with '
+                                     'a feature_code column' % RG_FILE)
+                weights *= self.locations.map_values('feature_code', feature_weights)
+            self._weights = (key, weights)
+        return self._weights[1]
+
+    def query_k(self, coordinates, k, columns=None):
+        """
+        Function to query the K-D tree to find the k nearest locations of each coordinate, e.g. to pick
+        the most populous of the nearby cities. Polygons are not applied to the neighbours
+        Args:
+        coordinates (list): List of tuple coordinates, i.e. [(latitude, longitude)], or an array of shape (n, 2)
+        k (int): Number of nearest locations
+        columns (list): OPTIONAL. Names of location columns to gather for each neighbour
+        Returns:
+            dict with 'index' (int array of shape (n, k), nearest first, padded with -1 when there are less
+            than k locations), 'distance' (float64 array of shape (n, k) padded with inf, kms when ecef
+            is set) and an array of shape (n, k) for each of the columns
+        """
+        points = self._points(coordinates)
+        dists, indices = self._query_latlon(points, k)
+        dists = dists.reshape(len(points), k)
+        # missing neighbours are reported by scipy with the number of locations as index
+        indices = np.where(indices < len(self.locations), indices, -1).reshape(len(points), k)
+
+        result = {'index': indices, 'distance': dists}
+        if columns:
+            gathered = self._take_padded(indices.reshape(-1), columns)
+            result.update({name: values.reshape(len(points), k) for name, values in gathered.items()})
+        return result
+
+    def query_radius(self, coordinates, radius, columns=None):
+        """
+        Function to query the K-D tree to find all the locations within radius of each coordinate,
+        e.g. for geofencing. Polygons are not applied to the neighbours
+        Args:
+        coordinates (list): List of tuple coordinates, i.e. [(latitude, longitude)], or an array of shape (n, 2)
+        radius (float): Radius in kms when ecef is set, in degrees otherwise. Either a single radius or an
+                        array with the radius of each coordinate
+        columns (list): OPTIONAL. Names of location columns to gather for each neighbour
+        Returns:
+            dict in CSR form: the neighbours of coordinate n are the items offsets[n]:offsets[n + 1] of
+            'index', 'distance' and each of the columns. 'offsets' is an int64 array of shape (n + 1,),
+            the neighbours of each coordinate are sorted nearest first
+        """
+        points = self._points(coordinates)
+        if self.ecef:
+            points = geodetic_in_ecef(points)
+            radius = ecef_km_to_chord(radius)
+
+        if self.mode == 2:
+            offsets, indices = self.tree.pquery_ball_point(points, radius)
+        else:
+            neighbours = self.tree.query_ball_point(points, radius, workers=self.workers if self.mode == 3 else 1,
+                                                    return_sorted=True)
+            offsets = np.zeros(len(points) + 1, dtype=np.int64)
+            np.cumsum(np.fromiter(map(len, neighbours), dtype=np.int64, count=len(neighbours)), out=offsets[1:])
+            indices = np.fromiter(itertools.chain.from_iterable(neighbours), dtype=np.int64, count=offsets[-1])
+
+        # distances of all the neighbours at once, then nearest first within each coordinate
+        owners = np.repeat(np.arange(len(points)), np.diff(offsets))
+        dists = np.linalg.norm(self.tree.data[indices] - points[owners], axis=1)
+        order = np.lexsort((dists, owners))
+        indices, dists = indices[order].astype(np.intp), dists[order]
+        if self.ecef:
+            dists = ecef_chord_to_km(dists)
+
+        result = {'offsets': offsets, 'index': indices, 'distance': dists}
+        if columns:
+            result.update(self.locations.take(indices, columns))
+        return result
+
+    def _take_padded(self, indices, columns):
+        """
+        Function that gathers columns at indices where -1 stands for no location, giving NaN for the
+        coordinates columns and None for the others
+        """
+        missing = indices < 0
+        result = self.locations.take(np.where(missing, 0, indices), columns)
+        if missing.any():
+            for name, values in result.items():
+                if values.dtype == object:
+                    values[missing] = None
+                else:
+                    values[missing] = np.nan
+        return result
+
+    def query_iter(self, coordinates, chunk_size=rg_stream.DEFAULT_CHUNK_SIZE, return_distance=False,
+                   columns=None):
+        """
+        Function to query an iterable of coordinates of any size in bounded chunks. The next chunk is
+        collected in a background thread while the current one is queried
+        Args:
+        coordinates (iterable): (latitude, longitude) pairs, or float64 arrays of shape (n, 2)
+        chunk_size (int): Number of coordinates queried at once
+        return_distance (bool): OPTIONAL. Add the distances to the nearest location
+        columns (list): OPTIONAL. Names of location columns to gather, all columns by default
+        Returns:
+            generator of query_array results, one per chunk
+        """
+        columns = columns or self.locations.fieldnames
+        for points in rg_stream.prefetch(rg_stream.chunk_coordinates(coordinates, chunk_size)):
+            yield self.query_array(points, return_distance=return_distance, columns=columns)
+
+    def search_stream(self, filename, delimiter=',', lat_col=0, lon_col=1, header=False,
+                      chunk_size=rg_stream.DEFAULT_CHUNK_SIZE, return_distance=False, columns=None,
+                      skip_invalid=False):
+        """
+        Function to query the coordinates of a delimited file in bounded chunks, so memory stays flat
+        whatever the file size. The next chunk is read and parsed while the current one is queried
+        Args:
+        filename (str): Path of the file, one coordinate per row
+        delimiter (str): Delimiter of the file
+        lat_col (int): Index of the latitude column
+        lon_col (int): Index of the longitude column
+        header (bool): Whether the first row of the file is a header
+        chunk_size (int): Number of rows queried at once
+        skip_invalid (bool): Skip (and log) rows with missing, malformed or out of range coordinates instead
+                             of raising a ValueError listing their line numbers
+        Returns:
+            generator of query_array results, one per chunk
+        """
+        columns = columns or self.locations.fieldnames
+        with open(filename, 'rt', newline='') as fd:
+            chunks = rg_stream.read_chunks(fd, delimiter, lat_col, lon_col, header, chunk_size, skip_invalid)
+            for _, points in rg_stream.prefetch(chunks):
+                yield self.query_array(points, return_distance=return_distance, columns=columns)
+
+    @large_csv_fields()
     def load(self, stream, stream_columns):
         """
         Function that loads a custom data source
@@ -270,8 +935,8 @@ class RGeocoderImpl:
                               The format of the stream must be a comma-separated file.
         """
         print('Loading geocoded stream ...')
-        stream_reader = csv.DictReader(stream, delimiter=',')
-        header = stream_reader.fieldnames
+        stream_reader = csv.reader(stream, delimiter=',')
+        header = next(stream_reader, None)
 
         if stream_columns and header != stream_columns:
             raise csv.Error('Input must be a comma-separated file with header containing ' + \
@@ -279,13 +944,21 @@ class RGeocoderImpl:
                 'https://github.com/thampiman/reverse-geocoder')
 
         # Load all the coordinates and locations
-        geo_coords, locations = [], []
-        for row in stream_reader:
-            geo_coords.append((row['lat'], row['lon']))
-            locations.append(row)
+        locations = LocationStore.from_rows(header, stream_reader, self.skip_invalid)
+        return locations.coords, locations
 
-        return geo_coords, locations
+    def load_index(self, path):
+        """
+        Function that loads a binary index created by build_index
+        Args:
+        path (str): Directory of the index
+        """
+        if self.verbose:
+            print('Loading geocoded index ...')
+        locations = rg_index.load_index(path)
+        return locations.coords, locations
 
+    @large_csv_fields()
     def extract(self, local_filename):
         """
         Function loads the already extracted GeoNames cities file or downloads and extracts it if
@@ -293,20 +966,19 @@ class RGeocoderImpl:
         Args:
         local_filename (str): Path to local RG_FILE
         """
-        if os.path.exists(local_filename):
-            if self.verbose:
-                print('Loading formatted geocoded file ...')
-            rows = csv.DictReader(open(local_filename, 'rt'))
-        else:
-            rows = self.do_extract(GN_CITIES1000, local_filename)
-
-        # Load all the coordinates and locations
-        geo_coords, locations = [], []
-        for row in rows:
-            geo_coords.append((row['lat'], row['lon']))
-            locations.append(row)
-        return geo_coords, locations
+        if not os.path.exists(local_filename):
+            self.do_extract(GN_CITIES1000, local_filename)
 
+        if self.verbose:
+            print('Loading formatted geocoded file ...')
+        with open(local_filename, 'rt') as fd:
+            rows = csv.reader(fd)
+            header = next(rows)
+            # Load all the coordinates and locations
+            locations = LocationStore.from_rows(header, rows, self.skip_invalid)
+        return locations.coords, locations
+
+    @large_csv_fields()
     def do_extract(self, geoname_file, local_filename):
         gn_cities_url = GN_URL + geoname_file + '.zip'
         gn_admin1_url = GN_URL + GN_ADMIN1
@@ -325,84 +997,113 @@ class RGeocoderImpl:
             urllib.request.urlretrieve(gn_admin2_url, GN_ADMIN2)
 
         if self.verbose:
-            print('Extracting %s...' % geoname_file)
-        _z = zipfile.ZipFile(open(cities_zipfilename, 'rb'))
-        open(cities_filename, 'wb').write(_z.read(cities_filename))
+            print('Creating formatted geocoded file from %s...' % cities_zipfilename)
+        # the zip entry is streamed, see rvgeocoder.build to build an index from local GeoNames dumps
+        from rvgeocoder import build as rg_build
+        fieldnames = RG_COLUMNS + RG_EXTRA_COLUMNS
+        count = 0
+        with rg_build.open_dump(cities_zipfilename) as gn_fd, open(local_filename, 'wt') as fd:
+            writer = csv.writer(fd)
+            writer.writerow(fieldnames)
+            for _, values in rg_build.read_geonames(gn_fd, rg_build.read_admin_codes(GN_ADMIN1),
+                                                    rg_build.read_admin_codes(GN_ADMIN2), feature_classes=None):
+                writer.writerows(zip(*values[:len(fieldnames)]))
+                count += len(values[0])
+
+        return count
+
+
+# geocoders of this process, shared by RGeocoder and unpickled geocoders
+registry = GeocoderRegistry()
+
+def RGeocoder(**kwargs):
+    """
+    Function to get the geocoder of this process for the given data source and options (see RGeocoderImpl),
+    created on the first call. Calls with other options get their own geocoder
+    """
+    return registry.get(RGeocoderImpl, **kwargs)
 
-        if self.verbose:
-            print('Loading admin1 codes...')
-        admin1_map = {}
-        t_rows = csv.reader(open(GN_ADMIN1, 'rt'), delimiter='\t')
-        for row in t_rows:
-            admin1_map[row[ADMIN_COLUMNS['concatCodes']]] = row[ADMIN_COLUMNS['asciiName']]
 
-        if self.verbose:
-            print('Loading admin2 codes...')
-        admin2_map = {}
-        for row in csv.reader(open(GN_ADMIN2, 'rt'), delimiter='\t'):
-            admin2_map[row[ADMIN_COLUMNS['concatCodes']]] = row[ADMIN_COLUMNS['asciiName']]
+def _restore_geocoder(cls, token, options, index, locations, polygons):
+    """
+    Function that unpickles a geocoder, all the copies of the same geocoder share one instance per process
+    """
+    def create():
+        rgeo = cls(index=index, locations=locations, **options)
+        rgeo.polygons = polygons
+        rgeo._token = token
+        rgeo._registered = True
+        return rgeo
+    return registry.get_or_create(('pickle', token), create)
 
-        if self.verbose:
-            print('Creating formatted geocoded file...')
-        writer = csv.DictWriter(open(local_filename, 'wt'), fieldnames=RG_COLUMNS)
-        rows = []
-        for row in csv.reader(open(cities_filename, 'rt'), delimiter='\t', quoting=csv.QUOTE_NONE):
-            lat = row[GN_COLUMNS['latitude']]
-            lon = row[GN_COLUMNS['longitude']]
-            name = row[GN_COLUMNS['asciiName']]
-            cc = row[GN_COLUMNS['countryCode']]
-
-            admin1_c = row[GN_COLUMNS['admin1Code']]
-            admin2_c = row[GN_COLUMNS['admin2Code']]
-
-            cc_admin1 = cc+'.'+admin1_c
-            cc_admin2 = cc+'.'+admin1_c+'.'+admin2_c
-
-            admin1 = ''
-            admin2 = ''
-
-            if cc_admin1 in admin1_map:
-                admin1 = admin1_map[cc_admin1]
-            if cc_admin2 in admin2_map:
-                admin2 = admin2_map[cc_admin2]
-
-            write_row = {
-                'lat': lat,
-                'lon': lon,
-                'name': name,
-                'admin1': admin1,
-                'admin2': admin2,
-                'cc': cc}
-            rows.append(write_row)
-        writer.writeheader()
-        writer.writerows(rows)
 
-        if self.verbose:
-            print('Removing extracted %s to save space...' % geoname_file)
-        os.remove(cities_filename)
+def geodetic_in_ecef(geo_coords):
+    """
+    Function that converts (lat, lon) coordinates in degrees to earth-centered earth-fixed (x, y, z) in kms
+    """
+    geo_coords = np.asarray(geo_coords, dtype=np.float64).reshape(-1, 2)
+    return latlon_in_ecef(geo_coords[:, 0], geo_coords[:, 1])
+
 
-        return rows
+def latlon_in_ecef(lat, lon):
+    """
+    Function that converts arrays of latitudes and longitudes in degrees to an ECEF (x, y, z) array in kms
+    """
+    lat_r = np.radians(lat)
+    lon_r = np.radians(lon)
+    sin_lat = np.sin(lat_r)
+    cos_lat = np.cos(lat_r)
+    normal = A / (np.sqrt(1 - E2 * (sin_lat ** 2)))
 
+    x = normal * cos_lat * np.cos(lon_r)
+    y = normal * cos_lat * np.sin(lon_r)
+    z = normal * (1 - E2) * sin_lat
 
-@singleton
-class RGeocoder(RGeocoderImpl):
-    pass
+    return np.column_stack([x, y, z])
 
 
-def geodetic_in_ecef(geo_coords):
-    geo_coords = np.asarray(geo_coords).astype(np.float)
-    lat = geo_coords[:, 0]
-    lon = geo_coords[:, 1]
+def ecef_chord_to_km(dists):
+    """
+    Function that converts chord distances between ECEF coordinates to great-circle distances in kms
+    """
+    dists = np.asarray(dists)
+    # inf stands for a missing neighbour, keep it as is
+    return np.where(np.isinf(dists), dists, 2 * R_MEAN * np.arcsin(np.minimum(dists / (2 * R_MEAN), 1.0)))
 
-    lat_r = np.radians(lat)
-    lon_r = np.radians(lon)
-    normal = A / (np.sqrt(1 - E2 * (np.sin(lat_r) ** 2)))
 
-    x = normal * np.cos(lat_r) * np.cos(lon_r)
-    y = normal * np.cos(lat_r) * np.sin(lon_r)
-    z = normal * (1 - E2) * np.sin(lat)
+def ecef_km_to_chord(dists):
+    """
+    Function that converts great-circle distances in kms to chord distances between ECEF coordinates
+    """
+    dists = np.asarray(dists, dtype=np.float64)
+    return 2 * R_MEAN * np.sin(np.minimum(dists / (2 * R_MEAN), np.pi / 2))
 
-    return np.column_stack([x, y, z])
+
+def _load_polygons(polygons_file):
+    """
+    Function that loads a polygons file into a PolygonIndex, None when no file is given.
+    shapely is only imported here
+    """
+    if not polygons_file:
+        return None
+    from rvgeocoder.polygons import PolygonIndex
+    return PolygonIndex.from_file(polygons_file)
+
+
+def _as_points(coordinates):
+    """
+    Function that converts a list of (latitude, longitude) tuples to a float64 array of shape (n, 2)
+    """
+    return np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+
+
+def _as_float_array(values):
+    """
+    Function that views a NumPy array, pandas Series or Arrow array as a float64 NumPy array.
+    No copy is made when the values are already contiguous float64 (and for Arrow, have no nulls
+    and a single chunk), as all of them implement the array protocol
+    """
+    return np.asarray(values, dtype=np.float64)
 
 
 def rel_path(filename):
@@ -423,6 +1124,17 @@ def get(geo_coord, mode=2, verbose=True):
     return _rg.query([geo_coord])[0]
 
 
+async def aget(geo_coord, mode=2, verbose=True):
+    """
+    Function to query for a single coordinate from asyncio code, concurrent calls are batched
+    """
+    if not isinstance(geo_coord, tuple) or not isinstance(geo_coord[0], float):
+        raise TypeError('Expecting a tuple')
+
+    _rg = RGeocoder(mode=mode, verbose=verbose)
+    return await _rg.aget(*geo_coord)
+
+
 def search(geo_coords, mode=2, verbose=True):
     """
     Function to query for a list of coordinates
@@ -436,6 +1148,14 @@ def search(geo_coords, mode=2, verbose=True):
     return _rg.query(geo_coords)
 
 
+def search_stream(filename, mode=2, verbose=True, **kwargs):
+    """
+    Function to query the coordinates of a delimited file in chunks, see RGeocoderImpl.search_stream
+    """
+    _rg = RGeocoder(mode=mode, verbose=verbose)
+    return _rg.search_stream(filename, **kwargs)
+
+
 if __name__ == '__main__':
     print('Testing single coordinate through get...')
     city = (37.78674, -122.39222)
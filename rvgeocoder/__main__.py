@@ -0,0 +1,152 @@
+""" Command line interface of rvgeocoder
+
+Usage:
+    python -m rvgeocoder build-index OUTPUT [--files FILE [FILE ...]] [--tile-size DEGREES]
+    python -m rvgeocoder geocode INPUT OUTPUT [--delimiter D] [--header] [--columns NAME [NAME ...]]
+    python -m rvgeocoder build-geonames DUMP OUTPUT [--admin1 FILE] [--admin2 FILE] [--feature-classes C [C ...]]
+    python -m rvgeocoder update-geonames INDEX [--modifications FILE [FILE ...]] [--deletes FILE [FILE ...]]
+    python -m rvgeocoder serve SOCKET [--index INDEX | --files FILE [FILE ...]] [--mode MODE]
+"""
+import argparse
+import logging
+import signal
+import sys
+
+import rvgeocoder as rvg
+from rvgeocoder import stream as rg_stream
+
+
+def build_index(args):
+    if args.files:
+        rgeo = rvg.RGeocoderImpl.from_files(args.files, mode=1, verbose=args.verbose)
+    else:
+        rgeo = rvg.RGeocoderImpl(mode=1, verbose=args.verbose)
+    rgeo.build_index(args.output, args.tile_size)
+    if args.verbose:
+        print('Saved index of %d locations to %s' % (len(rgeo.locations), args.output))
+
+
+def serve(args):
+    from rvgeocoder import server as rg_server
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    # exit through the server cleanup, which removes the socket
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with _make_geocoder(args) as rgeo:
+        # build the tree before the first client comes
+        rgeo.tree
+        rg_server.serve(rgeo, args.socket)
+
+
+def build_geonames(args):
+    from rvgeocoder import build as rg_build
+    count = rg_build.build_index(args.dump, args.output, args.admin1, args.admin2, args.feature_classes)
+    if args.verbose:
+        print('Saved index of %d locations to %s' % (count, args.output))
+
+
+def update_geonames(args):
+    from rvgeocoder import build as rg_build
+    count = rg_build.update_index(args.index, args.modifications, args.deletes, args.output, args.admin1,
+                                  args.admin2, args.feature_classes)
+    if args.verbose:
+        print('Saved index of %d locations to %s' % (count, args.output or args.index))
+
+
+def _add_geonames_arguments(parser):
+    parser.add_argument('--admin1', default=rvg.GN_ADMIN1, help='GeoNames admin1 codes file')
+    parser.add_argument('--admin2', default=rvg.GN_ADMIN2, help='GeoNames admin2 codes file')
+    parser.add_argument('--feature-classes', nargs='+', default=['P'],
+                        help='GeoNames feature classes to keep, P (populated places) by default')
+
+
+def _make_geocoder(args):
+    kwargs = {'mode': args.mode, 'verbose': args.verbose}
+    if args.index:
+        return rvg.RGeocoderImpl.from_index(args.index, **kwargs)
+    if args.files:
+        return rvg.RGeocoderImpl.from_files(args.files, **kwargs)
+    return rvg.RGeocoderImpl(**kwargs)
+
+
+def geocode(args):
+    delimiter = args.delimiter
+    if delimiter is None:
+        delimiter = '\t' if args.input.endswith(('.tsv', '.tab')) else ','
+    with _make_geocoder(args) as rgeo:
+        count = rg_stream.geocode_file(rgeo, args.input, args.output, delimiter=delimiter,
+                                       lat_col=args.lat_col, lon_col=args.lon_col, header=args.header,
+                                       columns=args.columns, distance=args.distance,
+                                       chunk_size=args.chunk_size, skip_invalid=args.skip_invalid)
+    if args.verbose:
+        print('Geocoded %d rows to %s' % (count, args.output))
+
+
+def _add_source_arguments(parser):
+    parser.add_argument('--index', help='binary index created by build-index')
+    parser.add_argument('--files', nargs='+',
+                        help='custom location files, the GeoNames cities file is used by default')
+    parser.add_argument('--mode', type=int, default=2, choices=(1, 2, 3), help='query mode')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rvgeocoder', description='Offline reverse geocoder')
+    parser.add_argument('-q', '--quiet', dest='verbose', action='store_false', help='no verbose output')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    build_parser = commands.add_parser('build-index', help='build a binary index, memory mapped on load')
+    build_parser.add_argument('output', help='directory of the index')
+    build_parser.add_argument('--files', nargs='+',
+                              help='custom location files, the GeoNames cities file is used by default')
+    build_parser.add_argument('--tile-size', type=float,
+                              help='build a sharded index of tiles of this size in degrees, loaded on demand')
+    build_parser.set_defaults(func=build_index)
+
+    geocode_parser = commands.add_parser('geocode', help='reverse geocode a csv/tsv file of coordinates')
+    geocode_parser.add_argument('input', help='delimited file, one coordinate per row')
+    geocode_parser.add_argument('output', help='output file, input rows followed by the location columns')
+    geocode_parser.add_argument('-d', '--delimiter', help='delimiter, by default tab for .tsv files else comma')
+    geocode_parser.add_argument('--header', action='store_true', help='the input file has a header row')
+    geocode_parser.add_argument('--lat-col', type=int, default=0, help='index of the latitude column')
+    geocode_parser.add_argument('--lon-col', type=int, default=1, help='index of the longitude column')
+    geocode_parser.add_argument('--columns', nargs='+', default=['name', 'admin1', 'admin2', 'cc'],
+                                help='location columns appended to each row')
+    geocode_parser.add_argument('--distance', action='store_true', help='append the distance to the location')
+    geocode_parser.add_argument('--chunk-size', type=int, default=rg_stream.DEFAULT_CHUNK_SIZE,
+                                help='number of rows queried at once')
+    geocode_parser.add_argument('--skip-invalid', action='store_true',
+                                help='leave out the rows with invalid coordinates instead of failing')
+    _add_source_arguments(geocode_parser)
+    geocode_parser.set_defaults(func=geocode)
+
+    gn_build_parser = commands.add_parser('build-geonames',
+                                          help='build a binary index from a local GeoNames dump, offline')
+    gn_build_parser.add_argument('dump', help='GeoNames dump, e.g. cities1000.zip or allCountries.zip')
+    gn_build_parser.add_argument('output', help='directory of the index')
+    _add_geonames_arguments(gn_build_parser)
+    gn_build_parser.set_defaults(func=build_geonames)
+
+    gn_update_parser = commands.add_parser('update-geonames',
+                                           help='apply GeoNames daily files to an index built by build-geonames')
+    gn_update_parser.add_argument('index', help='directory of the index')
+    gn_update_parser.add_argument('--modifications', nargs='+', default=[],
+                                  help='GeoNames modifications-YYYY-MM-DD.txt files')
+    gn_update_parser.add_argument('--deletes', nargs='+', default=[], help='GeoNames deletes-YYYY-MM-DD.txt files')
+    gn_update_parser.add_argument('-o', '--output', help='directory of the updated index, by default the index is '
+                                                         'replaced')
+    _add_geonames_arguments(gn_update_parser)
+    gn_update_parser.set_defaults(func=update_geonames)
+
+    serve_parser = commands.add_parser('serve', help='serve one geocoder to the processes of the host on a Unix '
+                                                     'socket, see rvgeocoder.server.RGeocoderClient')
+    serve_parser.add_argument('socket', help='path of the Unix socket')
+    _add_source_arguments(serve_parser)
+    serve_parser.set_defaults(func=serve, mode=3)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
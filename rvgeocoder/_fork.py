@@ -0,0 +1,41 @@
+""" Fork safety
+
+Locks held by another thread of the parent when a process forks stay held forever in the child, and the
+worker pools of the parent are not the child's to stop. Objects holding such state register here, and
+their _after_fork method is called in every forked child (os.register_at_fork) while they are alive.
+"""
+import os
+import weakref
+
+# objects of this process whose _after_fork method is called in a forked child
+_objects = weakref.WeakSet()
+
+# module level state reset in a forked child, called before the objects
+_callbacks = []
+
+
+def register(obj):
+    """
+    Function that calls obj._after_fork() in the children forked while obj is alive
+    """
+    _objects.add(obj)
+    return obj
+
+
+def on_fork(callback):
+    """
+    Function that calls callback() in every forked child. Usable as a decorator
+    """
+    _callbacks.append(callback)
+    return callback
+
+
+def _reinit_after_fork():
+    for callback in _callbacks:
+        callback()
+    for obj in list(_objects):
+        obj._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
@@ -0,0 +1,207 @@
+""" Asyncio micro-batching of single point lookups
+
+Concurrent aget calls of an event loop are collected for up to max_delay_us microseconds or max_points
+points, whichever comes first, and answered by one vectorized query run in an executor (the default
+thread pool of the loop, or any concurrent.futures executor). The loop never blocks on the tree, and the
+cost of a query is shared by the whole batch.
+
+Process pools get the geocoder with each batch, and a geocoder not loaded from an index pickles all its
+locations. Use process_pool(geocoder) instead: its workers receive the geocoder once when they start,
+and the batches only carry the points.
+"""
+import asyncio
+import functools
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from rvgeocoder.metrics import percentiles
+
+# Number of recent batches/requests kept to compute the percentiles of the metrics
+METRICS_WINDOW = 10000
+
+
+# geocoders of a GeocoderProcessPool worker, by token
+_worker_geocoders = {}
+
+
+def _query_batch(geocoder, points):
+    return geocoder.query(np.array(points, dtype=np.float64))
+
+
+def _init_worker(geocoder):
+    _worker_geocoders[geocoder._token] = geocoder
+
+
+def _query_worker_batch(token, points):
+    return _query_batch(_worker_geocoders[token], points)
+
+
+class GeocoderProcessPool(ProcessPoolExecutor):
+    """
+    Process pool serving the batches of one geocoder, sent to each worker once when it starts
+    """
+    def __init__(self, geocoder, max_workers=None, mp_context=None):
+        super().__init__(max_workers, mp_context, initializer=_init_worker, initargs=(geocoder,))
+        self.token = geocoder._token
+
+
+def process_pool(geocoder, max_workers=None, mp_context=None):
+    """
+    Function that returns a process pool for the AsyncBatcher of geocoder, see GeocoderProcessPool
+    Args:
+    geocoder (RGeocoderImpl): the geocoder answering the batches
+    max_workers (int): OPTIONAL. number of worker processes, the number of CPUs by default
+    mp_context (multiprocessing.context.BaseContext): OPTIONAL. start method of the workers
+    """
+    return GeocoderProcessPool(geocoder, max_workers, mp_context)
+
+
+class BatcherMetrics:
+    """
+    Counters of an AsyncBatcher, and the distributions of the recent batch sizes, queue latencies (from
+    aget to the dispatch of its batch) and service times (from the dispatch to the results of a batch)
+    """
+    def __init__(self, window=METRICS_WINDOW):
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self._batch_sizes = deque(maxlen=window)
+        self._queue_us = deque(maxlen=window)
+        self._service_us = deque(maxlen=window)
+
+    def dispatched(self, size, waits):
+        self.requests += size
+        self.batches += 1
+        self._batch_sizes.append(size)
+        self._queue_us.extend(waits)
+
+    def served(self, elapsed, failed=False):
+        self._service_us.append(elapsed)
+        if failed:
+            self.errors += 1
+
+    def stats(self):
+        """
+        Function that returns the metrics as a dict. The percentiles are over the last METRICS_WINDOW
+        batches (batch_size, service_us) or requests (queue_us), latencies are in microseconds
+        """
+        result = {'requests': self.requests, 'batches': self.batches, 'errors': self.errors,
+                  'mean_batch_size': self.requests / self.batches if self.batches else 0.0}
+        result.update(percentiles(self._batch_sizes, 'batch_size'))
+        result.update(percentiles(self._queue_us, 'queue_us'))
+        result.update(percentiles(self._service_us, 'service_us'))
+        return result
+
+
+class _Pending:
+    """
+    Requests of an event loop waiting for their batch
+    """
+    def __init__(self):
+        self.points = []
+        self.futures = []
+        self.times = []
+        self.timer = None
+
+    def take(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        taken = self.points, self.futures, self.times
+        self.points, self.futures, self.times = [], [], []
+        return taken
+
+
+class AsyncBatcher:
+    """
+    Collects concurrent single point lookups into batch queries of a geocoder
+    """
+    def __init__(self, geocoder, max_points=256, max_delay_us=200, executor=None, window=METRICS_WINDOW):
+        """ Class Instantiation
+        Args:
+        geocoder (RGeocoderImpl): the geocoder answering the batches
+        max_points (int): a batch is dispatched as soon as it holds max_points points
+        max_delay_us (int): a batch is dispatched at most max_delay_us microseconds after its first point.
+                            0 batches the lookups issued within the same iteration of the loop. Note the
+                            timers of the loop are scheduled with a resolution of about a millisecond
+        executor (concurrent.futures.Executor): OPTIONAL. runs the batch queries, by default the loop's
+                                                default executor (a thread pool). Process pools must be
+                                                created by process_pool, unless the geocoder was loaded
+                                                from an index (its pickle is then the index path)
+        window (int): number of recent batches/requests the metrics percentiles are computed on
+        """
+        if max_points < 1:
+            raise ValueError('max_points must be at least 1')
+        if isinstance(executor, GeocoderProcessPool):
+            if executor.token != geocoder._token:
+                raise ValueError('The process pool was created for another geocoder')
+            self._query = functools.partial(_query_worker_batch, executor.token)
+        elif isinstance(executor, ProcessPoolExecutor) and getattr(geocoder, '_index_path', None) is None:
+            raise ValueError('A process pool would receive all the locations of the geocoder with every batch, '
+                             'create it with rvgeocoder.aio.process_pool(geocoder)')
+        else:
+            self._query = functools.partial(_query_batch, geocoder)
+        self.geocoder = geocoder
+        self.max_points = max_points
+        self.max_delay_us = max_delay_us
+        self.executor = executor
+        self.metrics = BatcherMetrics(window)
+        self._pending = weakref.WeakKeyDictionary()
+
+    async def get(self, lat, lon):
+        """
+        Function that returns the nearest location of a coordinate, as RGeocoderImpl.query would
+        """
+        # a malformed coordinate fails its own lookup only, not the whole batch
+        point = float(lat), float(lon)
+        loop = asyncio.get_running_loop()
+        pending = self._pending.get(loop)
+        if pending is None:
+            pending = self._pending[loop] = _Pending()
+        future = loop.create_future()
+        pending.points.append(point)
+        pending.futures.append(future)
+        pending.times.append(time.perf_counter())
+        if len(pending.futures) >= self.max_points:
+            self._dispatch(loop, pending)
+        elif pending.timer is None:
+            if self.max_delay_us > 0:
+                pending.timer = loop.call_later(self.max_delay_us / 1e6, self._dispatch, loop, pending)
+            else:
+                pending.timer = loop.call_soon(self._dispatch, loop, pending)
+        return await future
+
+    def _dispatch(self, loop, pending):
+        points, futures, times = pending.take()
+        if not futures:
+            return
+        dispatched = time.perf_counter()
+        self.metrics.dispatched(len(futures), [(dispatched - start) * 1e6 for start in times])
+        try:
+            batch = loop.run_in_executor(self.executor, self._query, points)
+        except Exception as error:  # e.g. the executor was shut down
+            batch = loop.create_future()
+            batch.set_exception(error)
+        batch.add_done_callback(functools.partial(self._resolve, futures, dispatched))
+
+    def _resolve(self, futures, dispatched, batch):
+        error = batch.exception() if not batch.cancelled() else asyncio.CancelledError()
+        self.metrics.served((time.perf_counter() - dispatched) * 1e6, error is not None)
+        if error is not None:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        # a request cancelled while waiting for its batch is dropped
+        for future, record in zip(futures, batch.result()):
+            if not future.done():
+                future.set_result(record)
+
+    def stats(self):
+        """
+        Function that returns the batch size and latency metrics, see BatcherMetrics.stats
+        """
+        return self.metrics.stats()
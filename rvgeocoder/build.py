@@ -0,0 +1,241 @@
+""" Offline build of the GeoNames dataset
+
+Builds the locations (and the binary index) from local GeoNames dumps - cities500/1000/5000/15000.zip
+or allCountries.zip, zipped or not - and the admin1/admin2 codes files, without network access.
+The zip entry is streamed, rows are converted in chunks and the admin names of a whole chunk are
+joined at once. An index built here keeps the geoname_id of each location, so it can
+be updated from the GeoNames daily modifications-*.txt/deletes-*.txt files without reprocessing the dump.
+"""
+import csv
+import gc
+import io
+import itertools
+import logging
+import operator
+import os
+import re
+import zipfile
+import numpy as np
+
+from rvgeocoder import ADMIN_COLUMNS, GN_ADMIN1, GN_ADMIN2, GN_COLUMNS, RG_COLUMNS, RG_EXTRA_COLUMNS
+from rvgeocoder import index as rg_index
+from rvgeocoder.locations import LocationStore, LocationStoreBuilder, large_csv_fields
+
+logger = logging.getLogger(__name__)
+
+# Columns of the locations built from GeoNames, the geoname_id identifies the records of the daily updates
+BUILD_COLUMNS = RG_COLUMNS + RG_EXTRA_COLUMNS + ['geoname_id']
+
+# GeoNames columns read to build the locations
+_GN_READ_COLUMNS = ('geoNameId', 'latitude', 'longitude', 'asciiName', 'countryCode', 'admin1Code', 'admin2Code',
+                    'population', 'featureCode')
+
+# Feature classes kept by default, P = populated places (all of the citiesN dumps)
+DEFAULT_FEATURE_CLASSES = ('P',)
+
+# Number of GeoNames rows converted at once
+BUILD_CHUNK_SIZE = 100000
+
+# Date of a GeoNames daily file, e.g. modifications-2024-01-31.txt
+_DAILY_DATE = re.compile(r'(\d{4}-\d{2}-\d{2})')
+
+
+def open_dump(path):
+    """
+    Function that opens a GeoNames dump as a text file. A zip archive is streamed from its entry
+    (the .txt of the same name, or its only entry) without being extracted to disk
+    """
+    if not zipfile.is_zipfile(path):
+        return open(path, 'rt', encoding='utf-8', newline='')
+    archive = zipfile.ZipFile(path)
+    names = archive.namelist()
+    entry = os.path.splitext(os.path.basename(path))[0] + '.txt'
+    if entry not in names:
+        entries = [name for name in names if name.endswith('.txt') and name != 'readme.txt']
+        if len(entries) != 1:
+            raise ValueError('Cannot find the dump entry of %s, found %s' % (path, ', '.join(names)))
+        entry = entries[0]
+    return io.TextIOWrapper(archive.open(entry), encoding='utf-8', newline='')
+
+
+@large_csv_fields()
+def read_admin_codes(path):
+    """
+    Function that reads an admin1/admin2 codes file as a dict of the concatenated code to the ascii name
+    """
+    with open(path, 'rt', encoding='utf-8', newline='') as fd:
+        return {row[ADMIN_COLUMNS['concatCodes']]: row[ADMIN_COLUMNS['asciiName']]
+                for row in csv.reader(fd, delimiter='\t', quoting=csv.QUOTE_NONE) if row}
+
+
+def join_codes(codes, table):
+    """
+    Function that looks up a list of codes in a dict, the lookups run in C without any per-row bytecode
+    Returns:
+        list of the values, '' for missing codes
+    """
+    return list(map(table.get, codes, itertools.repeat('')))
+
+
+def read_geonames(fd, admin1_map, admin2_map, feature_classes=DEFAULT_FEATURE_CLASSES, chunk_size=BUILD_CHUNK_SIZE):
+    """
+    Function that reads GeoNames rows (a dump or a modifications file) in chunks
+    Args:
+    fd (file): text file of GeoNames rows
+    admin1_map (dict): admin1 concatenated codes to names
+    admin2_map (dict): admin2 concatenated codes to names
+    feature_classes (tuple): feature classes to keep, None keeps all the rows
+    chunk_size (int): number of rows per chunk
+    Returns:
+        generator of (geoname_ids, values) where geoname_ids is an int64 array of all the rows of the chunk,
+        and values the columns (ordered as BUILD_COLUMNS) of the rows of the kept feature classes
+    """
+    reader = csv.reader(fd, delimiter='\t', quoting=csv.QUOTE_NONE)
+    read_columns = operator.itemgetter(*(GN_COLUMNS[name] for name in _GN_READ_COLUMNS))
+    feature_class = GN_COLUMNS['featureClass']
+    while True:
+        # same as LocationStoreBuilder.append_rows, the collector has nothing to free among the parsed rows
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            rows = [row for row in itertools.islice(reader, chunk_size) if row]
+            if not rows:
+                return
+            column = dict(zip(_GN_READ_COLUMNS, zip(*map(read_columns, rows))))
+            geoname_ids = np.array(column['geoNameId'], dtype=np.int64)
+            if feature_classes is not None:
+                keep = np.isin(np.array([row[feature_class] for row in rows], dtype=object), list(feature_classes))
+                if not keep.all():
+                    kept = np.flatnonzero(keep).tolist()
+                    column = {name: [values[n] for n in kept] for name, values in column.items()}
+            del rows
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        cc_admin1 = [cc + '.' + admin1 for cc, admin1 in zip(column['countryCode'], column['admin1Code'])]
+        cc_admin2 = [cc_admin1 + '.' + admin2 for cc_admin1, admin2 in zip(cc_admin1, column['admin2Code'])]
+        values = {
+            'lat': column['latitude'],
+            'lon': column['longitude'],
+            'name': column['asciiName'],
+            'admin1': join_codes(cc_admin1, admin1_map),
+            'admin2': join_codes(cc_admin2, admin2_map),
+            'cc': column['countryCode'],
+            'population': column['population'],
+            'feature_code': column['featureCode'],
+            'geoname_id': column['geoNameId'],
+        }
+        yield geoname_ids, [values[name] for name in BUILD_COLUMNS]
+
+
+@large_csv_fields()
+def build_locations(dump, admin1=GN_ADMIN1, admin2=GN_ADMIN2, feature_classes=DEFAULT_FEATURE_CLASSES,
+                    chunk_size=BUILD_CHUNK_SIZE):
+    """
+    Function that builds the locations from a local GeoNames dump
+    Args:
+    dump (str): path of the dump, e.g. cities1000.zip, allCountries.zip or an extracted .txt
+    admin1 (str): path of admin1CodesASCII.txt
+    admin2 (str): path of admin2Codes.txt
+    feature_classes (tuple): feature classes to keep, None keeps all the rows
+    Returns:
+        LocationStore with the BUILD_COLUMNS columns
+    """
+    admin1_map, admin2_map = read_admin_codes(admin1), read_admin_codes(admin2)
+    builder = LocationStoreBuilder(BUILD_COLUMNS)
+    with open_dump(dump) as fd:
+        for _, values in read_geonames(fd, admin1_map, admin2_map, feature_classes, chunk_size):
+            builder.append_columns(values)
+    logger.info('Built %d locations from %s', builder.size, dump)
+    return builder.build()
+
+
+def build_index(dump, output, admin1=GN_ADMIN1, admin2=GN_ADMIN2, feature_classes=DEFAULT_FEATURE_CLASSES):
+    """
+    Function that builds the binary index of a local GeoNames dump, see build_locations
+    Returns:
+        the number of locations in the index
+    """
+    locations = build_locations(dump, admin1, admin2, feature_classes)
+    rg_index.save_index(locations, output)
+    return len(locations)
+
+
+def _daily_files(files):
+    """
+    Function that groups GeoNames daily files by the date in their name, in chronological order
+    """
+    days = {}
+    for path in files:
+        match = _DAILY_DATE.search(os.path.basename(path))
+        days.setdefault(match.group(1) if match else '', []).append(path)
+    return [days[day] for day in sorted(days)]
+
+
+@large_csv_fields()
+def update_locations(locations, modifications=(), deletes=(), admin1=GN_ADMIN1, admin2=GN_ADMIN2,
+                     feature_classes=DEFAULT_FEATURE_CLASSES):
+    """
+    Function that applies GeoNames daily files to locations built by build_locations. The days are applied
+    in the order of the dates in the file names: the modified records replace their previous version (or
+    are removed, if they are not of the kept feature classes anymore) and the deleted records are removed
+    Args:
+    locations (LocationStore): locations with a geoname_id column
+    modifications (list): paths of modifications-YYYY-MM-DD.txt files
+    deletes (list): paths of deletes-YYYY-MM-DD.txt files
+    Returns:
+        the updated LocationStore
+    """
+    if 'geoname_id' not in locations.fieldnames:
+        raise ValueError('Locations have no geoname_id column, build them with rvgeocoder.build')
+    admin1_map, admin2_map = read_admin_codes(admin1), read_admin_codes(admin2)
+    modifications, deletes = set(modifications), set(deletes)
+    current_ids = locations.numeric('geoname_id').astype(np.int64)
+
+    for day_files in _daily_files(modifications | deletes):
+        replaced_ids, deleted_ids, added, added_ids = [], [], [], []
+        for path in sorted(day_files):
+            with open(path, 'rt', encoding='utf-8', newline='') as fd:
+                if path in deletes:
+                    rows = csv.reader(fd, delimiter='\t', quoting=csv.QUOTE_NONE)
+                    deleted_ids.append(np.array([row[0] for row in rows if row], dtype=np.int64))
+                    continue
+                builder = LocationStoreBuilder(BUILD_COLUMNS)
+                for geoname_ids, values in read_geonames(fd, admin1_map, admin2_map, feature_classes):
+                    replaced_ids.append(geoname_ids)
+                    builder.append_columns(values)
+                added.append(builder.build())
+                added_ids.append(added[-1].numeric('geoname_id').astype(np.int64))
+
+        replaced_ids = np.concatenate(replaced_ids or [np.empty(0, dtype=np.int64)])
+        deleted_ids = np.concatenate(deleted_ids or [np.empty(0, dtype=np.int64)])
+        added = LocationStore.concat(added) if added else locations.subset([])
+        added_ids = np.concatenate(added_ids or [np.empty(0, dtype=np.int64)])
+        # a record modified twice on the same day keeps its last version, unless it is deleted as well
+        _, last = np.unique(added_ids[::-1], return_index=True)
+        keep_added = np.sort(len(added_ids) - 1 - last)
+        keep_added = keep_added[~np.isin(added_ids[keep_added], deleted_ids)]
+
+        keep = np.flatnonzero(~np.isin(current_ids, np.concatenate([replaced_ids, deleted_ids])))
+        logger.info('Applied %s: %d locations removed or replaced, %d added', ', '.join(sorted(day_files)),
+                    len(current_ids) - len(keep), len(keep_added))
+        locations = LocationStore.concat([locations.subset(keep), added.subset(keep_added)])
+        current_ids = np.concatenate([current_ids[keep], added_ids[keep_added]])
+    return locations
+
+
+def update_index(index_path, modifications=(), deletes=(), output=None, admin1=GN_ADMIN1, admin2=GN_ADMIN2,
+                 feature_classes=DEFAULT_FEATURE_CLASSES):
+    """
+    Function that applies GeoNames daily files to a binary index built by build_index, see update_locations
+    Args:
+    index_path (str): path of the index
+    output (str): OPTIONAL. path of the updated index, by default the index is replaced
+    Returns:
+        the number of locations in the updated index
+    """
+    locations = update_locations(rg_index.load_index(index_path), modifications, deletes, admin1, admin2,
+                                 feature_classes)
+    rg_index.save_index(locations, output or index_path)
+    return len(locations)
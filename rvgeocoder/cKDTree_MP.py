@@ -3,37 +3,155 @@
 Code extended from http://folk.uio.no/sturlamo/python/multiprocessing-tutorial.pdf
 """
 __author__ = 'Ajay Thampi'
+import itertools
+import os
+import queue
+import time
+import traceback
+import weakref
 import numpy as np
 import multiprocessing as mp
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import threading
 import ctypes
 from scipy.spatial import cKDTree
+from rvgeocoder import _fork
+from rvgeocoder.ordering import spatial_batch
+
+# Held while the workers are forked and while the parent registers shared memory blocks with the resource
+# tracker: a worker forked while another thread holds the lock of the tracker deadlocks on its first block
+_tracker_lock = threading.Lock()
+
+def _create_block(size):
+    with _tracker_lock:
+        return SharedMemory(create=True, size=size)
+
+def _release_block(block):
+    block.close()
+    with _tracker_lock:
+        block.unlink()
 
 def shmem_as_nparray(shmem_array):
     """
-    Function that converts a shared memory array (multiprocessing.Array) to a numpy array
+    Function that converts a shared memory array (multiprocessing.RawArray) to a numpy array
     """
-    return np.frombuffer(shmem_array.get_obj())
+    return np.frombuffer(shmem_array)
 
-def _pquery(scheduler, data, ndata, ndim, leafsize,
-            x, nx, d, i, k, eps, p, dub, ierr):
+def _batch_views(buf, nx, ndim, k):
     """
-    Function that parallelly queries the K-D tree based on chunks of data returned by the scheduler
+    Function that lays out the query points, distances and indices of a batch on a single shared buffer
     """
-    try:
-        _data = shmem_as_nparray(data).reshape((ndata, ndim))
-        _x = shmem_as_nparray(x).reshape((nx, ndim))
-        _d = shmem_as_nparray(d).reshape((nx, k))
-        _i = shmem_as_nparray(i).reshape((nx, k))
+    x_size = nx * ndim * 8
+    d_size = nx * k * 8
+    _x = np.ndarray((nx, ndim), dtype=np.float64, buffer=buf)
+    _d = np.ndarray((nx, k), dtype=np.float64, buffer=buf, offset=x_size)
+    _i = np.ndarray((nx, k), dtype=np.int64, buffer=buf, offset=x_size + d_size)
+    return _x, _d, _i
+
+def _batch_nbytes(nx, ndim, k):
+    return nx * ndim * 8 + 2 * nx * k * 8
+
+def _ball_views(buf, nx, ndim):
+    """
+    Function that lays out the query points, radii and counts/offsets of a radius batch on a single shared buffer
+    """
+    x_size = nx * ndim * 8
+    _x = np.ndarray((nx, ndim), dtype=np.float64, buffer=buf)
+    _r = np.ndarray((nx,), dtype=np.float64, buffer=buf, offset=x_size)
+    _n = np.ndarray((nx + 1,), dtype=np.int64, buffer=buf, offset=x_size + nx * 8)
+    return _x, _r, _n
+
+def _ball_nbytes(nx, ndim):
+    return nx * ndim * 8 + nx * 8 + (nx + 1) * 8
+
+def _task_query(kdtree, buffers, nx, ndim, args, s0, s1):
+    """
+    Task of a k nearest neighbours batch, the results are written to the distances and indices views
+    """
+    k, eps, p, dub = args
+    _x, _d, _i = _batch_views(buffers[0], nx, ndim, k)
+    d_out, i_out = kdtree.query(_x[s0:s1, :], k=k, eps=eps, p=p, distance_upper_bound=dub)
+    _d[s0:s1, :], _i[s0:s1, :] = d_out.reshape(-1, k), i_out.reshape(-1, k)
+
+def _task_count(kdtree, buffers, nx, ndim, args, s0, s1):
+    """
+    First pass of a radius batch, the number of neighbours of each point is written after its offset
+    """
+    eps, p = args
+    _x, _r, _n = _ball_views(buffers[0], nx, ndim)
+    _n[s0 + 1:s1 + 1] = kdtree.query_ball_point(_x[s0:s1, :], _r[s0:s1], p=p, eps=eps, return_length=True)
+
+def _task_ball(kdtree, buffers, nx, ndim, args, s0, s1):
+    """
+    Second pass of a radius batch, the neighbours are written at the offsets computed from the counts
+    """
+    eps, p = args
+    _x, _r, _n = _ball_views(buffers[0], nx, ndim)
+    _idx = np.ndarray((_n[nx],), dtype=np.int64, buffer=buffers[1])
+    neighbours = kdtree.query_ball_point(_x[s0:s1, :], _r[s0:s1], p=p, eps=eps, return_sorted=True)
+    start, stop = _n[s0], _n[s1]
+    _idx[start:stop] = np.fromiter(itertools.chain.from_iterable(neighbours), dtype=np.int64, count=stop - start)
+
+_TASKS = {'query': _task_query, 'count': _task_count, 'ball': _task_ball}
+
+def _pool_worker(worker_id, data, ndata, ndim, leafsize, tasks, results):
+    """
+    Function run by a long-lived pool worker. The K-D tree is built once from the shared data and
+    then chunks of query batches are served from the task queue until a None sentinel is received.
+    Results are (batch id, worker id, points, seconds, traceback of the error or None), the build of the
+    tree is reported as batch 0
+    """
+    start = time.perf_counter()
+    _data = shmem_as_nparray(data).reshape((ndata, ndim))
+    kdtree = cKDTree(_data, leafsize=leafsize)
+    results.put((0, worker_id, ndata, time.perf_counter() - start, None))
+
+    for task in iter(tasks.get, None):
+        batch_id, op, names, nx, args, s0, s1 = task
+        shmems = []
+        start = time.perf_counter()
+        try:
+            shmems = [SharedMemory(name=name) for name in names]
+            # the views of the task die with its frame, before the shared buffers are closed
+            _TASKS[op](kdtree, [shmem.buf for shmem in shmems], nx, ndim, args, s0, s1)
+            results.put((batch_id, worker_id, s1 - s0, time.perf_counter() - start, None))
+        except Exception:
+            results.put((batch_id, worker_id, s1 - s0, time.perf_counter() - start, traceback.format_exc()))
+        finally:
+            for shmem in shmems:
+                shmem.close()
 
-        kdtree = cKDTree(_data, leafsize=leafsize)
+def _shutdown_pool(procs, tasks, results):
+    """
+    Function that stops the workers of a pool. Registered as a finalizer so the pool is
+    released even if close() is never called
+    """
+    for _ in procs:
+        try:
+            tasks.put(None)
+        except (OSError, ValueError):
+            break
+    for proc in procs:
+        proc.join(timeout=5)
+        if proc.is_alive():
+            proc.terminate()
+            proc.join()
+    for q in (tasks, results):
+        q.close()
+        q.join_thread()
 
-        for s in scheduler:
-            d_out, i_out = kdtree.query(_x[s, :], k=k, eps=eps, p=p, distance_upper_bound=dub)
-            m_d = d_out.shape[0]
-            m_i = i_out.shape[0]
-            _d[s, :], _i[s, :] = d_out.reshape(m_d, 1), i_out.reshape(m_i, 1)
-    except:
-        ierr.value += 1
+@_fork.on_fork
+def _reinit_tracker_lock():
+    global _tracker_lock
+    _tracker_lock = threading.Lock()
+
+def _pool_allowed():
+    """
+    Function that tells whether this process can start a pool. Daemonic processes (e.g. the workers of a
+    multiprocessing.Pool) can not have children, their queries run in-process on all the CPUs instead
+    """
+    return not mp.current_process().daemon
 
 def num_cpus():
     """
@@ -47,114 +165,290 @@ def num_cpus():
 
 class cKDTree_MP(cKDTree):
     """ 
-    The parallelised cKDTree class
+    The parallelised cKDTree class.
+    Queries are served by a pool of long-lived worker processes, each holding its own copy of the tree.
+    The pool is started on the first call to pquery (or explicitly with start()) and is kept until
+    close() is called, so the process startup and tree build are paid once and not on every query.
     """
-    def __init__(self, data_list, leafsize=30):
+    def __init__(self, data_list, leafsize=30, nprocs=None, min_chunk=None, max_chunk=None):
         """ Class Instantiation
         Arguments are based on scipy.spatial.cKDTree class
+        nprocs (int): number of worker processes, defaults to the number of CPUs
+        min_chunk (int): smallest chunk of a batch handed to a worker, see Scheduler
+        max_chunk (int): largest chunk of a batch handed to a worker, see Scheduler
         """
         data = np.array(data_list)
         n, m = data.shape
-        self.shmem_data = mp.Array(ctypes.c_double, n*m)
+        # read only once built, a lock would only leave a semaphore behind in processes that never stop
+        # the tree (e.g. the daemonic workers of a multiprocessing.Pool, which are terminated)
+        self.shmem_data = mp.RawArray(ctypes.c_double, n*m)
 
         _data = shmem_as_nparray(self.shmem_data).reshape((n, m))
         _data[:, :] = data
 
         self._leafsize = leafsize
+        self._nprocs = nprocs or num_cpus()
+        self._min_chunk = min_chunk or Scheduler.MIN_CHUNK
+        self._max_chunk = max_chunk
+        self.last_stats = None
+        # rvgeocoder.metrics.QueryMetrics recording the stages of the batches, None disables it
+        self.metrics = None
+        self._procs = []
+        self._pool_pid = None
+        self._finalizer = None
+        self._batch_id = 0
+        self._batch_lock = threading.Lock()
         super(cKDTree_MP, self).__init__(_data, leafsize=leafsize)
+        _fork.register(self)
+
+    def _after_fork(self):
+        """
+        Function run in a forked child. The pool of a tree belongs to the parent process: the child must
+        not stop it at exit, and the batch lock may have been held by another thread of the parent
+        """
+        if self._finalizer is not None:
+            self._finalizer.detach()
+        # a bare os.fork keeps the parent processes in the multiprocessing children, which are terminated at exit
+        getattr(mp.process, '_children', set()).difference_update(self._procs)
+        self._finalizer = None
+        self._procs = []
+        self._pool_pid = None
+        self._batch_lock = threading.Lock()
+
+    def start(self):
+        """
+        Function to start the worker pool. Calling it on a running pool is a no-op
+        """
+        if self._procs and self._pool_pid == os.getpid():
+            return self
+        # a pool inherited through fork belongs to the parent process, start a fresh one
+        self._procs = []
+        start = time.perf_counter()
+
+        # workers must share the parent resource tracker, otherwise each of them tracks the
+        # batch buffers it attaches to and reports them as leaked when it exits
+        with _tracker_lock:
+            resource_tracker.ensure_running()
+            self._tasks = mp.Queue()
+            self._results = mp.Queue()
+            worker_args = (self.shmem_data, self.n, self.m, self._leafsize, self._tasks, self._results)
+            self._procs = [mp.Process(target=_pool_worker, args=(worker_id,) + worker_args, daemon=True)
+                           for worker_id in range(self._nprocs)]
+            for proc in self._procs: proc.start()
+        self._pool_pid = os.getpid()
+        self._finalizer = weakref.finalize(self, _shutdown_pool, self._procs, self._tasks, self._results)
+        if self.metrics is not None:
+            self.metrics.record('spawn', time.perf_counter() - start)
+        return self
+
+    def close(self):
+        """
+        Function to stop the worker pool. The pool is restarted by the next pquery call
+        """
+        if self._finalizer is not None and self._pool_pid == os.getpid():
+            self._finalizer()
+        self._finalizer = None
+        self._procs = []
+        self._pool_pid = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _wait_batch(self, batch_id, nchunks):
+        """
+        Function that waits until all the chunks of a batch were served.
+        Returns the tracebacks of the errors and the per-worker statistics of the batch
+        """
+        metrics = self.metrics
+        errors = []
+        workers = {}
+        while nchunks:
+            try:
+                done_id, worker_id, npoints, elapsed, err = self._results.get(timeout=1.0)
+            except queue.Empty:
+                if not all(proc.is_alive() for proc in self._procs):
+                    self.close()
+                    raise RuntimeError('worker process died while serving a query')
+                continue
+            if done_id == 0 and metrics is not None:
+                metrics.record('worker_build', elapsed, npoints)
+            if done_id == batch_id:
+                nchunks -= 1
+                if err is not None:
+                    errors.append(err)
+                if metrics is not None:
+                    metrics.record('worker_query', elapsed, npoints)
+                stats = workers.setdefault(worker_id, {'chunks': 0, 'points': 0, 'busy': 0.0})
+                stats['chunks'] += 1
+                stats['points'] += npoints
+                stats['busy'] += elapsed
+        return errors, workers
 
     def pquery(self, x_list, k=1, eps=0, p=2,
-               distance_upper_bound=np.inf):
+               distance_upper_bound=np.inf, reorder=False, dedupe=False):
         """
         Function to parallelly query the K-D Tree
+        reorder (bool): sort the points along a Morton curve before dispatching them to the workers, so
+                        each worker traverses the tree with neighbouring points
+        dedupe (bool): query each distinct point once (implies reorder)
         """
-        x = np.array(x_list)
+        x = np.asarray(x_list, dtype=np.float64)
+        if reorder or dedupe:
+            batch, restore = spatial_batch(x, dedupe)
+            d_out, i_out = self.pquery(batch, k, eps, p, distance_upper_bound)
+            return d_out[restore], i_out[restore]
+
         nx, mx = x.shape
-        shmem_x = mp.Array(ctypes.c_double, nx*mx)
-        shmem_d = mp.Array(ctypes.c_double, nx*k)
-        shmem_i = mp.Array(ctypes.c_double, nx*k)
+        if nx == 0:
+            _i = np.empty((0,) if k == 1 else (0, k), dtype=int)
+            return np.empty((0, k)), _i
+        if not _pool_allowed():
+            d_out, i_out = self.query(x, k=k, eps=eps, p=p, distance_upper_bound=distance_upper_bound, workers=-1)
+            return d_out.reshape(nx, k), i_out.astype(int)
 
-        _x = shmem_as_nparray(shmem_x).reshape((nx, mx))
-        _d = shmem_as_nparray(shmem_d).reshape((nx, k))
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        shmem = _create_block(_batch_nbytes(nx, mx, k))
+        try:
+            _x, _d, _i = _batch_views(shmem.buf, nx, mx, k)
+            _x[:, :] = x
+            if metrics is not None:
+                metrics.record('shm_copy', time.perf_counter() - start, nx)
+            self._run_batch('query', [shmem.name], nx, (k, eps, p, distance_upper_bound))
 
-        _i = shmem_as_nparray(shmem_i)
-        if k != 1:
-            _i = _i.reshape((nx, k))
+            if metrics is not None:
+                start = time.perf_counter()
+            d_out = _d.copy()
+            i_out = _i.astype(int).reshape(nx) if k == 1 else _i.astype(int)
+            if metrics is not None:
+                metrics.record('shm_copy', time.perf_counter() - start, nx)
+                metrics.batch(nx, len(self.last_stats['workers']))
+            return d_out, i_out
+        finally:
+            _x = _d = _i = None
+            _release_block(shmem)
 
-        _x[:, :] = x
+    def pquery_ball_point(self, x_list, r, p=2., eps=0):
+        """
+        Function to parallelly find all the points within distance r of each of the given points.
+        Runs in two passes over the pool: the workers count the neighbours of their chunks, then write
+        them at the offsets computed from the counts, straight into a shared result buffer
+        r (float or np.ndarray): radius, or radius of each point
+        Returns:
+            (offsets, indices) in CSR form: the neighbours of point n are indices[offsets[n]:offsets[n + 1]],
+            sorted by index
+        """
+        x = np.asarray(x_list, dtype=np.float64)
+        nx, mx = x.shape
+        if nx == 0:
+            return np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64)
+        if not _pool_allowed():
+            neighbours = self.query_ball_point(x, r, p=p, eps=eps, workers=-1, return_sorted=True)
+            offsets = np.zeros(nx + 1, dtype=np.int64)
+            np.cumsum(np.fromiter(map(len, neighbours), dtype=np.int64, count=nx), out=offsets[1:])
+            return offsets, np.fromiter(itertools.chain.from_iterable(neighbours), dtype=np.int64, count=offsets[-1])
 
-        nprocs = num_cpus()
-        scheduler = Scheduler(nx, nprocs)
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        shmem = _create_block(_ball_nbytes(nx, mx))
+        shmem_idx = None
+        try:
+            _x, _r, _n = _ball_views(shmem.buf, nx, mx)
+            _x[:, :] = x
+            _r[:] = r
+            _n[0] = 0
+            if metrics is not None:
+                metrics.record('shm_copy', time.perf_counter() - start, nx)
+            self._run_batch('count', [shmem.name], nx, (eps, p))
+            np.cumsum(_n, out=_n)
 
-        ierr = mp.Value(ctypes.c_int, 0)
+            # an empty shared memory block can not be created
+            shmem_idx = _create_block(max(int(_n[nx]), 1) * 8)
+            self._run_batch('ball', [shmem.name, shmem_idx.name], nx, (eps, p))
+            _idx = np.ndarray((_n[nx],), dtype=np.int64, buffer=shmem_idx.buf)
+            if metrics is not None:
+                start = time.perf_counter()
+            offsets, indices = _n.copy(), _idx.copy()
+            if metrics is not None:
+                metrics.record('shm_copy', time.perf_counter() - start, nx)
+                metrics.batch(nx, len(self.last_stats['workers']))
+            return offsets, indices
+        finally:
+            _x = _r = _n = _idx = None
+            for block in (shmem, shmem_idx):
+                if block is not None:
+                    _release_block(block)
 
-        query_args = (scheduler,
-                      self.shmem_data, self.n, self.m, self.leafsize,
-                      shmem_x, nx, shmem_d, shmem_i,
-                      k, eps, p, distance_upper_bound,
-                      ierr)
-        pool = [mp.Process(target=_pquery, args=query_args) for _ in range(nprocs)]
-        for p in pool: p.start()
-        for p in pool: p.join()
-        if ierr.value != 0:
-            raise RuntimeError('%d errors in worker processes' % (ierr.value))
+    def _run_batch(self, op, names, nx, args):
+        """
+        Function that splits a batch of nx points in chunks served by the pool and waits for all of them
+        op (str): the task run on each chunk, see _TASKS
+        names (list): names of the shared memory blocks of the batch
+        args (tuple): arguments of the task
+        """
+        with self._batch_lock:
+            self.start()
+            start = time.perf_counter()
+            self._batch_id += 1
+            scheduler = Scheduler(nx, self._nprocs, self._min_chunk, self._max_chunk)
+            for s in scheduler:
+                self._tasks.put((self._batch_id, op, names, nx, args, s.start, s.stop))
+            errors, workers = self._wait_batch(self._batch_id, scheduler.nchunks)
+            self.last_stats = _batch_stats(nx, scheduler.nchunks, time.perf_counter() - start, workers)
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.record('pool_query', self.last_stats['wall'], nx)
+            for error in errors:
+                metrics.error(error)
+        if errors:
+            raise RuntimeError('%d errors in worker processes, first error:\n%s' % (len(errors), errors[0]))
 
-        return _d.copy(), _i.astype(int).copy()
+def _batch_stats(npoints, nchunks, wall, workers):
+    """
+    Function that summarizes the per-worker statistics of a batch. imbalance is the ratio between the
+    busiest worker and the average busy time, 1.0 means a perfectly balanced batch
+    """
+    busy = [stats['busy'] for stats in workers.values()]
+    mean_busy = sum(busy) / len(busy) if busy else 0.0
+    return {'points': npoints,
+            'chunks': nchunks,
+            'wall': wall,
+            'workers': workers,
+            'imbalance': max(busy) / mean_busy if mean_busy else 1.0}
 
 class Scheduler:
     """
-    Scheduler that returns chunks of data to be queries on the K-D Tree.
-    The number of chunks is determined by the number of processes.
+    Guided scheduler that returns chunks of data to be queried on the K-D Tree.
+    Each chunk is the remaining data divided by (factor * nprocs), bounded by min_chunk and max_chunk:
+    chunks start large and shrink as the work drains, so a dense region or a slow core at the end of
+    a batch leaves the other workers idle for a short time only.
+    The chunks are planned in the parent process with a plain counter and pulled by idle workers from
+    the pool task queue, so there is no shared counter and no lock taken per fetch.
     """
-    def __init__(self, ndata, nprocs):
-        self._ndata = mp.RawValue(ctypes.c_int, ndata)
-        self._start = mp.RawValue(ctypes.c_int, 0)
-        self._lock = mp.Lock()
-        min_chunk = ndata // nprocs
-        min_chunk = ndata if min_chunk <= 2 else min_chunk
-        self._chunk = min_chunk
+    MIN_CHUNK = 1024
+
+    def __init__(self, ndata, nprocs, min_chunk=MIN_CHUNK, max_chunk=None, factor=2):
+        self._ndata = ndata
+        self._start = 0
+        self._divisor = max(1, factor * nprocs)
+        self._min_chunk = max(1, min_chunk)
+        self._max_chunk = max_chunk or ndata
+        self.nchunks = 0
 
     def __iter__(self):
         return self
 
-    def next(self): # Python 2 support
-        self._lock.acquire()
-        ndata = self._ndata.value
-        start = self._start.value
-        chunk = self._chunk
-        if ndata:
-            if chunk > ndata:
-                _s0 = start
-                _s1 = start + ndata
-                self._ndata.value = 0
-            else:
-                _s0 = start
-                _s1 = start + chunk
-                self._ndata.value = ndata - chunk
-                self._start.value = start + chunk
-            self._lock.release()
-            return slice(_s0, _s1)
-        else:
-            self._lock.release()
-            raise StopIteration
-
-    def __next__(self): # Python 3 support
-        self._lock.acquire()
-        ndata = self._ndata.value
-        start = self._start.value
-        chunk = self._chunk
-        if ndata:
-            if chunk > ndata:
-                _s0 = start
-                _s1 = start + ndata
-                self._ndata.value = 0
-            else:
-                _s0 = start
-                _s1 = start + chunk
-                self._ndata.value = ndata - chunk
-                self._start.value = start + chunk
-            self._lock.release()
-            return slice(_s0, _s1)
-        else:
-            self._lock.release()
+    def __next__(self):
+        remaining = self._ndata - self._start
+        if remaining <= 0:
             raise StopIteration
+        chunk = min(max(remaining // self._divisor, self._min_chunk), self._max_chunk, remaining)
+        _s0 = self._start
+        self._start += chunk
+        self.nchunks += 1
+        return slice(_s0, self._start)
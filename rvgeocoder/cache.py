@@ -0,0 +1,138 @@
+""" Cache of nearest location results
+
+Repeated coordinates (same venues, same devices) are answered from a bounded LRU cache instead of
+the K-D tree. Coordinates are quantized to a configurable number of decimals, and a batch is first
+deduplicated on the quantized keys so each distinct key is looked up (and queried) only once.
+Coordinates outside of [-90, 90] x [-180, 180] (e.g. 0..360 longitudes) or NaN have no key, they are
+queried as given and never cached.
+"""
+from collections import OrderedDict
+import threading
+import numpy as np
+from rvgeocoder import _fork
+
+# Highest precision whose keys fit in an int64
+MAX_PRECISION = 7
+
+
+class QueryCache:
+    """
+    LRU cache of (distance, index) results keyed on coordinates rounded to precision decimals.
+    The tree is queried with the rounded coordinates, so every coordinate sharing a key gets the same
+    result and distances are measured from the rounded coordinate (4 decimals = ~11m)
+    """
+    def __init__(self, maxsize=100000, precision=4):
+        """ Class Instantiation
+        Args:
+        maxsize (int): Maximal number of cached keys, least recently used keys are evicted first
+        precision (int): Number of decimals the coordinates are rounded to
+        """
+        if not 0 <= precision <= MAX_PRECISION:
+            raise ValueError('precision must be between 0 and %d' % MAX_PRECISION)
+        self.maxsize = maxsize
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self.queried = 0
+        self._scale = 10.0 ** precision
+        self._lon_span = int(360 * self._scale) + 1
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        _fork.register(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def _keys(self, quantized):
+        # only called on quantized coordinates within range, out of range keys would collide
+        lat_q = quantized[:, 0].astype(np.int64) + int(90 * self._scale)
+        lon_q = quantized[:, 1].astype(np.int64) + int(180 * self._scale)
+        return lat_q * self._lon_span + lon_q
+
+    def _in_range(self, quantized):
+        # NaN compares False, so it is out of range too
+        return ((np.abs(quantized[:, 0]) <= 90 * self._scale) &
+                (np.abs(quantized[:, 1]) <= 180 * self._scale))
+
+    def query(self, points, query_func):
+        """
+        Function that answers a batch of coordinates from the cache, querying only the missing keys
+        Args:
+        points (np.ndarray): float64 array of (lat, lon) of shape (n, 2)
+        query_func (callable): called with an array of missing (lat, lon) of shape (m, 2), returns
+                               (distances, indices) arrays of shape (m,)
+        Returns:
+            distances and indices arrays of shape (n,)
+        """
+        quantized = np.round(points * self._scale)
+        valid = self._in_range(quantized)
+        if not valid.all():
+            return self._query_partial(points, quantized, valid, query_func)
+        keys, first, inverse = np.unique(self._keys(quantized), return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse, minlength=len(keys))
+
+        dists = np.empty(len(keys), dtype=np.float64)
+        indices = np.empty(len(keys), dtype=np.intp)
+        missing = []
+        with self._lock:
+            entries = self._entries
+            for n, key in enumerate(keys.tolist()):
+                entry = entries.get(key)
+                if entry is None:
+                    missing.append(n)
+                else:
+                    entries.move_to_end(key)
+                    dists[n], indices[n] = entry
+
+        if missing:
+            missing = np.asarray(missing, dtype=np.intp)
+            m_dists, m_indices = query_func(quantized[first[missing]] / self._scale)
+            dists[missing] = m_dists
+            indices[missing] = m_indices
+            with self._lock:
+                entries = self._entries
+                for key, dist, index in zip(keys[missing].tolist(), m_dists.tolist(), m_indices.tolist()):
+                    entries[key] = (dist, index)
+                while len(entries) > self.maxsize:
+                    entries.popitem(last=False)
+
+        n_missing = int(counts[missing].sum()) if len(missing) else 0
+        with self._lock:
+            self.misses += n_missing
+            self.hits += len(points) - n_missing
+            self.queried += len(missing)
+        return dists[inverse], indices[inverse]
+
+    def _query_partial(self, points, quantized, valid, query_func):
+        """
+        Function that answers the coordinates within range from the cache and queries the others as given
+        """
+        dists = np.empty(len(points), dtype=np.float64)
+        indices = np.empty(len(points), dtype=np.intp)
+        if valid.any():
+            dists[valid], indices[valid] = self.query(points[valid], query_func)
+        invalid = ~valid
+        dists[invalid], indices[invalid] = query_func(points[invalid])
+        with self._lock:
+            self.misses += int(invalid.sum())
+        return dists, indices
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.queried = 0
+
+    def stats(self):
+        """
+        Function that returns the cache counters as a dict. hits and misses count coordinates,
+        queried counts the distinct keys sent to the tree after deduplication of the misses
+        """
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'queried': self.queried, 'size': len(self._entries),
+                'maxsize': self.maxsize, 'hit_rate': self.hits / total if total else 0.0}
@@ -0,0 +1,412 @@
+""" Hot-swappable, incrementally updatable geocoder
+
+A GeocoderHandle answers queries from a geocoder (the main tree) plus a small delta layer: the locations
+appended since the tree was built, searched by vectorized brute force, and the locations removed, masked
+out of the results. Once the delta reaches max_delta changes, a background compaction builds a new
+geocoder over the live locations and swaps it in. A freshly built geocoder (e.g. of a new index) can also
+be swapped in, right away or built in the background with reload.
+
+Queries see a consistent snapshot and are never blocked by a swap: a replaced geocoder is closed once its
+in-flight queries are done. Location indices are only valid within a generation of the handle, every swap
+(including compactions) renumbers the locations.
+"""
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import logging
+import threading
+import numpy as np
+
+from rvgeocoder import _as_points, _as_float_array, ecef_chord_to_km, geodetic_in_ecef
+from rvgeocoder.locations import LocationStore
+
+logger = logging.getLogger(__name__)
+
+# Number of delta changes (appended plus removed locations) that triggers a background compaction
+DEFAULT_MAX_DELTA = 1000
+
+# Largest number of point to delta location distances computed at once by the brute force search
+DELTA_BLOCK_SIZE = 1 << 20
+
+
+def warm_up(geocoder):
+    """
+    Function that builds the tree of a geocoder (and starts its worker pool in mode 2), so that it
+    answers its first query at full speed
+    """
+    geocoder.tree
+    return geocoder.start()
+
+
+class _Generation:
+    """
+    A geocoder of the handle and the number of queries in flight on it
+    """
+    def __init__(self, geocoder, number):
+        self.geocoder = geocoder
+        self.number = number
+        self.users = 0
+        self.retired = False
+
+
+class _LiveLocations(Sequence):
+    """
+    Locations of a snapshot: those of the geocoder followed by the appended ones, with the API of
+    LocationStore used to gather the results
+    """
+    def __init__(self, main, delta):
+        self.main = main
+        self.delta = delta
+        self.fieldnames = main.fieldnames
+        self.base = len(main)
+
+    def __len__(self):
+        return self.base + len(self.delta)
+
+    def __getitem__(self, index):
+        if index < self.base:
+            return self.main[index]
+        return self.delta[index - self.base]
+
+    def take(self, indices, columns=None):
+        indices = np.asarray(indices, dtype=np.intp)
+        appended = indices >= self.base
+        if not appended.any():
+            return self.main.take(indices, columns)
+        main = self.main.take(indices[~appended], columns)
+        delta = self.delta.take(indices[appended] - self.base, columns)
+        result = {}
+        for name, values in main.items():
+            result[name] = np.empty(len(indices), dtype=values.dtype)
+            result[name][~appended] = values
+            result[name][appended] = delta[name]
+        return result
+
+
+class _Snapshot:
+    """
+    Immutable state of the handle: a generation, the appended locations (and their coordinates in the
+    space of the tree) and the sorted indices of the removed locations
+    """
+    def __init__(self, generation, delta, removed):
+        geocoder = generation.geocoder
+        self.generation = generation
+        self.geocoder = geocoder
+        self.delta = delta
+        self.removed = removed
+        self.locations = _LiveLocations(geocoder.locations, delta)
+        self.base = self.locations.base
+        coords = np.asarray(delta.coords, dtype=np.float64).reshape(-1, 2)
+        self.delta_points = geodetic_in_ecef(coords) if geocoder.ecef else coords
+        self.delta_removed = removed[removed >= self.base] - self.base
+        self.main_removed = removed[removed < self.base]
+
+    @property
+    def changes(self):
+        return len(self.delta) + len(self.main_removed)
+
+
+class GeocoderHandle:
+    """
+    Handle over a geocoder supporting appended/removed locations and atomic swaps while queries keep flowing
+    """
+    def __init__(self, geocoder, max_delta=DEFAULT_MAX_DELTA, auto_compact=True):
+        """ Class Instantiation
+        Args:
+        geocoder (RGeocoderImpl): the initial geocoder, owned (closed) by the handle from now on
+        max_delta (int): number of appended plus removed locations that triggers a background compaction
+        auto_compact (bool): compact in the background once max_delta is reached, otherwise only compact
+                             when calling compact
+        """
+        self.max_delta = max_delta
+        self.auto_compact = auto_compact
+        self._lock = threading.Lock()
+        # runs the reloads and compactions one at a time
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='rvgeocoder-handle')
+        self._compaction = None
+        self._snapshot = self._new_snapshot(_Generation(geocoder, 0))
+
+    @staticmethod
+    def _new_snapshot(generation, delta=None, removed=None):
+        if delta is None:
+            delta = LocationStore.from_rows(generation.geocoder.locations.fieldnames, [])
+        if removed is None:
+            removed = np.empty(0, dtype=np.intp)
+        return _Snapshot(generation, delta, removed)
+
+    @property
+    def generation(self):
+        """
+        Number of the current generation, incremented by every swap and compaction
+        """
+        return self._snapshot.generation.number
+
+    @property
+    def geocoder(self):
+        """
+        The current geocoder, without the appended and removed locations
+        """
+        return self._snapshot.geocoder
+
+    @property
+    def fieldnames(self):
+        return self._snapshot.locations.fieldnames
+
+    def __len__(self):
+        snapshot = self._snapshot
+        return len(snapshot.locations) - len(snapshot.removed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Function that waits for the background work and closes the current geocoder
+        """
+        self._executor.shutdown()
+        with self._lock:
+            generation = self._snapshot.generation
+        generation.geocoder.close()
+
+    def _replace(self, snapshot):
+        """
+        Function that installs a new snapshot, must be called with the lock held. Returns the replaced
+        generation when it can be closed right away
+        """
+        previous = self._snapshot.generation
+        self._snapshot = snapshot
+        if snapshot.generation is not previous:
+            previous.retired = True
+            if previous.users == 0:
+                return previous
+        return None
+
+    @staticmethod
+    def _close(generation):
+        if generation is not None:
+            logger.debug('Closing geocoder of generation %d', generation.number)
+            generation.geocoder.close()
+
+    @contextlib.contextmanager
+    def _acquire(self):
+        """
+        Context of a query: the current snapshot, whose geocoder is not closed before the query is done
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            snapshot.generation.users += 1
+        try:
+            yield snapshot
+        finally:
+            generation = snapshot.generation
+            with self._lock:
+                generation.users -= 1
+                done = generation.retired and generation.users == 0
+            if done:
+                self._close(generation)
+
+    def swap(self, geocoder):
+        """
+        Function that atomically replaces the geocoder, dropping the appended and removed locations.
+        Queries in flight finish on the previous geocoder, which is closed afterwards
+        Args:
+        geocoder (RGeocoderImpl): the new geocoder, owned by the handle from now on. Its tree is built by
+                                  the first query, see reload to build it in the background
+        Returns:
+            the number of the new generation
+        """
+        with self._lock:
+            number = self._snapshot.generation.number + 1
+            replaced = self._replace(self._new_snapshot(_Generation(geocoder, number)))
+        self._close(replaced)
+        logger.info('Swapped to generation %d (%d locations)', number, len(geocoder.locations))
+        return number
+
+    def reload(self, factory):
+        """
+        Function that creates a geocoder and builds its tree in a background thread, then swaps it in
+        Args:
+        factory (callable): returns the new geocoder, e.g. lambda: RGeocoderImpl.from_index(path)
+        Returns:
+            concurrent.futures.Future of the number of the new generation
+        """
+        return self._executor.submit(lambda: self.swap(warm_up(factory())))
+
+    def add(self, locations):
+        """
+        Function that appends locations, searched by brute force until the next compaction
+        Args:
+        locations: a LocationStore with the columns of the geocoder, or an iterable of dicts of column
+                   values (missing columns are empty)
+        Returns:
+            int array of the indices of the appended locations
+        """
+        fieldnames = self.fieldnames
+        if not isinstance(locations, LocationStore):
+            rows = ([('' if row.get(name) is None else str(row.get(name))) for name in fieldnames]
+                    for row in locations)
+            locations = LocationStore.from_rows(fieldnames, rows, first_line=1)
+        with self._lock:
+            snapshot = self._snapshot
+            delta = LocationStore.concat([snapshot.delta, locations])
+            self._snapshot = _Snapshot(snapshot.generation, delta, snapshot.removed)
+            start = len(snapshot.locations)
+        self._check_delta()
+        return np.arange(start, start + len(locations))
+
+    def remove(self, indices, generation=None):
+        """
+        Function that removes locations from the results until the next compaction drops them
+        Args:
+        indices (array-like): indices of the locations, as returned by the queries
+        generation (int): OPTIONAL. generation the indices were obtained in, ValueError is raised when
+                          the handle was swapped since (the indices would designate other locations)
+        """
+        indices = np.unique(np.asarray(indices, dtype=np.intp))
+        with self._lock:
+            snapshot = self._snapshot
+            if generation is not None and generation != snapshot.generation.number:
+                raise ValueError('Indices of generation %d are stale, the handle is at generation %d' % (
+                    generation, snapshot.generation.number))
+            if len(indices) and (indices[0] < 0 or indices[-1] >= len(snapshot.locations)):
+                raise IndexError('Location indices out of range [0, %d)' % len(snapshot.locations))
+            removed = np.union1d(snapshot.removed, indices).astype(np.intp)
+            self._snapshot = _Snapshot(snapshot.generation, snapshot.delta, removed)
+        self._check_delta()
+
+    def _check_delta(self):
+        snapshot = self._snapshot
+        if self.auto_compact and snapshot.changes >= self.max_delta and isinstance(snapshot.geocoder.locations,
+                                                                                   LocationStore):
+            self.compact()
+
+    def compact(self):
+        """
+        Function that rebuilds the geocoder over the live locations in a background thread and swaps it in.
+        Changes made while compacting are carried over to the new generation
+        Returns:
+            concurrent.futures.Future, True once swapped, False when the handle was swapped meanwhile
+        """
+        if not isinstance(self._snapshot.geocoder.locations, LocationStore):
+            raise ValueError('Only geocoders of a LocationStore can be compacted, swap a rebuilt index instead')
+        with self._lock:
+            if self._compaction is None or self._compaction.done():
+                self._compaction = self._executor.submit(self._compact)
+            return self._compaction
+
+    def _compact(self):
+        snapshot = self._snapshot
+        main = snapshot.geocoder.locations
+        total = len(snapshot.locations)
+        keep = np.ones(total, dtype=bool)
+        keep[snapshot.removed] = False
+        store = LocationStore.concat([main.subset(np.flatnonzero(keep[:snapshot.base])),
+                                      snapshot.delta.subset(np.flatnonzero(keep[snapshot.base:]))])
+        geocoder = warm_up(snapshot.geocoder.with_locations(store))
+        renumber = np.cumsum(keep) - 1
+
+        with self._lock:
+            current = self._snapshot
+            if current.generation is not snapshot.generation:
+                replaced = geocoder
+                committed = False
+            else:
+                # appended and removed while compacting
+                delta = current.delta.subset(np.arange(len(snapshot.delta), len(current.delta)))
+                removed = np.setdiff1d(current.removed, snapshot.removed)
+                compacted = removed < total
+                removed = np.concatenate([renumber[removed[compacted]],
+                                          removed[~compacted] - total + len(store)]).astype(np.intp)
+                generation = _Generation(geocoder, current.generation.number + 1)
+                replaced = self._replace(_Snapshot(generation, delta, removed))
+                replaced = replaced and replaced.geocoder
+                committed = True
+        if replaced is not None:
+            replaced.close()
+        if committed:
+            logger.info('Compacted to generation %d (%d locations)', self.generation, len(store))
+        return committed
+
+    def _nearest(self, snapshot, points):
+        """
+        Function that finds the nearest live location of each coordinate, in the main tree and the delta
+        Returns:
+            distances and indices arrays, as RGeocoderImpl._query_latlon
+        """
+        geocoder = snapshot.geocoder
+        dists, indices = geocoder._query_latlon(points)
+        requery = np.flatnonzero(np.isin(indices, snapshot.main_removed)) if len(snapshot.main_removed) else []
+        if len(requery):
+            dists, indices = np.array(dists, dtype=np.float64), np.array(indices, dtype=np.intp)
+            # more neighbours until a live one is found, at most len(main_removed) of the nearest are removed
+            k = 1
+            while len(requery) and k <= len(snapshot.main_removed):
+                k = min(4 * k, len(snapshot.main_removed) + 1, snapshot.base)
+                r_dists, r_indices = geocoder._query_latlon_uncached(points[requery], k)
+                r_dists, r_indices = r_dists.reshape(len(requery), k), r_indices.reshape(len(requery), k)
+                r_dists[np.isin(r_indices, snapshot.main_removed) | (r_indices >= snapshot.base)] = np.inf
+                nearest = r_dists.argmin(axis=1)
+                dists[requery] = r_dists[np.arange(len(requery)), nearest]
+                indices[requery] = r_indices[np.arange(len(requery)), nearest]
+                requery = requery[np.isinf(dists[requery])]
+                if k == snapshot.base:
+                    break
+
+        if len(snapshot.delta) > len(snapshot.delta_removed):
+            tree_points = geodetic_in_ecef(points) if geocoder.ecef else points
+            delta_points = snapshot.delta_points
+            # |p - q|^2 - |p|^2 ranks the delta locations of a point, as a matrix product
+            delta_norms = (delta_points ** 2).sum(axis=1)
+            delta_norms[snapshot.delta_removed] = np.inf
+            block = max(1, DELTA_BLOCK_SIZE // len(delta_points))
+            dists, indices = np.array(dists, dtype=np.float64), np.array(indices, dtype=np.intp)
+            for start in range(0, len(points), block):
+                chunk = tree_points[start:start + block]
+                nearest = (delta_norms - 2 * chunk @ delta_points.T).argmin(axis=1)
+                d_dists = np.linalg.norm(chunk - delta_points[nearest], axis=1)
+                if geocoder.ecef:
+                    d_dists = ecef_chord_to_km(d_dists)
+                closer = np.flatnonzero(d_dists < dists[start:start + block])
+                dists[start + closer] = d_dists[closer]
+                indices[start + closer] = snapshot.base + nearest[closer]
+        return dists, indices
+
+    def query(self, coordinates):
+        """
+        Function to find the nearest live location of each coordinate, see RGeocoderImpl.query
+        """
+        points = _as_points(coordinates)
+        with self._acquire() as snapshot:
+            _, indices = self._nearest(snapshot, points)
+            return snapshot.geocoder._records(indices, points, snapshot.locations)
+
+    def query_dist(self, coordinates):
+        """
+        Function to find the nearest live location of each coordinate with its distance, see RGeocoderImpl.query_dist
+        """
+        points = _as_points(coordinates)
+        with self._acquire() as snapshot:
+            dists, indices = self._nearest(snapshot, points)
+            return list(zip(dists, snapshot.geocoder._records(indices, points, snapshot.locations)))
+
+    def query_array(self, lats, lons=None, return_distance=False, columns=None):
+        """
+        Function to find the nearest live location of arrays of coordinates, see RGeocoderImpl.query_array.
+        The indices are those of the current generation
+        """
+        lats = _as_float_array(lats)
+        points = lats.reshape(-1, 2) if lons is None else np.column_stack((lats, _as_float_array(lons)))
+        with self._acquire() as snapshot:
+            dists, indices = self._nearest(snapshot, points)
+            return snapshot.geocoder._array_result(points[:, 0], points[:, 1], dists, indices, return_distance,
+                                                   columns, snapshot.locations)
+
+    def query_columns(self, coordinates, columns=None):
+        """
+        Function to find the nearest live location of each coordinate as columns, see RGeocoderImpl.query_columns
+        """
+        result = self.query_array(_as_points(coordinates), columns=columns or self.fieldnames)
+        return {name: values for name, values in result.items() if name not in ('index', 'polygon')}
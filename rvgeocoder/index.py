@@ -0,0 +1,144 @@
+""" Precompiled binary index
+
+An index is a directory holding a json manifest and one .npy file per array of a LocationStore.
+The locations are saved in the order of the leaves of their K-D tree, so the tree is rebuilt
+faster and neighbouring locations are close in memory. All the arrays are loaded with
+np.load(mmap_mode='r'), so the location columns load in near constant time and processes on the
+same host share their page-cache pages. The tree itself is not saved: each process builds it from
+the coordinates on its first query, and mode 2 copies the coordinates to the shared memory of its
+worker pool.
+"""
+import json
+import os
+import shutil
+import numpy as np
+
+from rvgeocoder.locations import CategoricalColumn, LocationStore, StringColumn
+
+# Version of the index layout, bumped on any incompatible change
+INDEX_VERSION = 1
+
+INDEX_FORMAT = 'rvgeocoder-index'
+INDEX_MANIFEST = 'manifest.json'
+
+
+def _save_array(path, name, array):
+    np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(array), allow_pickle=False)
+    return name + '.npy'
+
+
+def _load_array(path, filename, mmap_mode):
+    try:
+        return np.load(os.path.join(path, filename), mmap_mode=mmap_mode, allow_pickle=False)
+    except ValueError:
+        # older numpy versions cannot memory map empty arrays
+        return np.load(os.path.join(path, filename), allow_pickle=False)
+
+
+def _save_strings(path, name, column):
+    return {'data': _save_array(path, name + '.data', column.data),
+            'offsets': _save_array(path, name + '.offsets', column.offsets)}
+
+
+def _load_strings(path, files, mmap_mode):
+    return StringColumn(_load_array(path, files['data'], mmap_mode),
+                        _load_array(path, files['offsets'], mmap_mode))
+
+
+def kd_order(coords, leafsize=30):
+    """
+    Function that returns the permutation of the coordinates following the leaves of their K-D tree
+    """
+    if not len(coords):
+        return np.arange(0)
+    from scipy.spatial import cKDTree
+    return cKDTree(coords, leafsize=leafsize).indices
+
+
+def sort_locations(locations, order):
+    """
+    Function that returns a new LocationStore with the locations permuted by order
+    """
+    return locations.subset(order)
+
+
+def save_index(locations, path, leafsize=30):
+    """
+    Function that writes a LocationStore as a binary index. The index is written next to path
+    and renamed when complete, so readers never see a partially written index
+    Args:
+    locations (LocationStore): the locations to save
+    path (str): directory of the index, replaced if exists
+    leafsize (int): leafsize of the K-D tree used to order the locations
+    """
+    locations = sort_locations(locations, kd_order(locations.coords, leafsize))
+
+    tmp_path = path.rstrip(os.sep) + '.tmp%d' % os.getpid()
+    os.makedirs(tmp_path)
+    try:
+        columns = {}
+        for n_col, name in enumerate(locations.fieldnames):
+            column = locations.columns[name]
+            key = 'col%d' % n_col
+            if isinstance(column, CategoricalColumn):
+                columns[name] = {'type': 'categorical',
+                                 'codes': _save_array(tmp_path, key + '.codes', column.codes),
+                                 'categories': _save_strings(tmp_path, key + '.categories', column.categories)}
+            else:
+                columns[name] = dict(type='string', **_save_strings(tmp_path, key, column))
+
+        manifest = {
+            'format': INDEX_FORMAT,
+            'version': INDEX_VERSION,
+            'size': len(locations),
+            'leafsize': leafsize,
+            'fieldnames': locations.fieldnames,
+            'coords': _save_array(tmp_path, 'coords', locations.coords),
+            'columns': columns,
+        }
+        with open(os.path.join(tmp_path, INDEX_MANIFEST), 'w') as fd:
+            json.dump(manifest, fd, indent=1)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def read_manifest(path):
+    """
+    Function that reads and validates the manifest of an index
+    """
+    with open(os.path.join(path, INDEX_MANIFEST)) as fd:
+        manifest = json.load(fd)
+    if manifest.get('format') != INDEX_FORMAT:
+        raise ValueError('%s is not a rvgeocoder index' % path)
+    if manifest.get('version') != INDEX_VERSION:
+        raise ValueError('Index %s has version %s, expected version %s. Please rebuild the index' % (
+            path, manifest.get('version'), INDEX_VERSION))
+    return manifest
+
+
+def load_index(path, mmap_mode='r'):
+    """
+    Function that loads a binary index as a LocationStore backed by memory mapped arrays
+    Args:
+    path (str): directory of the index
+    mmap_mode (str): mmap_mode passed to np.load, None loads the arrays in memory
+    """
+    manifest = read_manifest(path)
+    columns = {}
+    for name, files in manifest['columns'].items():
+        if files['type'] == 'categorical':
+            columns[name] = CategoricalColumn(_load_array(path, files['codes'], mmap_mode),
+                                              _load_strings(path, files['categories'], mmap_mode))
+        else:
+            columns[name] = _load_strings(path, files, mmap_mode)
+    coords = _load_array(path, manifest['coords'], mmap_mode)
+    return LocationStore(manifest['fieldnames'], coords, columns)
+
+
+def is_index(path):
+    return os.path.isfile(os.path.join(path, INDEX_MANIFEST))
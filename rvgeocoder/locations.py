@@ -0,0 +1,527 @@
+""" Columnar storage of the geocoded locations
+
+Instead of keeping one dict per location, every column is kept as a NumPy array:
+coordinates as float64, low cardinality columns (country code and admin regions) as
+integer codes into a table of categories, and any other text column as a single utf-8
+buffer with offsets. The source text of the coordinates is kept as well, so records
+are identical to the rows of the source file.
+"""
+from array import array
+from collections.abc import Sequence
+import contextlib
+import csv
+import gc
+import itertools
+import logging
+import sys
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Columns holding the coordinates of each location
+COORD_COLUMNS = ('lat', 'lon')
+
+# Columns with few distinct values, stored as codes into a table of categories
+CATEGORICAL_COLUMNS = ('cc', 'admin1', 'admin2', 'feature_code')
+
+# Number of rows converted at once when building a store from rows
+ROWS_CHUNK_SIZE = 65536
+
+# Number of malformed rows listed in errors and warnings
+MAX_REPORTED_ROWS = 10
+
+
+@contextlib.contextmanager
+def large_csv_fields():
+    """
+    Context manager (or decorator) lifting the csv field size limit while reading our files, whose fields
+    can be long (e.g. polygons in wkt format). The previous limit is restored on exit, so the csv module
+    of the application is left as is
+    """
+    previous = csv.field_size_limit(sys.maxsize)
+    try:
+        yield
+    finally:
+        csv.field_size_limit(previous)
+
+
+def parse_coordinates(lats, lons):
+    """
+    Function that converts the text of the lat/lon columns to a float64 array of shape (n, 2) in bulk
+    and validates the coordinates ranges
+    Returns:
+        the coordinates (NaN where the text is not a number) and a boolean array of the valid rows
+    """
+    coords = np.empty((len(lats), 2), dtype=np.float64)
+    for n_col, values in enumerate((lats, lons)):
+        try:
+            coords[:, n_col] = np.asarray(values, dtype=np.float64)
+        except ValueError:
+            # a malformed value in the chunk, convert one by one to find it
+            coords[:, n_col] = [_to_float(value) for value in values]
+    with np.errstate(invalid='ignore'):
+        valid = (np.abs(coords[:, 0]) <= 90) & (np.abs(coords[:, 1]) <= 180)
+    return coords, valid
+
+
+def invalid_report(invalid, lines, lats, lons):
+    """
+    Function that lists the line numbers and values of the first invalid rows, for errors and warnings
+    Args:
+    invalid (np.ndarray): positions of the invalid rows
+    lines (list): line number of each row
+    lats (list): text of the latitude of each row
+    lons (list): text of the longitude of each row
+    """
+    report = ', '.join('line %d (%r, %r)' % (lines[n], lats[n], lons[n]) for n in invalid[:MAX_REPORTED_ROWS])
+    if len(invalid) > MAX_REPORTED_ROWS:
+        report += ' and %d more' % (len(invalid) - MAX_REPORTED_ROWS)
+    return report
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+class StringColumn:
+    """
+    Column of strings stored as one utf-8 encoded buffer and the offsets of each value in it
+    """
+    def __init__(self, data, offsets):
+        """ Class Instantiation
+        Args:
+        data (np.ndarray): uint8 array with the encoded values one after the other
+        offsets (np.ndarray): int64 array of size n + 1, value i is data[offsets[i]:offsets[i + 1]]
+        """
+        self.data = data
+        self.offsets = offsets
+        self._view = memoryview(data)
+
+    def __reduce__(self):
+        return type(self), (np.asarray(self.data), np.asarray(self.offsets))
+
+    @classmethod
+    def from_strings(cls, values):
+        encoded = [value.encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return str(self._view[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+    def take(self, indices):
+        """
+        Function that returns the values at the given indices as an object array
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        values = np.empty(len(indices), dtype=object)
+        view = self._view
+        starts = self.offsets[:-1][indices].tolist()
+        ends = self.offsets[1:][indices].tolist()
+        values[:] = [str(view[start:end], 'utf-8') for start, end in zip(starts, ends)]
+        return values
+
+    def to_numpy(self):
+        return self.take(np.arange(len(self)))
+
+    def subset(self, indices):
+        """
+        Function that returns a new column with the values at the given indices, gathering the encoded
+        bytes at once instead of decoding each value
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        starts = self.offsets[:-1][indices]
+        lengths = self.offsets[1:][indices] - starts
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # position of each byte of the result in the source buffer
+        positions = np.arange(offsets[-1], dtype=np.int64) + np.repeat(starts - offsets[:-1], lengths)
+        return StringColumn(np.asarray(self.data)[positions], offsets)
+
+    @classmethod
+    def concat(cls, columns):
+        """
+        Function that concatenates string columns
+        """
+        data = np.concatenate([np.asarray(column.data, dtype=np.uint8) for column in columns])
+        ends = [column.offsets[1:] for column in columns]
+        shifts = np.cumsum([0] + [column.offsets[-1] for column in columns[:-1]])
+        offsets = np.concatenate([np.zeros(1, dtype=np.int64)] + [end + shift for end, shift in zip(ends, shifts)])
+        return cls(data, offsets)
+
+
+class CategoricalColumn:
+    """
+    Column of strings stored as int32 codes into a (small) column of distinct values
+    """
+    def __init__(self, codes, categories, values=None):
+        """ Class Instantiation
+        Args:
+        codes (np.ndarray): int32 array, code of the category of each value
+        categories (StringColumn): the distinct values of the column
+        values (np.ndarray): OPTIONAL. the categories already decoded, as an object array
+        """
+        self.codes = codes
+        self.categories = categories
+        self._values = categories.to_numpy() if values is None else values
+
+    def __reduce__(self):
+        return type(self), (np.asarray(self.codes), self.categories)
+
+    @classmethod
+    def from_strings(cls, values):
+        table = {}
+        codes = np.fromiter((table.setdefault(value, len(table)) for value in values),
+                            dtype=np.int32, count=len(values))
+        return cls(codes, StringColumn.from_strings(list(table)))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return self._values[self.codes[index]]
+
+    def take(self, indices):
+        """
+        Function that returns the values at the given indices as an object array
+        """
+        return self._values[self.codes[indices]]
+
+    def subset(self, indices):
+        """
+        Function that returns a new column with the values at the given indices. Only the categories in use
+        are kept, so small subsets (e.g. the shards of a sharded index) do not carry the whole table
+        """
+        used, codes = np.unique(np.asarray(self.codes)[indices], return_inverse=True)
+        return CategoricalColumn(codes.reshape(-1).astype(np.int32), self.categories.subset(used), self._values[used])
+
+    @classmethod
+    def concat(cls, columns):
+        """
+        Function that concatenates categorical columns, the codes are remapped to the union of the categories
+        """
+        table = {}
+        codes = []
+        for column in columns:
+            remap = np.array([table.setdefault(value, len(table)) for value in column.categories.to_numpy()],
+                             dtype=np.int32)
+            codes.append(remap[column.codes] if len(remap) else np.asarray(column.codes, dtype=np.int32))
+        return cls(np.concatenate(codes), StringColumn.from_strings(list(table)))
+
+    def to_numpy(self):
+        return self._values[self.codes]
+
+
+class StringColumnBuilder:
+    """
+    Incremental builder of a StringColumn, values are encoded as they are appended
+    """
+    def __init__(self):
+        self._data = bytearray()
+        self._offsets = array('q', [0])
+
+    def extend(self, values):
+        if not len(values):
+            return
+        joined = '\0'.join(values)
+        if joined.count('\0') != len(values) - 1:
+            # a value holds a NUL character, encode the values one by one
+            encoded = [value.encode('utf-8') for value in values]
+            ends = np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)))
+            data = b''.join(encoded)
+        else:
+            # encode the chunk at once, the separators positions give the values ends
+            buffer = np.frombuffer(joined.encode('utf-8'), dtype=np.uint8)
+            separators = np.flatnonzero(buffer == 0)
+            ends = np.append(separators - np.arange(len(separators)), len(buffer) - len(separators))
+            data = buffer[buffer != 0].tobytes() if len(separators) else buffer.tobytes()
+        self._offsets.frombytes((ends + len(self._data)).tobytes())
+        self._data += data
+
+    def build(self):
+        return StringColumn(np.frombuffer(self._data, dtype=np.uint8),
+                            np.frombuffer(self._offsets, dtype=np.int64))
+
+
+class CategoricalColumnBuilder:
+    """
+    Incremental builder of a CategoricalColumn
+    """
+    def __init__(self):
+        self._table = {}
+        self._codes = array('i')
+
+    def extend(self, values):
+        table = self._table
+        for value in [value for value in dict.fromkeys(values) if value not in table]:
+            table[value] = len(table)
+        self._codes.extend(map(table.__getitem__, values))
+
+    def build(self):
+        return CategoricalColumn(np.frombuffer(self._codes, dtype=np.int32),
+                                 StringColumn.from_strings(list(self._table)))
+
+
+class LocationStoreBuilder:
+    """
+    Incremental builder of a LocationStore. Rows are appended in chunks and converted right away
+    to the compact columns, so building takes memory proportional to the output only
+    """
+    def __init__(self, fieldnames, skip_invalid=False, first_line=2):
+        """ Class Instantiation
+        Args:
+        fieldnames (list): names of the columns, must include lat and lon
+        skip_invalid (bool): skip (and log) rows with malformed or out of range coordinates instead of raising
+        first_line (int): line number of the first appended row, used to report malformed rows
+        """
+        self.fieldnames = list(fieldnames)
+        missing = [name for name in COORD_COLUMNS if name not in self.fieldnames]
+        if missing:
+            raise ValueError('Locations must have %s columns, found header - %s' % (
+                '/'.join(COORD_COLUMNS), ','.join(self.fieldnames)))
+        self.skip_invalid = skip_invalid
+        self.line = first_line
+        self.skipped = 0
+        self._coords = {name: array('d') for name in COORD_COLUMNS}
+        self._columns = {name: CategoricalColumnBuilder() if name in CATEGORICAL_COLUMNS else StringColumnBuilder()
+                         for name in self.fieldnames}
+        self.size = 0
+
+    def append_columns(self, values, lines=None):
+        """
+        Function that appends locations given as a list of values for each column (ordered as fieldnames)
+        Args:
+        values (list): list of the same length as fieldnames, each item is the list of the column values
+        lines (list): OPTIONAL. line number of each location, by default numbered from the current line
+        """
+        data = dict(zip(self.fieldnames, values))
+        count = len(data[COORD_COLUMNS[0]])
+        if lines is None:
+            lines = range(self.line, self.line + count)
+            self.line += count
+        coords, valid = parse_coordinates(*(data[name] for name in COORD_COLUMNS))
+        if not valid.all():
+            data, coords = self._drop_invalid(data, coords, valid, lines)
+        for n_col, name in enumerate(COORD_COLUMNS):
+            self._coords[name].frombytes(coords[:, n_col].tobytes())
+        for name, builder in self._columns.items():
+            builder.extend(data[name])
+        self.size += len(coords)
+
+    def _drop_invalid(self, data, coords, valid, lines):
+        invalid = np.flatnonzero(~valid)
+        report = invalid_report(invalid, lines, *(data[name] for name in COORD_COLUMNS))
+        if not self.skip_invalid:
+            raise ValueError('Malformed or out of range coordinates at %s' % report)
+        logger.warning('Skipping %d locations with malformed or out of range coordinates at %s',
+                       len(invalid), report)
+        self.skipped += len(invalid)
+        keep = np.flatnonzero(valid)
+        data = {name: [column[n] for n in keep] for name, column in data.items()}
+        return data, coords[keep]
+
+    def append_rows(self, rows, chunk_size=ROWS_CHUNK_SIZE, chunk_filter=None):
+        """
+        Function that appends csv rows (lists of values ordered as fieldnames), consumed in chunks
+        Args:
+        rows (iterable): rows, e.g. a csv.reader
+        chunk_size (int): number of rows converted at once
+        chunk_filter (callable): OPTIONAL. called with each chunk (list of rows), returns the rows to append
+        """
+        rows = iter(rows)
+        # the rows are acyclic lists of strings, running the garbage collector every few hundred
+        # allocations while parsing millions of them only costs time
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk:
+                    return
+                if chunk_filter is not None:
+                    chunk = chunk_filter(chunk)
+                self.append_chunk(chunk)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def append_chunk(self, rows):
+        ncols = len(self.fieldnames)
+        lines = None
+        if set(map(len, rows)) != {ncols}:
+            first_line = self.line
+            self.line += len(rows)
+            lines = [line for line, row in enumerate(rows, first_line) if row]
+            # same as csv.DictReader, blank lines are skipped, missing values are empty and extra ones are ignored
+            rows = [row if len(row) == ncols else (row + [''] * ncols)[:ncols] for row in rows if row]
+        if rows:
+            self.append_columns(list(zip(*rows)), lines)
+
+    def build(self):
+        coords = np.empty((self.size, 2), dtype=np.float64)
+        for n_col, name in enumerate(COORD_COLUMNS):
+            coords[:, n_col] = np.frombuffer(self._coords[name], dtype=np.float64)
+        columns = {name: builder.build() for name, builder in self._columns.items()}
+        return LocationStore(self.fieldnames, coords, columns)
+
+
+class LocationStore(Sequence):
+    """
+    Read-only sequence of locations kept as columns. Indexing with an integer returns
+    the location as a dict (the same record csv.DictReader would have produced),
+    while take() gathers whole columns as arrays.
+    """
+    def __init__(self, fieldnames, coords, columns):
+        """ Class Instantiation
+        Args:
+        fieldnames (list): names of all the columns, in the order of the source file
+        coords (np.ndarray): float64 array of shape (n, 2) with the lat/lon of each location
+        columns (dict): column name to StringColumn/CategoricalColumn, the coordinates columns hold their
+                        source text
+        """
+        self.fieldnames = list(fieldnames)
+        self.coords = coords
+        self.columns = columns
+        self._numeric = {}
+
+    def __reduce__(self):
+        return type(self), (self.fieldnames, np.asarray(self.coords), self.columns)
+
+    @classmethod
+    def from_columns(cls, fieldnames, values, skip_invalid=False):
+        """
+        Function that builds the store from a list of values for each column
+        Args:
+        fieldnames (list): names of the columns, must include lat and lon
+        values (list): list of the same length as fieldnames, each item is the list of the column values
+        skip_invalid (bool): skip rows with malformed or out of range coordinates instead of raising ValueError
+        """
+        builder = LocationStoreBuilder(fieldnames, skip_invalid, first_line=1)
+        builder.append_columns(values)
+        return builder.build()
+
+    @classmethod
+    def from_rows(cls, fieldnames, rows, skip_invalid=False, first_line=2):
+        """
+        Function that builds the store from csv rows (lists of values ordered as fieldnames).
+        The rows are consumed in chunks, so rows can be a reader over a file of any size.
+        Malformed or out of range coordinates raise ValueError with their line numbers (counted from
+        first_line), or are skipped with a warning when skip_invalid is set
+        """
+        builder = LocationStoreBuilder(fieldnames, skip_invalid, first_line)
+        builder.append_rows(rows)
+        return builder.build()
+
+    def subset(self, indices):
+        """
+        Function that returns a new store with the locations at the given indices
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        columns = {name: column.subset(indices) for name, column in self.columns.items()}
+        return LocationStore(self.fieldnames, np.asarray(self.coords)[indices], columns)
+
+    @classmethod
+    def concat(cls, stores):
+        """
+        Function that concatenates stores with the same fieldnames
+        """
+        fieldnames = stores[0].fieldnames
+        for store in stores[1:]:
+            if store.fieldnames != fieldnames:
+                raise ValueError('Cannot concatenate locations with different columns. Expected %s, found %s' % (
+                    fieldnames, store.fieldnames))
+        columns = {name: type(stores[0].columns[name]).concat([store.columns[name] for store in stores])
+                   for name in fieldnames}
+        return cls(fieldnames, np.concatenate([store.coords for store in stores]), columns)
+
+    def iter_rows(self, chunk_size=ROWS_CHUNK_SIZE):
+        """
+        Function that iterates the locations as tuples of strings ordered as fieldnames, e.g. for csv.writer
+        """
+        for start in range(0, len(self), chunk_size):
+            indices = np.arange(start, min(start + chunk_size, len(self)))
+            yield from zip(*(self.columns[name].take(indices) for name in self.fieldnames))
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[n] for n in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return {name: self.columns[name][index] for name in self.fieldnames}
+
+    def column(self, name):
+        """
+        Function that returns a whole column as an array, lat/lon as float64
+        """
+        if name in COORD_COLUMNS:
+            return self.coords[:, COORD_COLUMNS.index(name)]
+        return self.columns[name].to_numpy()
+
+    def numeric(self, name, default=0.0):
+        """
+        Function that returns a column parsed as float64 (default for empty or malformed values).
+        The array is parsed once and cached
+        """
+        if name in COORD_COLUMNS:
+            return self.column(name)
+        if name not in self._numeric:
+            text = self.columns[name].to_numpy()
+            try:
+                values = np.asarray(text, dtype=np.float64)
+            except ValueError:
+                values = np.fromiter((_to_float(value) for value in text), dtype=np.float64, count=len(text))
+            values[np.isnan(values)] = default
+            self._numeric[name] = values
+        return self._numeric[name]
+
+    def map_values(self, name, mapping, default=1.0):
+        """
+        Function that maps the values of a column to float64 with a dict (default for missing keys).
+        Categorical columns are mapped once per distinct value
+        """
+        column = self.columns[name]
+        if isinstance(column, CategoricalColumn):
+            table = np.array([mapping.get(value, default) for value in column.categories.to_numpy()],
+                             dtype=np.float64)
+            return table[column.codes]
+        return np.fromiter((mapping.get(value, default) for value in column.to_numpy()), dtype=np.float64,
+                           count=len(column))
+
+    def take(self, indices, columns=None):
+        """
+        Function that gathers the given columns (all by default) at the given indices, lat/lon as float64
+        Args:
+        indices (np.ndarray): integer array of locations indices
+        columns (list): OPTIONAL. names of the columns to gather
+        Returns:
+            dict of column name to array
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        result = {}
+        for name in columns or self.fieldnames:
+            if name in COORD_COLUMNS:
+                result[name] = self.coords[indices, COORD_COLUMNS.index(name)]
+            else:
+                result[name] = self.columns[name].take(indices)
+        return result
+
+    def take_values(self, indices, columns=None):
+        """
+        Function that gathers the given columns (all by default) at the given indices as stored, lat/lon
+        as their source text like in the records
+        Returns:
+            dict of column name to object array
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        return {name: self.columns[name].take(indices) for name in columns or self.fieldnames}
@@ -0,0 +1,118 @@
+""" Instrumentation of the query pipeline
+
+A QueryMetrics assigned to the metrics attribute of a geocoder records the time spent in each stage of
+its queries, the batch sizes, the number of workers serving them and the errors (with the traceback of
+worker exceptions). Stages:
+    - convert: conversion of the input coordinates to a float64 array
+    - tree: query of the tree (all the stages of the pool below in mode 2)
+    - assemble: gathering of the records/columns of the results
+and in mode 2 (cKDTree_MP):
+    - spawn: start of the worker pool
+    - worker_build: build of the tree in a worker (reported by each worker of a new pool)
+    - shm_copy: copy of the points to the shared memory of a batch and of the results back
+    - pool_query: dispatch of a batch to the workers until all its chunks are served
+    - worker_query: query of a chunk by a worker
+
+Metrics are disabled by default (metrics is None), the instrumented code then only checks for None.
+"""
+from collections import defaultdict, deque
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Number of recent samples kept per stage to compute the percentiles
+METRICS_WINDOW = 10000
+
+# Number of recent errors kept with their message
+MAX_ERRORS = 10
+
+
+def percentiles(values, prefix):
+    """
+    Function that returns the p50/p99/max of values, keyed prefix_p50, prefix_p99 and prefix_max
+    """
+    if not values:
+        return {prefix + '_p50': 0.0, prefix + '_p99': 0.0, prefix + '_max': 0.0}
+    values = np.fromiter(values, dtype=np.float64, count=len(values))
+    p50, p99 = np.percentile(values, (50, 99))
+    return {prefix + '_p50': float(p50), prefix + '_p99': float(p99), prefix + '_max': float(values.max())}
+
+
+class QueryMetrics:
+    """
+    Per-stage timings, batch sizes, worker counts and errors of the queries of a geocoder
+    """
+    def __init__(self, window=METRICS_WINDOW, callback=None):
+        """ Class Instantiation
+        Args:
+        window (int): number of recent samples the percentiles are computed on
+        callback (callable): OPTIONAL. called as callback(stage, seconds, points) for every recorded stage,
+                             and callback('error', 0.0, message) for every error, e.g. to export traces
+        """
+        self.window = window
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        """
+        Function that clears all the metrics
+        """
+        self.batches = 0
+        self.points = 0
+        self.errors = 0
+        self.last_errors = deque(maxlen=MAX_ERRORS)
+        self._count = defaultdict(int)
+        self._total = defaultdict(float)
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._batch_sizes = deque(maxlen=self.window)
+        self._workers = deque(maxlen=self.window)
+
+    def record(self, stage, elapsed, points=0):
+        """
+        Function that records the duration of a stage
+        Args:
+        stage (str): name of the stage
+        elapsed (float): duration in seconds
+        points (int): number of points processed by the stage
+        """
+        self._count[stage] += 1
+        self._total[stage] += elapsed
+        self._samples[stage].append(elapsed * 1e6)
+        if self.callback is not None:
+            self.callback(stage, elapsed, points)
+
+    def batch(self, size, workers=1):
+        """
+        Function that records a batch of points sent to the tree and the number of workers serving it
+        """
+        self.batches += 1
+        self.points += size
+        self._batch_sizes.append(size)
+        self._workers.append(workers)
+
+    def error(self, message):
+        """
+        Function that records an error, e.g. the traceback of a worker exception
+        """
+        self.errors += 1
+        self.last_errors.append(message)
+        logger.debug('Query error: %s', message)
+        if self.callback is not None:
+            self.callback('error', 0.0, message)
+
+    def stats(self):
+        """
+        Function that returns the metrics as a dict. For each stage: its count, total seconds and the
+        percentiles of its duration in microseconds (stage_us_p50...), over the last window samples
+        """
+        result = {'batches': self.batches, 'points': self.points, 'errors': self.errors,
+                  'last_errors': list(self.last_errors),
+                  'mean_batch_size': self.points / self.batches if self.batches else 0.0}
+        result.update(percentiles(self._batch_sizes, 'batch_size'))
+        result.update(percentiles(self._workers, 'workers'))
+        for stage in sorted(self._count):
+            result[stage + '_count'] = self._count[stage]
+            result[stage + '_s'] = self._total[stage]
+            result.update(percentiles(self._samples[stage], stage + '_us'))
+        return result
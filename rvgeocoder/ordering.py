@@ -0,0 +1,92 @@
+""" Spatial ordering of query batches
+
+Randomly ordered points make every tree traversal start from a cold cache. Sorting a batch along a
+Morton (Z-order) curve makes consecutive queries visit the same tree nodes, and sorting also puts
+duplicated points next to each other so they can be queried once. Results of the reordered batch
+are scattered back to the original order with the restore index.
+"""
+import numpy as np
+
+
+def _spread_bits_2d(values):
+    """
+    Function that spreads the lower 32 bits of values so there is one zero bit between each two bits
+    """
+    values = values & 0x00000000FFFFFFFF
+    values = (values | (values << 16)) & 0x0000FFFF0000FFFF
+    values = (values | (values << 8)) & 0x00FF00FF00FF00FF
+    values = (values | (values << 4)) & 0x0F0F0F0F0F0F0F0F
+    values = (values | (values << 2)) & 0x3333333333333333
+    values = (values | (values << 1)) & 0x5555555555555555
+    return values
+
+
+def _spread_bits_3d(values):
+    """
+    Function that spreads the lower 21 bits of values so there are two zero bits between each two bits
+    """
+    values = values & 0x1FFFFF
+    values = (values | (values << 32)) & 0x1F00000000FFFF
+    values = (values | (values << 16)) & 0x1F0000FF0000FF
+    values = (values | (values << 8)) & 0x100F00F00F00F00F
+    values = (values | (values << 4)) & 0x10C30C30C30C30C3
+    values = (values | (values << 2)) & 0x1249249249249249
+    return values
+
+
+def morton_codes(points):
+    """
+    Function that returns the Morton code of each point of a (n, 2) or (n, 3) array. Each dimension is
+    scaled to the bounding box of the batch before its bits are interleaved
+    """
+    points = np.asarray(points, dtype=np.float64)
+    ndim = points.shape[1]
+    if ndim == 2:
+        bits, spread = 32, _spread_bits_2d
+    elif ndim == 3:
+        bits, spread = 21, _spread_bits_3d
+    else:
+        raise ValueError('Morton codes are supported for 2 or 3 dimensions, got %d' % ndim)
+
+    low = points.min(axis=0)
+    span = points.max(axis=0) - low
+    span[span == 0] = 1.0
+    scaled = ((points - low) * ((2 ** bits - 1) / span)).astype(np.uint64)
+
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for dim in range(ndim):
+        codes |= spread(scaled[:, dim]) << np.uint64(dim)
+    return codes
+
+
+def spatial_batch(points, dedupe=False):
+    """
+    Function that reorders a batch of points along a Morton curve, optionally dropping duplicated points
+    Args:
+    points (np.ndarray): float64 array of shape (n, ndim)
+    dedupe (bool): query each distinct point once
+    Returns:
+        (batch, restore) where batch are the points to query and results[restore] is in the original order
+    """
+    n = len(points)
+    if n < 2:
+        return points, np.arange(n)
+
+    codes = morton_codes(points)
+    if dedupe:
+        # equal points have equal codes, sort by the coordinates as well so they are adjacent
+        order = np.lexsort(tuple(points[:, dim] for dim in reversed(range(points.shape[1]))) + (codes,))
+    else:
+        order = np.argsort(codes, kind='stable')
+    batch = points[order]
+
+    restore = np.empty(n, dtype=np.intp)
+    if dedupe:
+        keep = np.empty(n, dtype=bool)
+        keep[0] = True
+        np.any(batch[1:] != batch[:-1], axis=1, out=keep[1:])
+        restore[order] = np.cumsum(keep) - 1
+        batch = batch[keep]
+    else:
+        restore[order] = np.arange(n)
+    return batch, restore
@@ -0,0 +1,100 @@
+""" Spatial index of polygons
+
+Point-in-polygon lookups for batches of coordinates, using an STRtree over the polygons and the
+vectorized predicates of shapely 2. Points outside of the bounding box of all the polygons are
+discarded before any tree query, so batches far from the polygons cost a couple of comparisons.
+"""
+import csv
+import logging
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from rvgeocoder.locations import large_csv_fields
+
+logger = logging.getLogger(__name__)
+
+
+class PolygonIndex:
+    """
+    Index of polygons answering which polygon (if any) contains each point of a batch
+    """
+    def __init__(self, geometries, names=None, attributes=None):
+        """ Class Instantiation
+        Args:
+        geometries (list): shapely polygons/multipolygons
+        names (list): OPTIONAL. name of each polygon, used for logging
+        attributes (list): OPTIONAL. dict of attributes of each polygon (name/cc/admin1/admin2...)
+        """
+        self.geometries = np.asarray(geometries, dtype=object)
+        self.names = list(names) if names is not None else ['unnamed-polygon'] * len(self.geometries)
+        self.attributes = attributes if attributes is not None else [{} for _ in self.geometries]
+        self.columns = {}
+        for name in dict.fromkeys(key for attrs in self.attributes for key in attrs):
+            self.columns[name] = np.array([attrs.get(name, '') for attrs in self.attributes], dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = STRtree(self.geometries)
+        if len(self.geometries):
+            self.bounds = shapely.total_bounds(self.geometries)
+        else:
+            self.bounds = np.array([np.inf, np.inf, -np.inf, -np.inf])
+
+    @staticmethod
+    @large_csv_fields()
+    def read_file(polygons_file):
+        """
+        Function that reads a polygons csv file, with a geometry column in wkt format
+        Returns:
+            the header of the file, the rows as dicts and the geometries array
+        """
+        with open(polygons_file, 'r') as fd:
+            poly_reader = csv.DictReader(fd)
+            rows = list(poly_reader)
+        geometries = shapely.from_wkt([row['geometry'] for row in rows])
+        return poly_reader.fieldnames, rows, geometries
+
+    @classmethod
+    def from_file(cls, polygons_file):
+        """
+        Function that loads a polygons csv file, all the columns but the geometry are the polygons attributes
+        """
+        _, rows, geometries = cls.read_file(polygons_file)
+        attributes = [{key: value for key, value in row.items() if key != 'geometry'} for row in rows]
+        return cls(geometries, [row.get('name', 'unnamed-polygon') for row in rows], attributes)
+
+    def __reduce__(self):
+        # the tree is rebuilt from the geometries
+        return type(self), (self.geometries, self.names, self.attributes)
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def locate(self, lats, lons):
+        """
+        Function that finds the polygon containing each point
+        Args:
+        lats (np.ndarray): latitudes of the points
+        lons (np.ndarray): longitudes of the points
+        Returns:
+            int array with the index of the first polygon containing each point, -1 for points outside
+            of all polygons
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        result = np.full(len(lats), -1, dtype=np.intp)
+
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        candidates = np.flatnonzero((lons >= min_lon) & (lons <= max_lon) & (lats >= min_lat) & (lats <= max_lat))
+        if not len(candidates):
+            return result
+
+        points = shapely.points(lons[candidates], lats[candidates])
+        point_idx, poly_idx = self.tree.query(points, predicate='within')
+        if len(point_idx):
+            # a point inside overlapping polygons gets the first of them
+            order = np.lexsort((poly_idx, point_idx))
+            point_idx, poly_idx = point_idx[order], poly_idx[order]
+            first = np.ones(len(point_idx), dtype=bool)
+            first[1:] = point_idx[1:] != point_idx[:-1]
+            result[candidates[point_idx[first]]] = poly_idx[first]
+        return result
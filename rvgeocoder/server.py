@@ -0,0 +1,341 @@
+""" Local geocoding server on a Unix domain socket
+
+One process of the host loads the locations (ideally a memory mapped binary index) and builds the tree,
+the other processes query it through a socket with a compact binary protocol, so the host keeps one
+copy of the locations in memory. RGeocoderClient falls back to an in-process geocoder when the server
+is not available.
+
+Protocol (little-endian), any number of requests per connection:
+    request:  magic 'RVG1', op u32, flags u32, n u32, ncolumns u32,
+              ncolumns x (u16 length, utf-8 column name), n x (float64 lat, float64 lon)
+    response: status u32, n u32, ncolumns u32, then for status OK:
+              n x int32 index (QUERY op only), [n x float64 distance if FLAG_DISTANCE],
+              ncolumns x (u32 kind, n x float64 for KIND_FLOAT or (n + 1) x uint32 offsets and the
+              utf-8 values joined for KIND_STRINGS)
+              and for status ERROR: u32 length, utf-8 exception type, u32 length, utf-8 message
+Columns are gathered as query_array does (lat/lon as float64), or as the text of the records returned
+by query with FLAG_RECORDS. The INFO op answers a single column holding the fieldnames of the locations.
+"""
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import numpy as np
+
+from rvgeocoder.locations import COORD_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'RVG1'
+OP_QUERY = 1
+OP_INFO = 2
+FLAG_DISTANCE = 1
+FLAG_RECORDS = 2
+
+KIND_STRINGS = 0
+KIND_FLOAT = 1
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+_REQUEST = struct.Struct('<4sIIII')
+_RESPONSE = struct.Struct('<III')
+_LENGTH = struct.Struct('<I')
+_NAME_LENGTH = struct.Struct('<H')
+
+# Largest batch of a request, larger batches are split by the client
+MAX_BATCH = 1 << 22
+
+# Exceptions of the server raised with the same type by the client, any other is raised as RuntimeError
+_ERRORS = {error.__name__: error for error in (ValueError, KeyError, TypeError, IndexError)}
+
+
+def _recv_exact(sock, nbytes):
+    """
+    Function that reads exactly nbytes from a socket, raising ConnectionError if it is closed before
+    """
+    buffer = bytearray(nbytes)
+    view = memoryview(buffer)
+    received = 0
+    while received < nbytes:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError('Connection closed by peer')
+        received += count
+    return buffer
+
+
+def encode_column(values):
+    """
+    Function that encodes a column of the response, float64 values as is and any other as strings
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        return _LENGTH.pack(KIND_FLOAT) + values.astype('<f8').tobytes()
+    encoded = [str(value).encode('utf-8') for value in values.tolist()]
+    offsets = np.zeros(len(encoded) + 1, dtype='<u4')
+    np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+    return _LENGTH.pack(KIND_STRINGS) + offsets.tobytes() + b''.join(encoded)
+
+
+def _recv_column(sock, n):
+    kind, = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    if kind == KIND_FLOAT:
+        return np.frombuffer(_recv_exact(sock, n * 8), dtype='<f8').copy()
+    offsets = np.frombuffer(_recv_exact(sock, (n + 1) * 4), dtype='<u4')
+    data = bytes(_recv_exact(sock, int(offsets[-1])))
+    bounds = offsets.tolist()
+    values = np.empty(n, dtype=object)
+    values[:] = [data[start:end].decode('utf-8') for start, end in zip(bounds[:-1], bounds[1:])]
+    return values
+
+
+def _encode_error(error):
+    kind = type(error).__name__.encode('utf-8')
+    message = str(error).encode('utf-8')
+    return (_RESPONSE.pack(STATUS_ERROR, 0, 0) + _LENGTH.pack(len(kind)) + kind + _LENGTH.pack(len(message)) +
+            message)
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        while True:
+            try:
+                magic, op, flags, n, ncolumns = _REQUEST.unpack(_recv_exact(sock, _REQUEST.size))
+                if magic != MAGIC:
+                    logger.warning('Closing connection with unknown protocol %r', magic)
+                    return
+                columns = [bytes(_recv_exact(sock, _NAME_LENGTH.unpack(_recv_exact(sock, _NAME_LENGTH.size))[0]))
+                           .decode('utf-8') for _ in range(ncolumns)]
+                points = np.frombuffer(_recv_exact(sock, n * 16), dtype='<f8').reshape(-1, 2)
+            except ConnectionError:
+                return
+            try:
+                response = self.server.answer(op, flags, points, columns)
+            except Exception as error:
+                response = _encode_error(error)
+            sock.sendall(response)
+
+
+class GeocoderServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Server answering the queries of RGeocoderClient with one geocoder, a thread per connection
+    """
+    daemon_threads = True
+
+    def __init__(self, geocoder, path):
+        """ Class Instantiation
+        Args:
+        geocoder (RGeocoderImpl): the geocoder answering all the clients
+        path (str): path of the Unix socket, replaced if it exists
+        """
+        self.geocoder = geocoder
+        self.path = path
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, _RequestHandler)
+
+    def answer(self, op, flags, points, columns):
+        """
+        Function that returns the encoded response of a request
+        """
+        if op == OP_INFO:
+            fieldnames = self.geocoder.locations.fieldnames
+            return _RESPONSE.pack(STATUS_OK, len(fieldnames), 1) + encode_column(np.array(fieldnames, dtype=object))
+        if op != OP_QUERY:
+            raise ValueError('Unknown operation %d' % op)
+        result = self.geocoder.query_array(points, return_distance=bool(flags & FLAG_DISTANCE), columns=columns)
+        parts = [_RESPONSE.pack(STATUS_OK, len(points), len(columns)),
+                 np.asarray(result['index'], dtype='<i4').tobytes()]
+        if flags & FLAG_DISTANCE:
+            parts.append(np.asarray(result['distance'], dtype='<f8').tobytes())
+        if flags & FLAG_RECORDS:
+            # the records hold the source text of the coordinates
+            coord_columns = [name for name in columns if name in COORD_COLUMNS]
+            if coord_columns:
+                result.update(self.geocoder.locations.take_values(result['index'], coord_columns))
+        for name in columns:
+            parts.append(encode_column(result[name]))
+        return b''.join(parts)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def serve(geocoder, path):
+    """
+    Function that serves a geocoder on a Unix socket until interrupted
+    """
+    with GeocoderServer(geocoder, path) as server:
+        logger.info('Serving %d locations on %s', len(geocoder.locations), path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+class RGeocoderClient:
+    """
+    Client of a GeocoderServer, with the query_array/query API of RGeocoderImpl. When the server can not
+    be reached, the queries are answered by the fallback geocoder (if any) until reconnect is called
+    """
+    def __init__(self, path, fallback=None, timeout=None):
+        """ Class Instantiation
+        Args:
+        path (str): path of the Unix socket of the server
+        fallback (RGeocoderImpl or callable): OPTIONAL. in-process geocoder used when the server is not
+                                              available, or a function creating it on first use
+        timeout (float): OPTIONAL. timeout of the socket operations in seconds
+        """
+        self.path = path
+        self.timeout = timeout
+        self._fallback = fallback
+        self._sock = None
+        self._fieldnames = None
+        self._lock = threading.Lock()
+        self.using_fallback = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+    def reconnect(self):
+        """
+        Function that goes back to the server after a fall back to the in-process geocoder
+        """
+        self.close()
+        self.using_fallback = False
+
+    @property
+    def fallback(self):
+        if callable(self._fallback) and not hasattr(self._fallback, 'query_array'):
+            self._fallback = self._fallback()
+        return self._fallback
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _request(self, op, flags=0, points=np.empty((0, 2)), columns=()):
+        """
+        Function that sends a request and reads the response, None when the server is not available
+        and there is a fallback
+        """
+        names = [name.encode('utf-8') for name in columns]
+        request = b''.join([_REQUEST.pack(MAGIC, op, flags, len(points), len(names))] +
+                           [_NAME_LENGTH.pack(len(name)) + name for name in names] +
+                           [np.ascontiguousarray(points, dtype='<f8').tobytes()])
+        with self._lock:
+            if self.using_fallback:
+                return None
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._sock = self._connect()
+                    self._sock.sendall(request)
+                    return self._read_response(self._sock, op, flags)
+                except OSError as error:  # ConnectionError, FileNotFoundError, socket.timeout
+                    if self._sock is not None:
+                        self._sock.close()
+                        self._sock = None
+                    unavailable = error
+                    if isinstance(error, (FileNotFoundError, ConnectionRefusedError)):
+                        break
+                    # the kept connection may be to a restarted server, retry once with a new connection
+            if self._fallback is None:
+                raise unavailable
+            logger.warning('Geocoder server %s not available (%s), using the in-process geocoder',
+                           self.path, unavailable)
+            self.using_fallback = True
+            return None
+
+    @staticmethod
+    def _read_response(sock, op, flags):
+        status, n, ncolumns = _RESPONSE.unpack(_recv_exact(sock, _RESPONSE.size))
+        if status != STATUS_OK:
+            kind = _recv_exact(sock, _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))[0]).decode('utf-8')
+            message = _recv_exact(sock, _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))[0]).decode('utf-8')
+            raise _ERRORS.get(kind, RuntimeError)(message)
+        response = {}
+        if op == OP_QUERY:
+            response['index'] = np.frombuffer(_recv_exact(sock, n * 4), dtype='<i4').astype(np.intp)
+        if flags & FLAG_DISTANCE:
+            response['distance'] = np.frombuffer(_recv_exact(sock, n * 8), dtype='<f8').copy()
+        response['columns'] = [_recv_column(sock, n) for _ in range(ncolumns)]
+        return response
+
+    @property
+    def fieldnames(self):
+        """
+        The names of the location columns
+        """
+        if self._fieldnames is None:
+            response = self._request(OP_INFO)
+            if response is None:
+                return self.fallback.locations.fieldnames
+            self._fieldnames = list(response['columns'][0])
+        return self._fieldnames
+
+    def _query(self, points, flags, columns):
+        """
+        Function that queries the server in batches of at most MAX_BATCH points
+        Returns:
+            dict of the index, distance and columns arrays, None when falling back to the in-process geocoder
+        """
+        responses = []
+        for start in range(0, max(len(points), 1), MAX_BATCH):
+            response = self._request(OP_QUERY, flags, points[start:start + MAX_BATCH], columns)
+            if response is None:
+                return None
+            responses.append(response)
+
+        result = {'index': np.concatenate([response['index'] for response in responses])}
+        if flags & FLAG_DISTANCE:
+            result['distance'] = np.concatenate([response['distance'] for response in responses])
+        for n_col, name in enumerate(columns):
+            result[name] = np.concatenate([response['columns'][n_col] for response in responses])
+        return result
+
+    def query_array(self, lats, lons=None, return_distance=False, columns=None):
+        """
+        Function to query the server with arrays of coordinates, see RGeocoderImpl.query_array.
+        The polygon indices are not returned, the columns hold the polygon attributes
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        points = lats.reshape(-1, 2) if lons is None else np.column_stack((lats, np.asarray(lons, dtype=np.float64)))
+        columns = list(columns or [])
+        result = self._query(points, FLAG_DISTANCE if return_distance else 0, columns)
+        if result is None:
+            result = self.fallback.query_array(points, return_distance=return_distance, columns=columns)
+            result.pop('polygon', None)
+        return result
+
+    def query(self, coordinates):
+        """
+        Function to query the server for the nearest location records, see RGeocoderImpl.query
+        """
+        points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        fieldnames = self.fieldnames
+        result = self._query(points, FLAG_RECORDS, fieldnames)
+        if result is None:
+            return self.fallback.query(points)
+        return [dict(zip(fieldnames, values)) for values in zip(*(result[name].tolist() for name in fieldnames))]
@@ -0,0 +1,427 @@
+""" Geographically sharded index
+
+For very large datasets, the locations are partitioned in a grid of tile_size x tile_size degrees tiles
+and each tile is saved as a binary index (a shard). Shards are loaded (memory mapped) and their tree built
+on first use, and at most max_resident shards are kept, the least recently used are evicted.
+
+A batch is routed to the shard of the tile of each point (the shard of the nearest non-empty tile for
+points in empty tiles), giving a first nearest distance. The neighbour shards whose bounds are closer
+than that distance are then queried as well, so results are the same as those of a single tree.
+The grid is in lat/lon degrees, like the tree of a geocoder without ecef.
+"""
+from collections import OrderedDict
+from collections.abc import Sequence
+import json
+import logging
+import os
+import shutil
+import threading
+import numpy as np
+
+from rvgeocoder import _fork
+from rvgeocoder import index as rg_index
+from rvgeocoder.locations import COORD_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Version of the sharded index layout, bumped on any incompatible change
+SHARDS_VERSION = 1
+
+SHARDS_FORMAT = 'rvgeocoder-shards'
+SHARDS_MANIFEST = 'shards.json'
+
+DEFAULT_TILE_SIZE = 10.0
+DEFAULT_MAX_RESIDENT = 16
+
+# Largest number of tiles per dimension of the search box of a point checked tile by tile, points with
+# a larger box are checked against the bounds of every shard
+MAX_BOX_SPAN = 9
+
+
+def _grid(tile_size):
+    return int(np.ceil(180.0 / tile_size)), int(np.ceil(360.0 / tile_size))
+
+
+def _tile_cells(lats, lons, tile_size):
+    nrows, ncols = _grid(tile_size)
+    rows = np.clip(np.floor((np.asarray(lats) + 90.0) / tile_size), 0, nrows - 1).astype(np.int64)
+    cols = np.clip(np.floor((np.asarray(lons) + 180.0) / tile_size), 0, ncols - 1).astype(np.int64)
+    return rows, cols
+
+
+def tile_keys(coords, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Function that returns the key of the tile of each (lat, lon) of a (n, 2) array
+    """
+    rows, cols = _tile_cells(coords[:, 0], coords[:, 1], tile_size)
+    return rows * _grid(tile_size)[1] + cols
+
+
+def save_sharded_index(locations, path, tile_size=DEFAULT_TILE_SIZE, leafsize=30):
+    """
+    Function that writes a LocationStore as a sharded index, one binary index per non-empty tile.
+    The index is written next to path and renamed when complete. The locations are numbered shard
+    after shard, in the order of the tiles
+    Args:
+    locations (LocationStore): the locations to save
+    path (str): directory of the index, replaced if exists
+    tile_size (float): size of the tiles in degrees
+    leafsize (int): leafsize of the K-D trees of the shards
+    """
+    coords = np.asarray(locations.coords)
+    keys = tile_keys(coords, tile_size)
+    order = np.argsort(keys, kind='stable')
+    tiles, starts = np.unique(keys[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+
+    tmp_path = path.rstrip(os.sep) + '.tmp%d' % os.getpid()
+    os.makedirs(tmp_path)
+    try:
+        shards, offset = [], 0
+        for key, start, end in zip(tiles.tolist(), starts.tolist(), ends.tolist()):
+            members = order[start:end]
+            shard_path = 'tile%d' % key
+            rg_index.save_index(locations.subset(members), os.path.join(tmp_path, shard_path), leafsize)
+            shard_coords = coords[members]
+            shards.append({'key': key, 'path': shard_path, 'offset': offset, 'size': len(members),
+                           'bounds': shard_coords.min(axis=0).tolist() + shard_coords.max(axis=0).tolist()})
+            offset += len(members)
+
+        manifest = {
+            'format': SHARDS_FORMAT,
+            'version': SHARDS_VERSION,
+            'size': len(locations),
+            'tile_size': tile_size,
+            'leafsize': leafsize,
+            'fieldnames': locations.fieldnames,
+            'shards': shards,
+        }
+        with open(os.path.join(tmp_path, SHARDS_MANIFEST), 'w') as fd:
+            json.dump(manifest, fd, indent=1)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def is_sharded_index(path):
+    return os.path.isfile(os.path.join(path, SHARDS_MANIFEST))
+
+
+def read_manifest(path):
+    """
+    Function that reads and validates the manifest of a sharded index
+    """
+    with open(os.path.join(path, SHARDS_MANIFEST)) as fd:
+        manifest = json.load(fd)
+    if manifest.get('format') != SHARDS_FORMAT:
+        raise ValueError('%s is not a rvgeocoder sharded index' % path)
+    if manifest.get('version') != SHARDS_VERSION:
+        raise ValueError('Sharded index %s has version %s, expected version %s. Please rebuild the index' % (
+            path, manifest.get('version'), SHARDS_VERSION))
+    return manifest
+
+
+class _Shard:
+    def __init__(self, locations, tree, offset):
+        self.locations = locations
+        self.tree = tree
+        self.offset = offset
+
+
+class ShardedIndex:
+    """
+    Index over the shards of a sharded index, with the query/query_ball_point API of cKDTree.
+    Location indices are global: the locations of shard s are offsets[s]:offsets[s + 1]
+    """
+    def __init__(self, path, max_resident=DEFAULT_MAX_RESIDENT):
+        """ Class Instantiation
+        Args:
+        path (str): directory of the sharded index
+        max_resident (int): maximal number of shards kept loaded, the least recently used are evicted
+        """
+        manifest = read_manifest(path)
+        self.path = path
+        self.max_resident = max(1, max_resident)
+        self.tile_size = manifest['tile_size']
+        self.leafsize = manifest['leafsize']
+        self.fieldnames = manifest['fieldnames']
+        self.n = manifest['size']
+        shards = manifest['shards']
+        self.keys = np.array([shard['key'] for shard in shards], dtype=np.int64)
+        self.paths = [os.path.join(path, shard['path']) for shard in shards]
+        self.offsets = np.array([shard['offset'] for shard in shards] + [self.n], dtype=np.int64)
+        self.bounds = np.array([shard['bounds'] for shard in shards], dtype=np.float64).reshape(-1, 4)
+        self.loads = 0
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+        self._centers = None
+        self.locations = ShardedLocations(self)
+        self.data = _ShardedCoords(self)
+        _fork.register(self)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def shard(self, n_shard):
+        """
+        Function that returns a shard, loading it and building its tree if it is not resident
+        """
+        with self._lock:
+            shard = self._resident.get(n_shard)
+            if shard is not None:
+                self._resident.move_to_end(n_shard)
+                return shard
+            from scipy.spatial import cKDTree
+            locations = rg_index.load_index(self.paths[n_shard])
+            shard = _Shard(locations, cKDTree(locations.coords, leafsize=self.leafsize), int(self.offsets[n_shard]))
+            self._resident[n_shard] = shard
+            self.loads += 1
+            while len(self._resident) > self.max_resident:
+                self._resident.popitem(last=False)
+            return shard
+
+    def resident(self):
+        """
+        Function that returns the numbers of the loaded shards, least recently used first
+        """
+        with self._lock:
+            return list(self._resident)
+
+    def start(self):
+        return self
+
+    def close(self):
+        """
+        Function that unloads all the shards
+        """
+        with self._lock:
+            self._resident.clear()
+
+    def shards_of(self, indices):
+        """
+        Function that returns the shard of each global location index
+        """
+        return np.searchsorted(self.offsets, indices, side='right') - 1
+
+    def _shards_of_points(self, points):
+        """
+        Function that returns the shard of the tile of each point, -1 for empty tiles
+        """
+        keys = tile_keys(points, self.tile_size)
+        pos = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        return np.where(self.keys[pos] == keys, pos, -1) if len(self.keys) else np.full(len(points), -1)
+
+    def _seed_shards(self, points):
+        """
+        Function that returns the shard first queried for each point: the shard of its tile, or the shard
+        whose bounds center is the nearest for points in empty tiles
+        """
+        seeds = self._shards_of_points(points)
+        empty = np.flatnonzero(seeds < 0)
+        if len(empty):
+            if self._centers is None:
+                from scipy.spatial import cKDTree
+                self._centers = cKDTree((self.bounds[:, :2] + self.bounds[:, 2:]) / 2)
+            seeds[empty] = self._centers.query(points[empty])[1]
+        return seeds
+
+    def _bounds_distance(self, points, shards):
+        """
+        Function that returns the distance from each point to the bounds of the matching shard,
+        a lower bound of the distance to any of its locations
+        """
+        low, high = self.bounds[shards, :2], self.bounds[shards, 2:]
+        return np.linalg.norm(np.maximum(np.maximum(low - points, points - high), 0), axis=1)
+
+    def _candidates(self, points, radius, exclude):
+        """
+        Function that returns the (point, shard) pairs where the bounds of the shard are within radius of
+        the point, except the excluded shard of each point (-1 for none)
+        Returns:
+            point indices and shard indices arrays of the pairs
+        """
+        if not len(self.keys):
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        nrows, ncols = _grid(self.tile_size)
+        finite = np.isfinite(radius)
+        reach = np.where(finite, radius, 0)
+        row0, col0 = _tile_cells(points[:, 0] - reach, points[:, 1] - reach, self.tile_size)
+        row1, col1 = _tile_cells(points[:, 0] + reach, points[:, 1] + reach, self.tile_size)
+        boxed = finite & (row1 - row0 < MAX_BOX_SPAN) & (col1 - col0 < MAX_BOX_SPAN)
+
+        pairs_points, pairs_shards = [], []
+        # tile by tile within the search box of each point
+        members = np.flatnonzero(boxed)
+        if len(members):
+            for d_row in range(int((row1 - row0)[members].max()) + 1):
+                for d_col in range(int((col1 - col0)[members].max()) + 1):
+                    cell = members[(row0[members] + d_row <= row1[members]) & (col0[members] + d_col <= col1[members])]
+                    keys = (row0[cell] + d_row) * ncols + col0[cell] + d_col
+                    pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+                    hit = self.keys[pos] == keys
+                    pairs_points.append(cell[hit])
+                    pairs_shards.append(pos[hit])
+        # against the bounds of every shard for the points with a large or unbounded search box
+        members = np.flatnonzero(~boxed)
+        for n_shard in range(len(self.keys)) if len(members) else ():
+            pairs_points.append(members)
+            pairs_shards.append(np.full(len(members), n_shard))
+
+        pairs_points = np.concatenate(pairs_points).astype(np.intp)
+        pairs_shards = np.concatenate(pairs_shards).astype(np.intp)
+        keep = (pairs_shards != exclude[pairs_points]) & (
+            self._bounds_distance(points[pairs_points], pairs_shards) <= radius[pairs_points])
+        return pairs_points[keep], pairs_shards[keep]
+
+    def _groups(self, point_indices, shards):
+        """
+        Function that yields the shard number and the point indices of each shard of (point, shard) pairs
+        """
+        order = np.argsort(shards, kind='stable')
+        shards, point_indices = shards[order], point_indices[order]
+        starts = np.flatnonzero(np.r_[True, shards[1:] != shards[:-1]]) if len(shards) else []
+        for start, end in zip(starts, np.append(starts[1:], len(shards)) if len(shards) else []):
+            yield int(shards[start]), point_indices[start:end]
+
+    def _query_pairs(self, points, point_indices, shards, k, workers, dists, indices):
+        """
+        Function that queries the shards of (point, shard) pairs and merges the neighbours into the k
+        nearest found so far
+        """
+        for n_shard, members in self._groups(point_indices, shards):
+            shard = self.shard(n_shard)
+            s_dists, s_indices = shard.tree.query(points[members], k=k, workers=workers)
+            s_dists, s_indices = s_dists.reshape(len(members), k), s_indices.reshape(len(members), k)
+            s_indices = np.where(s_indices < len(shard.locations), s_indices + shard.offset, self.n)
+            all_dists = np.concatenate([dists[members], s_dists], axis=1)
+            all_indices = np.concatenate([indices[members], s_indices], axis=1)
+            nearest = np.argsort(all_dists, axis=1, kind='stable')[:, :k]
+            dists[members] = np.take_along_axis(all_dists, nearest, axis=1)
+            indices[members] = np.take_along_axis(all_indices, nearest, axis=1)
+
+    def query(self, points, k=1, workers=1):
+        """
+        Function that finds the k nearest locations of each point, as cKDTree.query
+        Returns:
+            distances and global indices, of shape (n,) when k=1 or (n, k) otherwise. Missing neighbours
+            have an inf distance and n as index
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        dists = np.full((len(points), k), np.inf)
+        indices = np.full((len(points), k), self.n, dtype=np.intp)
+        if len(points) and len(self.keys):
+            seeds = self._seed_shards(points)
+            self._query_pairs(points, np.arange(len(points)), seeds, k, workers, dists, indices)
+            pairs = self._candidates(points, dists[:, -1], seeds)
+            self._query_pairs(points, *pairs, k, workers, dists, indices)
+        if k == 1:
+            return dists.reshape(-1), indices.reshape(-1)
+        return dists, indices
+
+    def query_ball_point(self, points, r, workers=1, return_sorted=True):
+        """
+        Function that finds the locations within r of each point, as cKDTree.query_ball_point
+        Returns:
+            list of the global indices of the neighbours of each point
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        radius = np.broadcast_to(np.asarray(r, dtype=np.float64), (len(points),))
+        neighbours = [[] for _ in range(len(points))]
+        point_indices, shards = self._candidates(points, radius, np.full(len(points), -1))
+        for n_shard, members in self._groups(point_indices, shards):
+            shard = self.shard(n_shard)
+            found = shard.tree.query_ball_point(points[members], radius[members], workers=workers,
+                                                return_sorted=return_sorted)
+            for member, local in zip(members.tolist(), found):
+                neighbours[member].extend(index + shard.offset for index in local)
+        return neighbours
+
+
+class _ShardedCoords:
+    """
+    Coordinates of the locations of a ShardedIndex, gathered from the shards by global index
+    """
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return self._index.n
+
+    def __getitem__(self, indices):
+        indices = np.asarray(indices, dtype=np.intp)
+        result = np.empty((len(indices), 2), dtype=np.float64)
+        for n_shard, members in self._index._groups(np.arange(len(indices)), self._index.shards_of(indices)):
+            shard = self._index.shard(n_shard)
+            result[members] = shard.locations.coords[indices[members] - shard.offset]
+        return result
+
+
+class ShardedLocations(Sequence):
+    """
+    Read-only sequence of the locations of a ShardedIndex, with the API of LocationStore used by the
+    geocoder. Whole columns (numeric, map_values, column) load every shard in turn
+    """
+    def __init__(self, index):
+        self._index = index
+        self.fieldnames = index.fieldnames
+
+    def __len__(self):
+        return self._index.n
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[n] for n in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        shard = self._index.shard(int(self._index.shards_of(index)))
+        return shard.locations[index - shard.offset]
+
+    def take(self, indices, columns=None):
+        """
+        Function that gathers the given columns (all by default) at the given global indices, see LocationStore.take
+        """
+        columns = columns or self.fieldnames
+        dtypes = {name: np.float64 if name in COORD_COLUMNS else object for name in columns}
+        return self._gather(indices, dtypes, lambda locations, local: locations.take(local, columns))
+
+    def take_values(self, indices, columns=None):
+        """
+        Function that gathers the given columns (all by default) at the given global indices as stored,
+        see LocationStore.take_values
+        """
+        columns = columns or self.fieldnames
+        return self._gather(indices, dict.fromkeys(columns, object),
+                            lambda locations, local: locations.take_values(local, columns))
+
+    def _gather(self, indices, dtypes, take):
+        """
+        Function that gathers columns at global indices shard by shard, take(locations, local_indices)
+        returns the columns of a shard
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        result = {name: np.empty(len(indices), dtype=dtype) for name, dtype in dtypes.items()}
+        for n_shard, members in self._index._groups(np.arange(len(indices)), self._index.shards_of(indices)):
+            shard = self._index.shard(n_shard)
+            for name, values in take(shard.locations, indices[members] - shard.offset).items():
+                result[name][members] = values
+        return result
+
+    def _concat(self, func):
+        return np.concatenate([func(self._index.shard(n_shard).locations) for n_shard in range(len(self._index))]
+                              or [np.empty(0)])
+
+    def column(self, name):
+        return self._concat(lambda locations: locations.column(name))
+
+    def numeric(self, name, default=0.0):
+        return self._concat(lambda locations: locations.numeric(name, default))
+
+    def map_values(self, name, mapping, default=1.0):
+        return self._concat(lambda locations: locations.map_values(name, mapping, default))
@@ -0,0 +1,167 @@
+""" Streaming helpers
+
+Reverse geocoding of very large inputs in bounded chunks. Reading and parsing the next chunk
+runs in a background thread while the current chunk is queried, and only a couple of chunks
+are held in memory at any time, whatever the input size.
+"""
+import csv
+import itertools
+import logging
+import threading
+import queue
+import numpy as np
+from rvgeocoder.locations import invalid_report, parse_coordinates
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def prefetch(iterable, depth=1):
+    """
+    Function that iterates an iterable in a background thread, keeping up to depth items ready ahead
+    of the consumer. Exceptions raised by the iterable are re-raised in the consumer
+    """
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def put(entry):
+        # give up when the consumer stopped iterating, instead of blocking on a full queue forever
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as err:
+            put((done, err))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, err = items.get()
+            if item is done:
+                if err is not None:
+                    raise err
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def chunk_coordinates(coordinates, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Function that groups an iterable of (lat, lon) pairs into float64 arrays of shape (chunk_size, 2)
+    Arrays of shape (n, 2) in the iterable are yielded as is, so pre-chunked input is also accepted
+    """
+    iterator = iter(coordinates)
+    while True:
+        first = next(iterator, None)
+        if first is None:
+            return
+        if isinstance(first, np.ndarray) and first.ndim == 2:
+            yield np.asarray(first, dtype=np.float64)
+            continue
+        chunk = [first]
+        chunk.extend(itertools.islice(iterator, chunk_size - 1))
+        yield np.asarray(chunk, dtype=np.float64).reshape(-1, 2)
+
+
+def read_chunks(fd, delimiter=',', lat_col=0, lon_col=1, header=False, chunk_size=DEFAULT_CHUNK_SIZE,
+                skip_invalid=False, first_line=1):
+    """
+    Function that reads a delimited file of coordinates in chunks. Blank lines are skipped, rows with
+    missing, malformed or out of range coordinates raise a ValueError listing their line numbers
+    Args:
+    fd (file): text file object
+    delimiter (str): delimiter of the file
+    lat_col (int): index of the latitude column
+    lon_col (int): index of the longitude column
+    header (bool): whether the first row is a header, it is skipped
+    chunk_size (int): maximal number of rows per chunk
+    skip_invalid (bool): skip (and log) the rows with invalid coordinates instead of raising
+    first_line (int): line number of the first line of fd, used to report invalid rows
+    Returns:
+        generator of (rows, points) where rows are the parsed rows and points a float64 array of shape (n, 2)
+    """
+    reader = csv.reader(fd, delimiter=delimiter)
+    if header:
+        next(reader, None)
+    min_length = max(lat_col, lon_col) + 1
+    while True:
+        rows, lines = [], []
+        read = 0
+        line = reader.line_num + first_line
+        for read, row in enumerate(itertools.islice(reader, chunk_size), 1):
+            if row:
+                rows.append(row)
+                lines.append(line)
+            # first line of the next row, quoted values can span several lines
+            line = reader.line_num + first_line
+        if not read:
+            return
+        if not rows:
+            # a chunk of blank lines
+            continue
+        lats = [row[lat_col] if len(row) >= min_length else '' for row in rows]
+        lons = [row[lon_col] if len(row) >= min_length else '' for row in rows]
+        points, valid = parse_coordinates(lats, lons)
+        if not valid.all():
+            invalid = np.flatnonzero(~valid)
+            report = invalid_report(invalid, lines, lats, lons)
+            if not skip_invalid:
+                raise ValueError('Missing, malformed or out of range coordinates at %s' % report)
+            logger.warning('Skipping %d rows with missing, malformed or out of range coordinates at %s',
+                           len(invalid), report)
+            keep = np.flatnonzero(valid)
+            if not len(keep):
+                continue
+            rows, points = [rows[n] for n in keep], points[keep]
+        yield rows, points
+
+
+def geocode_file(rgeo, input_file, output_file, delimiter=',', lat_col=0, lon_col=1, header=False,
+                 columns=('name', 'admin1', 'admin2', 'cc'), distance=False, chunk_size=DEFAULT_CHUNK_SIZE,
+                 skip_invalid=False):
+    """
+    Function that reverse geocodes a delimited file of coordinates to an output file with the same rows
+    followed by the requested location columns (and the distance)
+    Args:
+    rgeo (RGeocoderImpl): the geocoder used for the queries
+    input_file (str): path of the input file
+    output_file (str): path of the output file, written with the same delimiter
+    columns (list): names of the location columns to append to each row
+    distance (bool): append the distance to the nearest location
+    skip_invalid (bool): leave out (and log) the rows with invalid coordinates instead of raising ValueError
+    Returns:
+        number of rows geocoded
+    """
+    columns = list(columns)
+    count = 0
+    with open(input_file, 'rt', newline='') as fin, open(output_file, 'wt', newline='') as fout:
+        writer = csv.writer(fout, delimiter=delimiter)
+        reader = csv.reader(fin, delimiter=delimiter)
+        if header:
+            input_header = next(reader, None) or []
+            writer.writerow(input_header + columns + (['distance'] if distance else []))
+
+        chunks = read_chunks(fin, delimiter, lat_col, lon_col, chunk_size=chunk_size, skip_invalid=skip_invalid,
+                             first_line=reader.line_num + 1)
+        for rows, points in prefetch(chunks):
+            result = rgeo.query_array(points, return_distance=distance, columns=columns)
+            out_columns = [result[name] for name in columns]
+            if distance:
+                out_columns.append(result['distance'])
+            writer.writerows(row + list(values) for row, values in zip(rows, zip(*out_columns)))
+            count += len(rows)
+    return count
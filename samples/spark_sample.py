@@ -1,4 +1,3 @@
-import io
 import random
 
 import numpy as np
@@ -10,28 +9,19 @@ from pyspark.sql.session import SparkSession
 
 ## TODO: put your custom geocoding files here
 files = []
-file_unified_data = ''.join(rvg.RGeocoderDataLoader.load_files_lines(files))
 
-# if we are doing this here mode must be equal to 1 as mode=2 does not work when trying to serialize 
-# as ckDTree has some issues with serialization
-# files_stream = rvg.RGeocoderDataLoader.load_files_stream(files)
-# rgeo = rvg.RGeocoder(mode=1, stream=files_stream)
+# the geocoder is created once on the driver and pickled with the udf. Pickling carries the path of the
+# index (when loaded from one) or the compact location arrays, and every executor process rebuilds it once,
+# on the first query, however many tasks use it. Mode 2 works as well, mode 3 avoids a pool per executor.
+# Use rvg.RGeocoderImpl.from_index(path, mode=3) to ship a path instead of the arrays.
+rgeo = rvg.RGeocoderImpl.from_files(files, mode=3) if files else rvg.RGeocoder(mode=3)
 
 # return list of strings and not tuple as pandas_udf does not support structs/maps at the moment
 def reverse(slat, slon):
-    coords = list(zip(slat.values, slon.values))
-    if files:
-        files_stream = io.StringIO(file_unified_data)
-        files_stream.seek(0)
-        rgeo = rvg.RGeocoder(stream=files_stream)
-    else:
-        rgeo = rvg.RGeocoder()
-
-    res = rgeo.query(coords)
-    
-    pdf = pd.DataFrame()
-    pdf['locs'] = [[x['cc'], x['name']] for x in res]
-    return pdf.locs
+    # query the pandas columns directly, no list of tuples round trip
+    res = rgeo.query_array(slat, slon, columns=['cc', 'name'])
+
+    return pd.Series(list(zip(res['cc'], res['name']))).apply(list)
 
 
 def gen_coords_list(n):
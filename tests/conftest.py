@@ -0,0 +1,31 @@
+import io
+import numpy as np
+import pytest
+import rvgeocoder as rvg
+
+
+def make_data(n=10000, prefix='Place', admin1='Admin1', clustered=False):
+    """
+    Function that returns the csv text of n random locations with the columns of rg_cities1000.csv
+    Args:
+    n (int): number of locations
+    prefix (str): prefix of the names, followed by the location number
+    admin1 (str): admin1 of every location
+    clustered (bool): half of the locations around (45, 5), leaving many areas empty
+    """
+    if clustered:
+        lats = np.concatenate([np.random.normal(45, 2, n // 2), np.random.uniform(-60, 70, n - n // 2)])
+        lons = np.concatenate([np.random.normal(5, 3, n // 2), np.random.uniform(-180, 180, n - n // 2)])
+    else:
+        lats = np.random.uniform(-60, 70, n)
+        lons = np.random.uniform(-180, 180, n)
+    data = io.StringIO()
+    data.write(','.join(rvg.RG_COLUMNS) + '\n')
+    for i in range(n):
+        data.write('%.5f,%.5f,%s %d,%s,Admin2,CC\n' % (lats[i], lons[i], prefix, i, admin1))
+    return data.getvalue()
+
+
+@pytest.fixture
+def gen_data():
+    return make_data
@@ -2,18 +2,26 @@ from timeit import timeit
 import csv
 import rvgeocoder as rvg
 
+MODES = (1, 2, 3)
+
 if __name__ == '__main__':
-    setup = "import csv;import rvgeocoder as rvg;print('Loading coordinates...');" + \
-            "cities = [(row[0],row[1]) for row in csv.reader(open('test/coordinates_10000000.csv','rt'),delimiter='\t')];"
+    print('Loading coordinates...')
+    cities = [(row[0],row[1]) for row in csv.reader(open('test/coordinates_10000000.csv','rt'),delimiter='\t')]
     num = 3
-    t = timeit(stmt="rvg.search(cities,mode=1)",setup=setup,number=num)
-    print('Running time: %.2f secs' % (t / num))
+    for mode in MODES:
+        # a dedicated instance per mode, closed with its pool at the end of the block
+        with rvg.RGeocoderImpl(mode=mode) as rgeo:
+            rgeo.query(cities[:10])
+            t = timeit(lambda: rgeo.query(cities), number=num)
+        print('Mode %d running time: %.2f secs' % (mode, t / num))
 
-    print('\nLoading coordinates to compare mode 1 and mode 2...')
+    print('\nLoading coordinates to compare modes...')
     cities = [(row[0],row[1]) for row in csv.reader(open('test/coordinates_1000.csv','rt'),delimiter='\t')]
-    result1 = rvg.search(cities,mode=1)
-    result2 = rvg.search(cities,mode=2)
-    if result1 != result2:
+    results = {}
+    for mode in MODES:
+        with rvg.RGeocoderImpl(mode=mode) as rgeo:
+            results[mode] = rgeo.query(cities)
+    if any(results[mode] != results[1] for mode in MODES):
         print('Results do not match!')
     else:
-        print('Both results match!')
\ No newline at end of file
+        print('All results match!')
@@ -0,0 +1,78 @@
+import asyncio
+import multiprocessing as mp
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pytest
+import rvgeocoder as rvg
+from rvgeocoder import aio
+from rvgeocoder.aio import AsyncBatcher
+
+
+async def lookup_all(rgeo, points):
+    return await asyncio.gather(*(rgeo.aget(lat, lon) for lat, lon in points))
+
+
+def test_aget(gen_data, mode=1):
+    points = [tuple(point) for point in np.random.uniform([-60, -180], [70, 180], (1000, 2)).tolist()]
+    with rvg.RGeocoderImpl.from_data(gen_data(10000), mode=mode, verbose=False) as rgeo:
+        rgeo.batcher = AsyncBatcher(rgeo, max_points=64, max_delay_us=0)
+        records = asyncio.run(lookup_all(rgeo, points))
+        assert records == rgeo.query(points)
+        stats = rgeo.batcher.stats()
+        assert stats['requests'] == len(points) and stats['errors'] == 0
+        assert stats['batch_size_max'] == 64 and stats['batches'] < len(points) / 10
+
+
+def test_aget_errors(gen_data):
+    with rvg.RGeocoderImpl.from_data(gen_data(100), mode=1, verbose=False) as rgeo:
+        async def lookup():
+            return await asyncio.gather(rgeo.aget(0.0, 0.0), rgeo.aget('x', 0.0), return_exceptions=True)
+        valid, malformed = asyncio.run(lookup())
+        assert valid == rgeo.query([(0.0, 0.0)])[0] and isinstance(malformed, ValueError)
+
+        executor = aio.process_pool(rgeo, 1)
+        executor.shutdown()
+        rgeo.batcher = AsyncBatcher(rgeo, executor=executor)
+        results = asyncio.run(lookup())
+        assert isinstance(results[0], RuntimeError) and rgeo.batcher.stats()['errors'] == 1
+
+        # a plain process pool would pickle the locations with every batch
+        with ProcessPoolExecutor(1) as executor:
+            try:
+                AsyncBatcher(rgeo, executor=executor)
+                assert False, 'process pool of a geocoder not loaded from an index'
+            except ValueError:
+                pass
+
+
+def count_geocoders(token):
+    return len(aio._worker_geocoders), token in aio._worker_geocoders
+
+
+@pytest.mark.parametrize('method', ['fork', 'spawn'])
+def test_aget_process_pool(gen_data, method):
+    points = [tuple(point) for point in np.random.uniform([-60, -180], [70, 180], (200, 2)).tolist()]
+    with rvg.RGeocoderImpl.from_data(gen_data(1000), mode=1, verbose=False) as rgeo, \
+            aio.process_pool(rgeo, 2, mp.get_context(method)) as executor:
+        rgeo.batcher = AsyncBatcher(rgeo, max_points=16, executor=executor)
+        assert asyncio.run(lookup_all(rgeo, points)) == rgeo.query(points)
+        # the workers got the geocoder once, when they started
+        assert executor.submit(count_geocoders, rgeo._token).result() == (1, True)
+        other = rvg.RGeocoderImpl.from_data(gen_data(100), mode=1, verbose=False)
+        try:
+            AsyncBatcher(other, executor=executor)
+            assert False, 'process pool of another geocoder'
+        except ValueError:
+            pass
+
+
+def test_aget_index_process_pool(gen_data):
+    points = [(10.0, 10.0), (-20.0, 30.0)]
+    with tempfile.TemporaryDirectory() as path:
+        rvg.RGeocoderImpl.from_data(gen_data(1000), mode=1, verbose=False).build_index(os.path.join(path, 'index'))
+        with rvg.RGeocoderImpl.from_index(os.path.join(path, 'index'), mode=1, verbose=False) as rgeo, \
+                ProcessPoolExecutor(1) as executor:
+            rgeo.batcher = AsyncBatcher(rgeo, executor=executor)
+            assert asyncio.run(lookup_all(rgeo, points)) == rgeo.query(points)
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import zipfile
+import rvgeocoder as rvg
+from rvgeocoder import build as rg_build
+from rvgeocoder import index as rg_index
+
+
+def gn_row(geoname_id, name, lat, lon, cc, admin1, admin2, population, feature_class='P', feature_code='PPL'):
+    row = [''] * len(rvg.GN_COLUMNS)
+    for key, value in (('geoNameId', geoname_id), ('name', name), ('asciiName', name), ('latitude', lat),
+                       ('longitude', lon), ('featureClass', feature_class), ('featureCode', feature_code),
+                       ('countryCode', cc), ('admin1Code', admin1), ('admin2Code', admin2),
+                       ('population', population)):
+        row[rvg.GN_COLUMNS[key]] = str(value)
+    return '\t'.join(row) + '\n'
+
+
+def write_dataset(path):
+    with open(os.path.join(path, rvg.GN_ADMIN1), 'w') as fd:
+        fd.write('US.CA\tCalifornia\tCalifornia\t5332921\n')
+        fd.write('FR.11\tIle-de-France\tIle-de-France\t3012874\n')
+    with open(os.path.join(path, rvg.GN_ADMIN2), 'w') as fd:
+        fd.write('US.CA.037\tLos Angeles County\tLos Angeles County\t5368381\n')
+        fd.write('FR.11.75\tParis\tParis\t2968815\n')
+    with zipfile.ZipFile(os.path.join(path, 'cities1000.zip'), 'w') as archive:
+        archive.writestr('cities1000.txt', ''.join([
+            gn_row(1, 'Los Angeles', '34.05223', '-118.24368', 'US', 'CA', '037', 3971883, feature_code='PPLA2'),
+            gn_row(2, 'Paris', '48.85341', '2.3488', 'FR', '11', '75', 2138551, feature_code='PPLC'),
+            gn_row(3, 'Nowhere', '10.5', '20.5', 'XX', '00', '', 0),
+            gn_row(4, 'Mount Something', '40.0', '-110.0', 'US', 'UT', '', 0, 'T', 'MT'),
+        ]))
+    with open(os.path.join(path, 'modifications-2024-01-01.txt'), 'w') as fd:
+        fd.write(gn_row(3, 'Somewhere', '11.5', '21.5', 'XX', '00', '', 10))
+        fd.write(gn_row(5, 'Santa Monica', '34.01949', '-118.49138', 'US', 'CA', '037', 91411))
+    with open(os.path.join(path, 'deletes-2024-01-02.txt'), 'w') as fd:
+        fd.write('5\tSanta Monica\tduplicate\n')
+    with open(os.path.join(path, 'modifications-2024-01-02.txt'), 'w') as fd:
+        fd.write(gn_row(1, 'Los Angeles', '34.05223', '-118.24368', 'US', 'CA', '037', 3898747,
+                        feature_code='PPLA2'))
+
+
+def test_build_locations():
+    with tempfile.TemporaryDirectory() as path:
+        write_dataset(path)
+        locations = rg_build.build_locations(os.path.join(path, 'cities1000.zip'),
+                                             os.path.join(path, rvg.GN_ADMIN1), os.path.join(path, rvg.GN_ADMIN2))
+        assert locations.fieldnames == rg_build.BUILD_COLUMNS
+        assert [row['name'] for row in locations] == ['Los Angeles', 'Paris', 'Nowhere']
+        assert locations[0]['admin1'] == 'California' and locations[0]['admin2'] == 'Los Angeles County'
+        assert locations[1]['admin1'] == 'Ile-de-France' and locations[1]['admin2'] == 'Paris'
+        assert locations[2]['admin1'] == '' and locations[2]['admin2'] == ''
+        assert locations[1]['population'] == '2138551' and locations[1]['geoname_id'] == '2'
+
+
+def test_update_index():
+    with tempfile.TemporaryDirectory() as path:
+        write_dataset(path)
+        admin = os.path.join(path, rvg.GN_ADMIN1), os.path.join(path, rvg.GN_ADMIN2)
+        index_path = os.path.join(path, 'cities.idx')
+        assert rg_build.build_index(os.path.join(path, 'cities1000.zip'), index_path, *admin) == 3
+
+        daily = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.startswith('modifications')]
+        deletes = [os.path.join(path, 'deletes-2024-01-02.txt')]
+        assert rg_build.update_index(index_path, daily[:1], [], os.path.join(path, 'day1.idx'), *admin) == 4
+        assert rg_build.update_index(index_path, daily, deletes, None, *admin) == 3
+
+        records = {row['geoname_id']: row for row in rg_index.load_index(index_path)}
+        assert sorted(records) == ['1', '2', '3']
+        assert records['1']['population'] == '3898747'
+        assert records['3']['name'] == 'Somewhere' and records['3']['lat'] == '11.5'
+
+        with rvg.RGeocoderImpl.from_index(index_path, mode=1, verbose=False) as rgeo:
+            assert rgeo.query([(11.4, 21.4)])[0]['name'] == 'Somewhere'
+
+
+def test_do_extract():
+    with tempfile.TemporaryDirectory() as path:
+        write_dataset(path)
+        cwd = os.getcwd()
+        os.chdir(path)
+        try:
+            rgeo = rvg.RGeocoderImpl.__new__(rvg.RGeocoderImpl)
+            rgeo.verbose = False
+            rgeo.do_extract(rvg.GN_CITIES1000, 'rg_cities.csv')
+            with open('rg_cities.csv', 'rt') as fd:
+                lines = fd.read().splitlines()
+            assert not os.path.exists(rvg.GN_CITIES1000 + '.txt')
+        finally:
+            os.chdir(cwd)
+        assert lines[0] == ','.join(rvg.RG_COLUMNS + rvg.RG_EXTRA_COLUMNS)
+        assert lines[1] == '34.05223,-118.24368,Los Angeles,California,Los Angeles County,US,3971883,PPLA2'
+        assert lines[4] == '40.0,-110.0,Mount Something,,,US,0,MT'
+
+
+if __name__ == '__main__':
+    test_build_locations()
+    test_update_index()
+    test_do_extract()
+    print('OK')
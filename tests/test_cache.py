@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import rvgeocoder as rvg
+from rvgeocoder.cache import QueryCache
+
+
+@pytest.mark.parametrize('ecef', [False, True])
+def test_cached_queries(gen_data, ecef):
+    data = gen_data(5000)
+    # repeated coordinates, rounded to the cache precision so both geocoders query the same points
+    points = np.round(np.random.uniform([-60, -180], [70, 180], (1000, 2)), 4)
+    points = points[np.random.randint(0, len(points), 5000)]
+    rgeo = rvg.RGeocoderImpl.from_data(data, mode=1, ecef=ecef, verbose=False)
+    cached = rvg.RGeocoderImpl.from_data(data, mode=1, ecef=ecef, cache_size=600, verbose=False)
+    expected = rgeo.query_array(points, return_distance=True)
+    for _ in range(2):
+        result = cached.query_array(points, return_distance=True)
+        assert np.array_equal(result['index'], expected['index'])
+        assert np.allclose(result['distance'], expected['distance'])
+    assert cached.query(points[:50]) == rgeo.query(points[:50])
+    stats = cached.cache.stats()
+    assert len(cached.cache) == stats['size'] == 600 and stats['hits'] > 0
+    assert stats['hits'] + stats['misses'] == 2 * len(points) + 50
+
+    cached.cache.clear()
+    assert len(cached.cache) == 0 and cached.cache.stats()['hit_rate'] == 0.0
+
+
+def test_out_of_range(gen_data):
+    data = gen_data(5000)
+    rgeo = rvg.RGeocoderImpl.from_data(data, mode=1, verbose=False)
+    cached = rvg.RGeocoderImpl.from_data(data, mode=1, cache_size=100, verbose=False)
+    # out of range coordinates would share the keys of in range ones
+    points = np.array([(10, 200), (10.0001, -160.0001), (95, 0), (-85, 0), (10, -160), (10, 200)])
+    for batch in (points, points[::-1], points[:1], points[1:2]):
+        expected = rgeo.query_array(batch, return_distance=True)
+        result = cached.query_array(batch, return_distance=True)
+        assert np.array_equal(result['index'], expected['index'])
+        assert np.allclose(result['distance'], expected['distance'])
+    # only the in range coordinates are cached
+    assert len(cached.cache) == 3
+
+    # NaN coordinates are queried as given, never cached
+    cache = QueryCache(10)
+    queried = []
+
+    def query_func(batch):
+        queried.append(batch)
+        return np.zeros(len(batch)), np.arange(len(batch))
+    cache.query(np.array([(np.nan, 0.0), (1.0, 2.0), (np.nan, 0.0)]), query_func)
+    assert len(cache) == 1 and cache.stats()['misses'] == 3
+    assert np.isnan(queried[1][:, 0]).all() and len(queried[1]) == 2
+
+    try:
+        QueryCache(10, precision=8)
+        assert False, 'precision too high'
+    except ValueError:
+        pass
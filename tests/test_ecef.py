@@ -0,0 +1,34 @@
+import numpy as np
+import rvgeocoder as rvg
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * rvg.R_MEAN * np.arcsin(np.sqrt(a))
+
+
+def test_ecef_distances(gen_data):
+    points = np.random.uniform([-80, -180], [80, 180], (2000, 2))
+    data = gen_data(5000)
+    rgeo = rvg.RGeocoderImpl.from_data(data, mode=1, ecef=True, verbose=False)
+    result = rgeo.query_array(points, return_distance=True, columns=['lat', 'lon'])
+    expected = haversine(points[:, 0], points[:, 1], result['lat'], result['lon'])
+    assert np.allclose(result['distance'], expected, rtol=0.01, atol=0.01)
+
+    # the nearest location measured on the ellipsoid, brute force
+    locations = rgeo.locations.coords
+    for lat, lon, index in zip(points[:50, 0], points[:50, 1], result['index'][:50]):
+        dists = np.linalg.norm(rvg.latlon_in_ecef(locations[:, 0], locations[:, 1]) -
+                               rvg.geodetic_in_ecef([(lat, lon)]), axis=1)
+        assert index == np.argmin(dists)
+
+
+def test_ecef_antimeridian():
+    data = 'lat,lon,name,admin1,admin2,cc\n60.0,-179.9,East,,,\n60.0,179.0,West,,,\n'
+    point = [(60.0, 179.95)]
+    # in degrees the location across the antimeridian is 359 degrees away
+    assert rvg.RGeocoderImpl.from_data(data, mode=1, verbose=False).query(point)[0]['name'] == 'West'
+    rgeo = rvg.RGeocoderImpl.from_data(data, mode=1, ecef=True, verbose=False)
+    (dist, record), = rgeo.query_dist(point)
+    assert record['name'] == 'East' and abs(dist - haversine(60.0, 179.95, 60.0, -179.9)) < 0.05
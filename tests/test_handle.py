@@ -0,0 +1,105 @@
+import threading
+import time
+import numpy as np
+import pytest
+import rvgeocoder as rvg
+from rvgeocoder import handle as rg_handle
+from rvgeocoder.handle import GeocoderHandle
+
+
+def gen_rows(n, prefix='New'):
+    return [{'lat': '%.5f' % lat, 'lon': '%.5f' % lon, 'name': '%s %d' % (prefix, i), 'cc': 'XX'}
+            for i, (lat, lon) in enumerate(np.random.uniform([-60, -180], [70, 180], (n, 2)).tolist())]
+
+
+def check_live(handle, points, removed_names):
+    # a geocoder built over the live locations answers the same
+    live = [dict(zip(handle.fieldnames, row)) for row in _live_rows(handle)]
+    assert not removed_names & {row['name'] for row in live}
+    reference = rvg.RGeocoderImpl(locations=rvg.LocationStore.from_rows(
+        handle.fieldnames, ([row[name] for name in handle.fieldnames] for row in live)),
+        mode=1, ecef=handle.geocoder.ecef, verbose=False)
+    expected = reference.query_array(points, return_distance=True, columns=['name'])
+    result = handle.query_array(points, return_distance=True, columns=['name'])
+    assert np.allclose(result['distance'], expected['distance'])
+    assert np.array_equal(result['name'], expected['name'])
+    assert handle.query(points[:20]) == reference.query(points[:20])
+
+
+def _live_rows(handle):
+    snapshot = handle._snapshot
+    removed = set(snapshot.removed.tolist())
+    return [[snapshot.locations[n][name] for name in handle.fieldnames]
+            for n in range(len(snapshot.locations)) if n not in removed]
+
+
+@pytest.mark.parametrize('ecef', [False, True])
+def test_delta(gen_data, ecef):
+    points = np.random.uniform([-60, -180], [70, 180], (2000, 2))
+    with GeocoderHandle(rvg.RGeocoderImpl.from_data(gen_data(), mode=1, ecef=ecef, verbose=False),
+                        auto_compact=False) as handle:
+        added = handle.add(gen_rows(500))
+        assert np.array_equal(added, np.arange(10000, 10500)) and len(handle) == 10500
+        # remove the nearest locations of some points, in the main tree and in the delta
+        nearest = handle.query_array(points[:300])['index']
+        handle.remove(np.append(nearest, added[:50]), generation=handle.generation)
+        removed_names = set(handle._snapshot.locations.take(handle._snapshot.removed, ['name'])['name'])
+        check_live(handle, points, removed_names)
+
+        assert handle.compact().result() is True and handle.generation == 1
+        assert len(handle.geocoder.locations) == len(handle) and len(handle._snapshot.delta) == 0
+        check_live(handle, points, removed_names)
+        try:
+            handle.remove([0], generation=0)
+            assert False, 'stale generation'
+        except ValueError:
+            pass
+
+
+def test_changes_while_compacting(gen_data, monkeypatch):
+    points = np.random.uniform([-60, -180], [70, 180], (1000, 2))
+    with GeocoderHandle(rvg.RGeocoderImpl.from_data(gen_data(), mode=1, verbose=False), max_delta=100) as handle:
+        warm_up = rg_handle.warm_up
+
+        def concurrent_changes(geocoder):
+            # changes made after the compaction took its snapshot
+            handle.add(gen_rows(10, 'Late'))
+            handle.remove([0, 10005, len(handle._snapshot.locations) - 1])
+            return warm_up(geocoder)
+        monkeypatch.setattr(rg_handle, 'warm_up', concurrent_changes)
+        handle.add(gen_rows(99))
+        handle.remove([5])  # reaches max_delta
+        assert handle._compaction.result() is True and handle.generation == 1
+        names = {row[2] for row in _live_rows(handle)}
+        assert 'Place 0' not in names and 'Place 5' not in names and 'New 5' not in names
+        assert 'Late 9' not in names and 'Late 8' in names and len(handle) == 10000 + 99 + 10 - 4
+        check_live(handle, points, set())
+
+
+def test_reload(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (100, 2))
+    errors = []
+    with GeocoderHandle(rvg.RGeocoderImpl.from_data(gen_data(1000), mode=2, verbose=False)) as handle:
+        stop = threading.Event()
+
+        def queries():
+            while not stop.is_set():
+                try:
+                    assert len(handle.query(points)) == len(points)
+                except Exception as error:
+                    errors.append(error)
+
+        threads = [threading.Thread(target=queries) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        previous = handle.geocoder
+        data = gen_data(1000, 'Reloaded')
+        assert handle.reload(lambda: rvg.RGeocoderImpl.from_data(data, mode=2, verbose=False)).result() == 1
+        time.sleep(0.2)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        assert not errors
+        assert all(record['name'].startswith('Reloaded') for record in handle.query(points))
+        # the replaced geocoder was closed once its queries were done
+        assert previous._tree._procs == []
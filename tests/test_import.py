@@ -0,0 +1,45 @@
+import subprocess
+import sys
+
+# modules that must not be imported by `import rvgeocoder`, they are loaded on first use
+DEFERRED_MODULES = ('scipy', 'shapely', 'multiprocessing', 'zipfile', 'urllib.request')
+
+# budget of the import of rvgeocoder itself (numpy excluded) in microseconds
+IMPORT_BUDGET_US = 150000
+
+
+def import_times(module):
+    """
+    Function that imports module in a fresh interpreter with -X importtime
+    Returns:
+        dict of each imported module to its cumulative import time in microseconds
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                            capture_output=True, text=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_heavy_modules_are_deferred():
+    imported = import_times('rvgeocoder')
+    deferred = [name for name in imported if name.split('.')[0] in DEFERRED_MODULES or name in DEFERRED_MODULES]
+    assert not deferred, 'imported by rvgeocoder: %s' % ', '.join(deferred)
+
+
+def test_import_time_budget():
+    imported = import_times('rvgeocoder')
+    own = imported['rvgeocoder'] - imported.get('numpy', 0)
+    assert own < IMPORT_BUDGET_US, 'rvgeocoder imported in %d us (budget %d us)' % (own, IMPORT_BUDGET_US)
+
+
+if __name__ == '__main__':
+    imported = import_times('rvgeocoder')
+    print('rvgeocoder: %.1f ms, numpy: %.1f ms' % (imported['rvgeocoder'] / 1000, imported.get('numpy', 0) / 1000))
+    test_heavy_modules_are_deferred()
+    test_import_time_budget()
+    print('Import checks passed')
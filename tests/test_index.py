@@ -0,0 +1,24 @@
+import os
+import tempfile
+import numpy as np
+import rvgeocoder as rvg
+from rvgeocoder import index as rg_index
+
+
+def test_index_round_trip(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (2000, 2))
+    with tempfile.TemporaryDirectory() as path:
+        rgeo = rvg.RGeocoderImpl.from_data(gen_data(), mode=1, verbose=False)
+        rgeo.build_index(os.path.join(path, 'index'))
+        assert rg_index.is_index(os.path.join(path, 'index'))
+        loaded = rg_index.load_index(os.path.join(path, 'index'))
+        assert loaded.fieldnames == rgeo.locations.fieldnames and len(loaded) == len(rgeo.locations)
+        assert isinstance(loaded.coords, np.memmap)
+        # the index keeps the locations in tree order, with the same columns
+        order = np.lexsort((loaded.column('lon'), loaded.column('lat')))
+        expected = np.lexsort((rgeo.locations.column('lon'), rgeo.locations.column('lat')))
+        for name in loaded.fieldnames:
+            assert np.array_equal(loaded.column(name)[order], rgeo.locations.column(name)[expected]), name
+
+        indexed = rvg.RGeocoderImpl.from_index(os.path.join(path, 'index'), mode=3, verbose=False)
+        assert indexed.query(points) == rgeo.query(points)
@@ -0,0 +1,110 @@
+import csv
+import io
+import os
+import tempfile
+import numpy as np
+import rvgeocoder as rvg
+from rvgeocoder.locations import LocationStoreBuilder
+
+
+# lines 3, 5, 7 and 8 have missing, malformed or out of range coordinates
+INVALID = '\n'.join(['lat,lon,name,admin1,admin2,cc', '10,20,A,a,b,C', 'abc,20,B,a,b,C', '', '95,10,C,a,b,C',
+                     '11,21,D,a,b,C', '12', '13,200,F,a,b,C', '14,24,G,a,b,C']) + '\n'
+
+
+def write_file(filename, data):
+    with open(filename, 'w') as fd:
+        fd.write(data)
+    return filename
+
+
+def test_from_files(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (1000, 2))
+    data = [gen_data(3000, 'First'), gen_data(2000, 'Second')]
+    with tempfile.TemporaryDirectory() as path:
+        files = [write_file(os.path.join(path, 'locations%d.csv' % n), text) for n, text in enumerate(data)]
+        rows = [row for text in data for row in csv.DictReader(io.StringIO(text))]
+        locations = rvg.RGeocoderDataLoader.load_files_locations(files)
+        assert locations[:] == rows
+
+        # same geocoder as over the csv text of both files
+        rgeo = rvg.RGeocoderImpl.from_files(files, mode=1, verbose=False)
+        merged = data[0] + data[1].split('\n', 1)[1]
+        assert rgeo.query(points) == rvg.RGeocoderImpl.from_data(merged, mode=1, verbose=False).query(points)
+
+        # a small chunk size gives the same store
+        builder = LocationStoreBuilder(rvg.RG_COLUMNS)
+        reader = csv.reader(io.StringIO(merged))
+        next(reader)
+        builder.append_rows(reader, chunk_size=7)
+        assert builder.build()[:] == rows
+
+        write_file(files[1], data[1].replace('admin2', 'district', 1))
+        try:
+            rvg.RGeocoderDataLoader.load_files_locations(files)
+            assert False, 'different headers'
+        except Exception as error:
+            assert 'different header' in str(error)
+
+
+def test_create_patch_locations(gen_data):
+    data, patch = gen_data(5000), gen_data(100, 'Patch')
+    with tempfile.TemporaryDirectory() as path:
+        loc_file = write_file(os.path.join(path, 'locations.csv'), data)
+        patch_file = write_file(os.path.join(path, 'patch.csv'), patch)
+        poly_file = write_file(os.path.join(path, 'polygons.csv'),
+                               'name,geometry\nPatched,"POLYGON ((-30 -20, 40 -20, 40 30, -30 30, -30 -20))"\n')
+        output_file = os.path.join(path, 'patched.csv')
+        locations = rvg.RGeocoderDataLoader.create_patch_locations([loc_file], patch_file, output_file, poly_file)
+
+        # the original locations inside the polygon are replaced by the patch locations
+        expected = [row for row in csv.DictReader(io.StringIO(data))
+                    if not (-30 <= float(row['lon']) <= 40 and -20 <= float(row['lat']) <= 30)]
+        expected += list(csv.DictReader(io.StringIO(patch)))
+        assert len(expected) < 5100 and locations[:] == expected
+        with open(output_file, newline='') as fd:
+            assert list(csv.DictReader(fd)) == expected
+
+        locations = rvg.RGeocoderDataLoader.create_patch_locations([loc_file], patch_file)
+        assert len(locations) == 5100
+
+
+def test_invalid_rows(gen_data):
+    report = "line 3 ('abc', '20'), line 5 ('95', '10'), line 7 ('12', ''), line 8 ('13', '200')"
+    with tempfile.TemporaryDirectory() as path:
+        files = [write_file(os.path.join(path, 'locations.csv'), gen_data(100)),
+                 write_file(os.path.join(path, 'invalid.csv'), INVALID)]
+        # the line numbers are those of the file, header and blank lines included
+        try:
+            rvg.RGeocoderDataLoader.load_files_locations(files)
+            assert False, 'invalid coordinates'
+        except ValueError as error:
+            assert str(error) == 'File %s: Malformed or out of range coordinates at %s' % (files[1], report)
+        try:
+            rvg.RGeocoderImpl.from_data(INVALID, mode=1, verbose=False)
+            assert False, 'invalid coordinates'
+        except ValueError as error:
+            assert report in str(error)
+
+        locations = rvg.RGeocoderDataLoader.load_files_locations(files, skip_invalid=True)
+        assert [row['name'] for row in locations[100:]] == ['A', 'D', 'G']
+        rgeo = rvg.RGeocoderImpl.from_files(files, mode=1, skip_invalid=True, verbose=False)
+        assert rgeo.query([(14, 24)])[0]['name'] == 'G'
+
+    # rows split over several chunks keep their line numbers
+    reader = csv.reader(io.StringIO(INVALID))
+    builder = LocationStoreBuilder(next(reader))
+    try:
+        builder.append_rows(reader, chunk_size=2)
+        assert False, 'invalid coordinates'
+    except ValueError as error:
+        assert str(error) == "Malformed or out of range coordinates at line 3 ('abc', '20')"
+    reader = csv.reader(io.StringIO(INVALID))
+    builder = LocationStoreBuilder(next(reader), skip_invalid=True)
+    builder.append_rows(reader, chunk_size=2)
+    assert builder.skipped == 4 and [row['name'] for row in builder.build()] == ['A', 'D', 'G']
+    try:
+        LocationStoreBuilder(['latitude', 'longitude', 'name'])
+        assert False, 'missing lat/lon columns'
+    except ValueError:
+        pass
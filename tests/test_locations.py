@@ -0,0 +1,47 @@
+import csv
+import io
+import numpy as np
+import pytest
+import rvgeocoder as rvg
+
+
+def test_store_records(gen_data):
+    data = gen_data(1000)
+    rows = list(csv.DictReader(io.StringIO(data)))
+    reader = csv.reader(io.StringIO(data))
+    locations = rvg.LocationStore.from_rows(next(reader), reader)
+    # records are the rows of csv.DictReader, coordinates included as their source text
+    assert len(locations) == len(rows) and locations[:] == rows and locations[-1] == rows[-1]
+    assert np.array_equal(locations.column('lat'), np.array([row['lat'] for row in rows], dtype=np.float64))
+    indices = np.array([5, 0, 999, 5])
+    assert list(locations.take(indices, ['name'])['name']) == [rows[n]['name'] for n in indices]
+    assert locations.subset(indices)[:] == [rows[n] for n in indices]
+    assert rvg.LocationStore.concat([locations.subset([1, 2]), locations.subset([3])])[:] == rows[1:4]
+
+
+def test_query_array(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (1000, 2))
+    rgeo = rvg.RGeocoderImpl.from_data(gen_data(), mode=1, verbose=False)
+    records = rgeo.query(points)
+    result = rgeo.query_array(points[:, 0], points[:, 1], return_distance=True, columns=['name', 'cc', 'lat'])
+    assert sorted(result) == ['cc', 'distance', 'index', 'lat', 'name']
+    assert list(result['name']) == [record['name'] for record in records]
+    assert result['lat'].dtype == np.float64 and np.all(result['distance'] >= 0)
+    assert np.array_equal(rgeo.query_array(points)['index'], result['index'])
+    assert rgeo.query_columns(points, ['name'])['name'].tolist() == result['name'].tolist()
+    empty = rgeo.query_array(np.empty((0, 2)), columns=['name'])
+    assert len(empty['index']) == 0 and len(empty['name']) == 0
+    # float32 and strided columns are converted, arrays of shape (n, 2) queried as is
+    lats, lons = points[:, 0].astype(np.float32), np.asfortranarray(points)[:, 1]
+    expected = rgeo.query_array(lats.astype(np.float64), lons)['index']
+    assert np.array_equal(rgeo.query_array(lats, lons)['index'], expected)
+    assert np.array_equal(rgeo.query_array(points.tolist())['index'], result['index'])
+
+
+def test_query_arrow(gen_data):
+    pa = pytest.importorskip('pyarrow')
+    points = np.random.uniform([-60, -180], [70, 180], (1000, 2))
+    rgeo = rvg.RGeocoderImpl.from_data(gen_data(), mode=1, verbose=False)
+    expected = rgeo.query_array(points[:, 0], points[:, 1], columns=['name'])
+    result = rgeo.query_array(pa.array(points[:, 0]), pa.array(points[:, 1]), columns=['name'])
+    assert np.array_equal(result['index'], expected['index']) and list(result['name']) == list(expected['name'])
@@ -0,0 +1,45 @@
+import numpy as np
+import rvgeocoder as rvg
+from rvgeocoder.metrics import QueryMetrics
+
+
+def test_stages(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (5000, 2))
+    traced = []
+    with rvg.RGeocoderImpl.from_data(gen_data(), mode=3, verbose=False) as rgeo:
+        expected = rgeo.query(points[:100])
+        rgeo.metrics = QueryMetrics(callback=lambda stage, elapsed, size: traced.append((stage, size)))
+        assert rgeo.query(points[:100]) == expected
+        rgeo.query_array(points, columns=['name'])
+        stats = rgeo.metrics.stats()
+        assert stats['batches'] == 2 and stats['points'] == 5100 and stats['batch_size_max'] == 5000
+        assert stats['convert_count'] == 2 and stats['tree_count'] == 2 and stats['assemble_count'] == 2
+        assert stats['tree_us_max'] > 0 and stats['errors'] == 0
+        assert ('tree', 5000) in traced and ('assemble', 100) in traced
+        rgeo.metrics.reset()
+        assert rgeo.metrics.stats()['batches'] == 0
+
+
+def test_pool_stages(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (5000, 2))
+    rgeo = rvg.RGeocoderImpl.from_data(gen_data(), mode=2, verbose=False)
+    # set before the pool is started, to record its spawn
+    rgeo.metrics = QueryMetrics()
+    with rgeo:
+        rgeo.query_array(points)
+        rgeo.query_radius(points[:100], 1.0)
+        stats = rgeo.metrics.stats()
+        assert stats['spawn_count'] == 1 and 1 <= stats['worker_build_count'] <= rgeo.tree._nprocs
+        assert stats['pool_query_count'] == 3 and stats['worker_query_count'] >= 3
+        assert stats['shm_copy_count'] == 4 and stats['batches'] == 2 and stats['workers_max'] >= 1
+
+        # worker exceptions are reported with their traceback
+        try:
+            rgeo.tree._run_batch('query', ['rvgeocoder_missing_block'], 10, (1, 0, 2, np.inf))
+            assert False, 'missing shared memory block'
+        except RuntimeError as error:
+            assert 'FileNotFoundError' in str(error)
+        stats = rgeo.metrics.stats()
+        assert stats['errors'] >= 1 and 'Traceback' in stats['last_errors'][0]
+        # the pool still serves queries
+        assert len(rgeo.query_array(points)['index']) == len(points)
@@ -0,0 +1,14 @@
+import numpy as np
+import rvgeocoder as rvg
+from rvgeocoder.cKDTree_MP import cKDTree_MP
+
+
+def test_mode3_workers(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (2000, 2))
+    data = gen_data(1000)
+    expected = rvg.RGeocoderImpl.from_data(data, mode=1, verbose=False).query_array(points)['index']
+    for workers in (1, 2, -1):
+        rgeo = rvg.RGeocoderImpl.from_data(data, mode=3, workers=workers, verbose=False)
+        assert np.array_equal(rgeo.query_array(points)['index'], expected)
+        # mode 3 queries an in-process tree, without a pool
+        assert not isinstance(rgeo.tree, cKDTree_MP)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import rvgeocoder as rvg
+
+
+def brute_force(rgeo, points):
+    # distances from each point to every location, in the space of the tree
+    locations = rgeo.locations.coords
+    if rgeo.ecef:
+        chords = np.linalg.norm(rvg.geodetic_in_ecef(points)[:, None, :] -
+                                rvg.latlon_in_ecef(locations[:, 0], locations[:, 1])[None, :, :], axis=2)
+        return rvg.ecef_chord_to_km(chords)
+    return np.linalg.norm(points[:, None, :] - locations[None, :, :], axis=2)
+
+
+@pytest.mark.parametrize('mode', [1, 2, 3])
+@pytest.mark.parametrize('ecef', [False, True])
+def test_query_k(gen_data, mode, ecef):
+    points = np.random.uniform([-60, -180], [70, 180], (200, 2))
+    with rvg.RGeocoderImpl.from_data(gen_data(2000), mode=mode, ecef=ecef, verbose=False) as rgeo:
+        result = rgeo.query_k(points, 5, ['name', 'lat'])
+        dists = brute_force(rgeo, points)
+        nearest = np.argsort(dists, axis=1)[:, :5]
+        assert result['index'].shape == (len(points), 5)
+        assert np.array_equal(result['index'], nearest)
+        assert np.allclose(result['distance'], np.take_along_axis(dists, nearest, axis=1))
+        assert np.array_equal(result['lat'], rgeo.locations.coords[nearest, 0])
+        assert list(result['name'][:, 0]) == [record['name'] for record in rgeo.query(points)]
+
+
+def test_query_k_padding(gen_data):
+    rgeo = rvg.RGeocoderImpl.from_data(gen_data(10), mode=1, verbose=False)
+    result = rgeo.query_k([(10, 10), (-10, -10)], 15, ['name', 'lat'])
+    assert result['index'].shape == (2, 15)
+    assert (result['index'][:, 10:] == -1).all() and (result['index'][:, :10] >= 0).all()
+    assert np.isinf(result['distance'][:, 10:]).all() and np.isfinite(result['distance'][:, :10]).all()
+    assert all(name is None for name in result['name'][:, 10:].ravel()) and np.isnan(result['lat'][:, 10:]).all()
+    assert sorted(result['name'][0, :10]) == sorted('Place %d' % n for n in range(10))
+
+
+@pytest.mark.parametrize('mode', [1, 2, 3])
+@pytest.mark.parametrize('ecef', [False, True])
+def test_query_radius(gen_data, mode, ecef):
+    points = np.random.uniform([-60, -180], [70, 180], (200, 2))
+    # degrees in lat/lon, kms with ecef, one radius or a radius per point
+    radius = 500.0 if ecef else 5.0
+    with rvg.RGeocoderImpl.from_data(gen_data(2000), mode=mode, ecef=ecef, verbose=False) as rgeo:
+        dists = brute_force(rgeo, points)
+        for r in (radius, np.random.uniform(0, 2 * radius, len(points))):
+            result = rgeo.query_radius(points, r, ['name'])
+            offsets = result['offsets']
+            assert offsets[0] == 0 and 0 < offsets[-1] == len(result['index']) == len(result['name'])
+            r = np.broadcast_to(r, len(points))
+            for n in range(len(points)):
+                # the brute force neighbours, up to rounding errors at the radius, nearest first
+                expected = np.flatnonzero(dists[n] <= r[n])
+                expected = expected[np.argsort(dists[n, expected])]
+                found = result['index'][offsets[n]:offsets[n + 1]]
+                close = np.abs(dists[n] - r[n]) < 1e-6 * max(r[n], 1)
+                assert set(found) ^ set(expected) <= set(np.flatnonzero(close))
+                assert np.all(np.diff(result['distance'][offsets[n]:offsets[n + 1]]) >= 0)
+                assert np.allclose(result['distance'][offsets[n]:offsets[n + 1]], dists[n, found])
+                assert list(result['name'][offsets[n]:offsets[n + 1]]) == \
+                    [rgeo.locations[index]['name'] for index in found]
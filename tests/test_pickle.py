@@ -0,0 +1,53 @@
+import multiprocessing as mp
+import os
+import pickle
+import tempfile
+import threading
+import numpy as np
+import rvgeocoder as rvg
+
+
+def lookup(args):
+    rgeo, points = args
+    return os.getpid(), id(rgeo), rgeo.query_array(points)['index']
+
+
+def test_same_process(gen_data):
+    rgeo = rvg.RGeocoderImpl.from_data(gen_data(1000), mode=1, verbose=False)
+    data = pickle.dumps(rgeo)
+    # unpickled in its own process, a geocoder is the geocoder itself
+    assert pickle.loads(data) is rgeo
+    restored = []
+    threads = [threading.Thread(target=lambda: restored.append(pickle.loads(data))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(item is rgeo for item in restored)
+
+
+def test_spawn_pool(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (1000, 2))
+    with tempfile.TemporaryDirectory() as path:
+        rgeo = rvg.RGeocoderImpl.from_data(gen_data(), mode=1, verbose=False)
+        rgeo.build_index(os.path.join(path, 'index'))
+        for rgeo in (rgeo, rvg.RGeocoderImpl.from_index(os.path.join(path, 'index'), mode=3, verbose=False)):
+            expected = rgeo.query_array(points)['index']
+            with mp.get_context('spawn').Pool(2) as pool:
+                results = pool.map(lookup, [(rgeo, points)] * 8)
+            instances = {}
+            for pid, instance, indices in results:
+                assert np.array_equal(indices, expected)
+                instances.setdefault(pid, set()).add(instance)
+            # one geocoder per process, whatever the number of tasks
+            assert all(len(ids) == 1 for ids in instances.values())
+            assert os.getpid() not in instances
+
+
+def test_mode2_fork_pool(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (1000, 2))
+    with rvg.RGeocoderImpl.from_data(gen_data(), mode=2, verbose=False) as rgeo:
+        expected = rgeo.query_array(points)['index']
+        with mp.get_context('fork').Pool(2) as pool:
+            results = pool.map(lookup, [(rgeo, points)] * 4)
+        assert all(np.array_equal(indices, expected) for _, _, indices in results)
@@ -0,0 +1,94 @@
+import csv
+import io
+import os
+import pickle
+import tempfile
+import numpy as np
+import rvgeocoder as rvg
+from rvgeocoder.polygons import PolygonIndex
+
+# the second polygon overlaps the first one on lat 45..50, lon 5..10
+POLYGONS = [
+    {'name': 'Square', 'cc': 'SQ', 'admin1': 'Square Admin1', 'geometry': 'POLYGON ((0 40, 10 40, 10 50, 0 50, 0 40))'},
+    {'name': 'Overlap', 'cc': 'OV', 'admin1': 'Overlap Admin1',
+     'geometry': 'MULTIPOLYGON (((5 45, 15 45, 15 55, 5 55, 5 45)), ((-100 -10, -90 -10, -90 0, -100 -10)))'},
+]
+
+
+def write_polygons(filename):
+    with open(filename, 'w', newline='') as fd:
+        writer = csv.DictWriter(fd, ['name', 'cc', 'admin1', 'geometry'])
+        writer.writeheader()
+        writer.writerows(POLYGONS)
+    return filename
+
+
+def polygon_of(lats, lons):
+    # expected polygon of each point, the first one for points inside both
+    square = (lons >= 0) & (lons <= 10) & (lats >= 40) & (lats <= 50)
+    overlap = (lons >= 5) & (lons <= 15) & (lats >= 45) & (lats <= 55)
+    triangle = (lons <= -90) & (lats >= -10) & (lats <= lons + 90)
+    return np.where(square, 0, np.where(overlap | triangle, 1, -1))
+
+
+def test_remove_polygons_points(gen_data):
+    with tempfile.TemporaryDirectory() as path:
+        poly_file = write_polygons(os.path.join(path, 'polygons.csv'))
+        # half of the locations around the polygons, in two files
+        data = gen_data(20000, clustered=True)
+        files = [os.path.join(path, 'locations%d.csv' % n) for n in range(2)]
+        for filename in files:
+            with open(filename, 'w') as fd:
+                fd.write(data)
+        rows = list(csv.DictReader(io.StringIO(data)))
+        lats = np.array([float(row['lat']) for row in rows])
+        lons = np.array([float(row['lon']) for row in rows])
+        kept = [row for row, polygon in zip(rows, polygon_of(lats, lons)) if polygon < 0]
+        assert 0 < len(kept) < len(rows)
+
+        locations = rvg.RGeocoderDataLoader.load_files_locations(files, patch_poly_file=poly_file)
+        assert locations[:] == kept + kept
+        locations = rvg.RGeocoderDataLoader.load_files_locations(files)
+        assert len(locations) == 2 * len(rows)
+
+
+def test_locate():
+    points = np.random.uniform([-20, -110], [60, 20], (5000, 2))
+    with tempfile.TemporaryDirectory() as path:
+        polygons = PolygonIndex.from_file(write_polygons(os.path.join(path, 'polygons.csv')))
+    assert len(polygons) == 2 and polygons.names == ['Square', 'Overlap']
+    assert list(polygons.columns['cc']) == ['SQ', 'OV']
+    expected = polygon_of(points[:, 0], points[:, 1])
+    assert np.array_equal(polygons.locate(points[:, 0], points[:, 1]), expected)
+    restored = pickle.loads(pickle.dumps(polygons))
+    assert np.array_equal(restored.locate(points[:, 0], points[:, 1]), expected)
+    assert list(PolygonIndex([]).locate(points[:3, 0], points[:3, 1])) == [-1, -1, -1]
+
+
+def test_polygon_queries(gen_data):
+    data = gen_data(5000)
+    points = np.vstack([np.random.uniform([-20, -110], [60, 20], (1000, 2)), [(47, 7), (52, 12), (0, 0)]])
+    inside = polygon_of(points[:, 0], points[:, 1])
+    with tempfile.TemporaryDirectory() as path:
+        poly_file = write_polygons(os.path.join(path, 'polygons.csv'))
+        plain = rvg.RGeocoderImpl.from_data(data, mode=1, verbose=False)
+        rgeo = rvg.RGeocoderImpl.from_data(data, mode=1, polygons_file=poly_file, verbose=False)
+
+    # the points inside a polygon get its attributes, the other columns are those of the nearest location
+    expected = plain.query(points)
+    for record, polygon in zip(expected, inside):
+        if polygon >= 0:
+            record.update({name: POLYGONS[polygon][name] for name in ('name', 'cc', 'admin1')})
+    assert rgeo.query(points) == expected
+    assert [record for _, record in rgeo.query_dist(points)] == expected
+    assert expected[-3]['name'] == 'Square' and expected[-2]['cc'] == 'OV' and expected[-1]['cc'] == 'CC'
+
+    result = rgeo.query_columns(points, ['name', 'admin2'])
+    assert list(result['name']) == [record['name'] for record in expected]
+    assert list(result['admin2']) == [record['admin2'] for record in expected]
+
+    result = rgeo.query_array(points, return_distance=True, columns=['cc', 'lat'])
+    assert np.array_equal(result['polygon'], inside)
+    assert list(result['cc']) == [record['cc'] for record in expected]
+    assert np.array_equal(result['lat'], plain.query_array(points, columns=['lat'])['lat'])
+    assert np.allclose(result['distance'], plain.query_array(points, return_distance=True)['distance'])
@@ -0,0 +1,40 @@
+import numpy as np
+import rvgeocoder as rvg
+from rvgeocoder.cKDTree_MP import cKDTree_MP
+
+
+def test_modes_match(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (5000, 2))
+    data = gen_data()
+    results = {}
+    for mode in (1, 2, 3):
+        with rvg.RGeocoderImpl.from_data(data, mode=mode, verbose=False) as rgeo:
+            results[mode] = (rgeo.query(points[:500]), rgeo.query_array(points, return_distance=True))
+    for mode in (2, 3):
+        assert results[mode][0] == results[1][0]
+        assert np.array_equal(results[mode][1]['index'], results[1][1]['index'])
+        assert np.allclose(results[mode][1]['distance'], results[1][1]['distance'])
+
+
+def test_pool_lifecycle():
+    data = np.random.uniform([-60, -180], [70, 180], (20000, 2))
+    points = np.random.uniform([-60, -180], [70, 180], (10000, 2))
+    expected_d, expected_i = cKDTree_MP(data).query(points, k=3)
+    tree = cKDTree_MP(data, nprocs=2, min_chunk=100)
+    with tree:
+        procs = list(tree._procs)
+        assert len(procs) == 2 and all(proc.is_alive() for proc in procs)
+        for _ in range(3):
+            d, i = tree.pquery(points, k=3)
+            assert np.array_equal(i, expected_i) and np.allclose(d, expected_d)
+        # the same workers serve every query
+        assert tree._procs == procs and tree.start()._procs == procs
+    assert tree._procs == [] and not any(proc.is_alive() for proc in procs)
+
+    # a closed pool is restarted by the next query
+    d, i = tree.pquery(points[:100])
+    assert np.array_equal(i, expected_i[:100, 0]) and len(tree._procs) == 2
+    tree.close()
+    d, i = tree.pquery(np.empty((0, 2)))
+    assert d.shape == (0, 1) and i.shape == (0,)
+    tree.close()
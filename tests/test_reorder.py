@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import rvgeocoder as rvg
+from rvgeocoder.ordering import morton_codes, spatial_batch
+
+
+def repeated_points(n, distinct=500):
+    # GPS like traffic: many points repeat exactly
+    points = np.round(np.random.uniform([-90, -180], [90, 180], (distinct, 2)), 4)
+    return points[np.random.randint(0, distinct, n)]
+
+
+def test_spatial_batch():
+    points = repeated_points(5000)
+    batch, restore = spatial_batch(points)
+    assert len(batch) == len(points) and np.array_equal(batch[restore], points)
+    codes = morton_codes(batch)
+    assert np.all(codes[1:] >= codes[:-1])
+
+    batch, restore = spatial_batch(points, dedupe=True)
+    assert np.array_equal(batch[restore], points)
+    assert len(batch) == len(np.unique(points, axis=0))
+
+    # 3 dimensions (ECEF), and the trivial batches
+    xyz = rvg.latlon_in_ecef(points[:, 0], points[:, 1])
+    batch, restore = spatial_batch(xyz, dedupe=True)
+    assert np.array_equal(batch[restore], xyz) and len(batch) == len(np.unique(xyz, axis=0))
+    for n in (0, 1):
+        batch, restore = spatial_batch(points[:n], dedupe=True)
+        assert np.array_equal(batch[restore], points[:n])
+    try:
+        morton_codes(np.zeros((3, 4)))
+        assert False, '4 dimensions'
+    except ValueError:
+        pass
+
+
+@pytest.mark.parametrize('mode', [1, 2, 3])
+def test_reorder_dedupe(gen_data, mode):
+    data = gen_data(5000)
+    points = repeated_points(5000)
+    # nearest locations and distances of plain geocoders, in lat/lon and in ECEF
+    expected = {ecef: rvg.RGeocoderImpl.from_data(data, mode=1, ecef=ecef, verbose=False).query_array(
+        points, return_distance=True) for ecef in (False, True)}
+    for kwargs in ({}, {'reorder': True}, {'dedupe': True}, {'dedupe': True, 'ecef': True}):
+        with rvg.RGeocoderImpl.from_data(data, mode=mode, verbose=False, **kwargs) as rgeo:
+            result = rgeo.query_array(points, return_distance=True)
+            plain = expected[rgeo.ecef]
+            assert np.array_equal(result['index'], plain['index']), kwargs
+            assert np.allclose(result['distance'], plain['distance']), kwargs
+            assert rgeo.query(points[:20]) == [rgeo.locations[n] for n in plain['index'][:20]]
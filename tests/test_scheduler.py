@@ -0,0 +1,27 @@
+import numpy as np
+from rvgeocoder.cKDTree_MP import Scheduler, cKDTree_MP
+
+
+def test_scheduler():
+    chunks = list(Scheduler(100000, 4, min_chunk=1000))
+    assert chunks[0] == slice(0, 12500) and chunks[-1].stop == 100000
+    assert all(a.stop == b.start for a, b in zip(chunks, chunks[1:]))
+    sizes = [chunk.stop - chunk.start for chunk in chunks]
+    # guided: chunks shrink as the work drains, down to min_chunk
+    assert sizes == sorted(sizes, reverse=True) and min(sizes[:-1]) == 1000
+
+    assert [chunk.stop - chunk.start for chunk in Scheduler(10000, 2, min_chunk=1, max_chunk=1000)][:3] == [1000] * 3
+    assert list(Scheduler(10, 8, min_chunk=1000)) == [slice(0, 10)]
+    assert list(Scheduler(0, 8)) == []
+
+
+def test_last_stats():
+    data = np.random.uniform([-60, -180], [70, 180], (20000, 2))
+    points = np.random.uniform([-60, -180], [70, 180], (10000, 2))
+    with cKDTree_MP(data, nprocs=2, min_chunk=100) as tree:
+        tree.pquery(points)
+        stats = tree.last_stats
+        assert stats['points'] == len(points) and stats['chunks'] > 2
+        # every point served by one of the workers, each of them reporting its share
+        assert sum(worker['points'] for worker in stats['workers'].values()) == len(points)
+        assert len(stats['workers']) <= 2 and stats['imbalance'] >= 1.0 and stats['wall'] > 0
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import threading
+import numpy as np
+import rvgeocoder as rvg
+from rvgeocoder.server import GeocoderServer, RGeocoderClient
+
+
+def start_server(rgeo, path):
+    server = GeocoderServer(rgeo, path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_client(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (1000, 2))
+    with tempfile.TemporaryDirectory() as path, \
+            rvg.RGeocoderImpl.from_data(gen_data(admin1='Admin1 é'), mode=3, verbose=False) as rgeo:
+        server = start_server(rgeo, os.path.join(path, 'rvg.sock'))
+        try:
+            with RGeocoderClient(server.path) as client:
+                expected = rgeo.query_array(points, return_distance=True, columns=['name', 'admin1', 'lat'])
+                result = client.query_array(points[:, 0], points[:, 1], return_distance=True,
+                                            columns=['name', 'admin1', 'lat'])
+                assert sorted(result) == sorted(expected)
+                for name, values in expected.items():
+                    assert np.array_equal(result[name], values), name
+                assert client.query(points[:10].tolist()) == rgeo.query(points[:10].tolist())
+                assert client.query_array(points[:0])['index'].shape == (0,)
+                try:
+                    client.query_array(points, columns=['unknown'])
+                    assert False, 'unknown column'
+                except KeyError:
+                    pass
+                # the connection is still usable after an error
+                assert client.query(points[:1]) == rgeo.query(points[:1])
+                assert not client.using_fallback
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def test_fallback(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (100, 2))
+    with tempfile.TemporaryDirectory() as path, \
+            rvg.RGeocoderImpl.from_data(gen_data(1000, admin1='Admin1 é'), mode=1, verbose=False) as rgeo:
+        socket_path = os.path.join(path, 'rvg.sock')
+        with RGeocoderClient(socket_path, fallback=lambda: rgeo) as client:
+            assert client.query(points) == rgeo.query(points)
+            assert client.using_fallback
+
+            server = start_server(rgeo, socket_path)
+            try:
+                client.reconnect()
+                assert client.query(points) == rgeo.query(points)
+                assert not client.using_fallback
+            finally:
+                server.shutdown()
+                server.server_close()
+            try:
+                RGeocoderClient(socket_path).query(points)
+                assert False, 'no server and no fallback'
+            except FileNotFoundError:
+                pass
+
+
+def test_sharded_index(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (500, 2))
+    with tempfile.TemporaryDirectory() as path:
+        rgeo = rvg.RGeocoderImpl.from_data(gen_data(5000, clustered=True), mode=1, verbose=False)
+        rgeo.build_index(os.path.join(path, 'shards'), tile_size=30)
+        with rvg.RGeocoderImpl.from_index(os.path.join(path, 'shards'), mode=3, max_shards=4,
+                                          verbose=False) as sharded:
+            server = start_server(sharded, os.path.join(path, 'rvg.sock'))
+            try:
+                with RGeocoderClient(server.path) as client:
+                    # records hold the source text of the coordinates, gathered shard by shard
+                    assert client.query(points.tolist()) == rgeo.query(points)
+                    result = client.query_array(points[:, 0], points[:, 1], columns=['name', 'lat'])
+                    expected = rgeo.query_array(points, columns=['name', 'lat'])
+                    assert np.array_equal(result['lat'], expected['lat'])
+                    assert np.array_equal(result['name'], expected['name'])
+            finally:
+                server.shutdown()
+                server.server_close()
@@ -0,0 +1,40 @@
+import os
+import pickle
+import tempfile
+import numpy as np
+import rvgeocoder as rvg
+
+
+def query_points(n=5000, tile_size=10):
+    points = np.random.uniform([-90, -180], [90, 180], (n, 2))
+    # points on and next to the tile borders
+    borders = np.random.randint(-4, 4, (n // 5, 2)) * tile_size + np.random.uniform(-0.01, 0.01, (n // 5, 2))
+    return np.vstack([points, borders + [40, 0]])
+
+
+def test_sharded_index(gen_data):
+    points = query_points()
+    with tempfile.TemporaryDirectory() as path:
+        rgeo = rvg.RGeocoderImpl.from_data(gen_data(20000, clustered=True), mode=1, verbose=False)
+        rgeo.build_index(os.path.join(path, 'shards'), tile_size=10)
+        sharded = rvg.RGeocoderImpl.from_index(os.path.join(path, 'shards'), mode=2, max_shards=8, verbose=False)
+        assert sharded.mode == 3 and len(sharded.locations) == len(rgeo.locations)
+
+        expected = rgeo.query_array(points, return_distance=True)
+        result = sharded.query_array(points, return_distance=True)
+        assert np.array_equal(result['distance'], expected['distance'])
+        # same records for the same distances (the index numbering differs)
+        assert sharded.query(points[:200]) == rgeo.query(points[:200])
+        assert len(sharded.tree.resident()) <= 8 and sharded.tree.loads > len(sharded.tree.resident())
+
+        expected, result = rgeo.query_k(points, 5, ['name']), sharded.query_k(points, 5, ['name'])
+        assert np.array_equal(result['distance'], expected['distance'])
+        assert np.array_equal(result['name'], expected['name'])
+
+        expected, result = rgeo.query_radius(points, 3, ['name']), sharded.query_radius(points, 3, ['name'])
+        assert np.array_equal(result['offsets'], expected['offsets'])
+        assert np.array_equal(result['distance'], expected['distance'])
+        assert sorted(result['name']) == sorted(expected['name'])
+
+        restored = pickle.loads(pickle.dumps(sharded))
+        assert restored.query(points[:10]) == rgeo.query(points[:10])
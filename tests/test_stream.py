@@ -0,0 +1,86 @@
+import csv
+import os
+import tempfile
+import numpy as np
+import rvgeocoder as rvg
+from rvgeocoder.__main__ import main
+
+
+def write_points(filename, points, header=None, delimiter=','):
+    with open(filename, 'wt', newline='') as fd:
+        writer = csv.writer(fd, delimiter=delimiter)
+        if header:
+            writer.writerow(header)
+        writer.writerows(['id%d' % n, '%.6f' % lat, '%.6f' % lon] for n, (lat, lon) in enumerate(points))
+
+
+def concat(results):
+    results = list(results)
+    return {name: np.concatenate([result[name] for result in results]) for name in results[0]}
+
+
+def test_search_stream(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (2500, 2))
+    rgeo = rvg.RGeocoderImpl.from_data(gen_data(), mode=1, verbose=False)
+    expected = rgeo.query_array(np.round(points, 6), return_distance=True, columns=['name'])
+    with tempfile.TemporaryDirectory() as path:
+        filename = os.path.join(path, 'points.csv')
+        write_points(filename, points, header=['id', 'lat', 'lon'])
+        chunks = list(rgeo.search_stream(filename, lat_col=1, lon_col=2, header=True, chunk_size=1000,
+                                         return_distance=True, columns=['name']))
+        assert [len(chunk['index']) for chunk in chunks] == [1000, 1000, 500]
+        result = concat(chunks)
+        assert np.array_equal(result['index'], expected['index'])
+        assert np.array_equal(result['name'], expected['name'])
+        assert np.allclose(result['distance'], expected['distance'])
+
+        # query_iter of the same coordinates
+        result = concat(rgeo.query_iter(map(tuple, np.round(points, 6)), chunk_size=700, columns=['name']))
+        assert np.array_equal(result['name'], expected['name'])
+
+
+def test_invalid_rows(gen_data):
+    rgeo = rvg.RGeocoderImpl.from_data(gen_data(1000), mode=1, verbose=False)
+    lines = ['lat,lon', '10.5,20.5', '', '91,0', '"1,5",2', '', '', '45.1,5.2', '45.2', 'x,1', '-10,-20']
+    with tempfile.TemporaryDirectory() as path:
+        filename = os.path.join(path, 'points.csv')
+        with open(filename, 'wt') as fd:
+            fd.write('\n'.join(lines) + '\n')
+        # the line numbers are those of the file, blank lines and header included
+        for chunk_size in (1, 3, 100):
+            try:
+                list(rgeo.search_stream(filename, header=True, chunk_size=chunk_size))
+                assert False, 'invalid coordinates'
+            except ValueError as error:
+                assert 'line 4 ' in str(error)
+                if chunk_size == 100:
+                    assert "line 4 ('91', '0'), line 5 ('1,5', '2'), line 9 ('', ''), line 10 ('x', '1')" \
+                        in str(error)
+
+        result = concat(rgeo.search_stream(filename, header=True, chunk_size=3, skip_invalid=True, columns=['lat']))
+        expected = rgeo.query_array([(10.5, 20.5), (45.1, 5.2), (-10, -20)], columns=['lat'])
+        assert np.array_equal(result['index'], expected['index'])
+
+        # a file of blank and invalid rows only
+        with open(filename, 'wt') as fd:
+            fd.write('\n\n\n1000,0\n\n')
+        assert list(rgeo.search_stream(filename, chunk_size=2, skip_invalid=True)) == []
+
+
+def test_geocode_file(gen_data):
+    points = np.random.uniform([-60, -180], [70, 180], (300, 2))
+    rgeo = rvg.RGeocoderImpl.from_data(gen_data(1000), mode=1, verbose=False)
+    expected = rgeo.query_array(np.round(points, 6), return_distance=True, columns=['name', 'cc'])
+    with tempfile.TemporaryDirectory() as path:
+        rgeo.build_index(os.path.join(path, 'index'))
+        input_file, output_file = os.path.join(path, 'points.tsv'), os.path.join(path, 'geocoded.tsv')
+        write_points(input_file, points, header=['id', 'lat', 'lon'], delimiter='\t')
+        main(['-q', 'geocode', input_file, output_file, '--index', os.path.join(path, 'index'), '--mode', '1',
+              '--header', '--lat-col', '1', '--lon-col', '2', '--columns', 'name', 'cc', '--distance',
+              '--chunk-size', '64'])
+        with open(output_file, newline='') as fd:
+            rows = list(csv.reader(fd, delimiter='\t'))
+        assert rows[0] == ['id', 'lat', 'lon', 'name', 'cc', 'distance'] and len(rows) == len(points) + 1
+        assert [row[0] for row in rows[1:]] == ['id%d' % n for n in range(len(points))]
+        assert [row[3] for row in rows[1:]] == list(expected['name'])
+        assert np.allclose([float(row[5]) for row in rows[1:]], expected['distance'])
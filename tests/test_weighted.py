@@ -0,0 +1,77 @@
+import io
+import numpy as np
+import pytest
+import rvgeocoder as rvg
+
+
+def gen_locations(n=2000):
+    # few big cities and many small places, populations with a heavy tail like GeoNames
+    lats = np.random.uniform(-60, 70, n)
+    lons = np.random.uniform(-180, 180, n)
+    population = (np.random.pareto(1.2, n) * 1000).astype(np.int64)
+    feature_code = np.where(population > 100000, 'PPLA', 'PPL')
+    data = io.StringIO()
+    data.write(','.join(rvg.RG_COLUMNS + rvg.RG_EXTRA_COLUMNS) + '\n')
+    for i in range(n):
+        data.write('%.5f,%.5f,Place %d,Admin1,Admin2,CC,%d,%s\n' % (
+            lats[i], lons[i], i, population[i], feature_code[i]))
+    return data.getvalue()
+
+
+@pytest.mark.parametrize('mode', [1, 2, 3])
+def test_query_weighted(mode):
+    points = np.random.uniform([-60, -180], [70, 180], (500, 2))
+    feature_weights = {'PPLA': 1.5, 'PPLX': 0.5}
+    with rvg.RGeocoderImpl.from_data(gen_locations(), mode=mode, verbose=False) as rgeo:
+        result = rgeo.query_weighted(points, k=5, feature_weights=feature_weights, return_distance=True,
+                                     columns=['name'])
+        # lowest score among the 5 nearest, brute force
+        candidates = rgeo.query_k(points, 5, ['population', 'feature_code'])
+        weights = 1 + np.log1p(candidates['population'].astype(np.float64))
+        weights *= np.vectorize(lambda code: feature_weights.get(code, 1.0))(candidates['feature_code'])
+        best = np.argmin(candidates['distance'] / weights, axis=1)
+        rows = np.arange(len(points))
+        assert np.array_equal(result['index'], candidates['index'][rows, best])
+        assert np.allclose(result['distance'], candidates['distance'][rows, best])
+        assert list(result['name']) == [rgeo.locations[n]['name'] for n in result['index']]
+
+        # without weights, the nearest location
+        result = rgeo.query_weighted(points, k=5, population_weight=0)
+        assert np.array_equal(result['index'], rgeo.query_array(points)['index'])
+
+
+def test_weighted_choice():
+    data = '\n'.join([','.join(rvg.RG_COLUMNS + rvg.RG_EXTRA_COLUMNS),
+                      '45.00000,5.00000,City,Admin1,Admin2,CC,2000000,PPLA',
+                      '45.00000,5.20000,Hamlet,Admin1,Admin2,CC,30,PPL',
+                      '45.00000,4.80000,Capital,Admin1,Admin2,CC,30,PPLC']) + '\n'
+    rgeo = rvg.RGeocoderImpl.from_data(data, mode=1, verbose=False)
+    # the suburbs of the city, closer to the hamlet
+    assert rgeo.query([(45, 5.15)])[0]['name'] == 'Hamlet'
+    assert rgeo.query_weighted([(45, 5.15)], k=3, columns=['name'])['name'][0] == 'City'
+    assert rgeo.query_weighted([(45, 5.15)], k=3, population_weight=0, columns=['name'])['name'][0] == 'Hamlet'
+    # closer to the city, the feature weight of the capital prevails
+    result = rgeo.query_weighted([(45, 4.93)], k=3, population_weight=0, feature_weights={'PPLC': 2.0},
+                                 columns=['name'])
+    assert result['name'][0] == 'Capital'
+    # fewer locations than k, the missing candidates are never picked
+    assert rgeo.query_weighted([(45, 5.15)], k=10, columns=['name'])['name'][0] == 'City'
+
+
+def test_missing_columns(gen_data):
+    rgeo = rvg.RGeocoderImpl.from_data(gen_data(100), mode=1, verbose=False)
+    try:
+        rgeo.query_weighted([(10, 10)])
+        assert False, 'no population column'
+    except ValueError:
+        pass
+    assert len(rgeo.query_weighted([(10, 10)], population_weight=0)['index']) == 1
+
+    data = gen_data(100).replace('cc\n', 'cc,population\n', 1).replace('CC\n', 'CC,100\n')
+    rgeo = rvg.RGeocoderImpl.from_data(data, mode=1, verbose=False)
+    assert len(rgeo.query_weighted([(10, 10)])['index']) == 1
+    try:
+        rgeo.query_weighted([(10, 10)], feature_weights={'PPLA': 1.5})
+        assert False, 'no feature_code column'
+    except ValueError:
+        pass